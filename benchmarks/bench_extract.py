@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of the chord sheet extraction backends.
+
+Usage:
+    python -m benchmarks.bench_extract [--pages "recordings/*.html"] [--repeat 5]
+
+Without recorded pages, synthetic song pages of a few hundred kilobytes are used.
+"""
+import argparse
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from benchmarks.pages import load_pages
+from src.extract import available_backends, extract_tab
+
+
+def full_page_html_parser(page):
+    """Parse the whole page with BeautifulSoup, as parse_chords used to."""
+    soup = BeautifulSoup(page, 'html.parser')
+    body = soup.find('pre', attrs={'class': 'tK8GG Ty_RP'})
+    return [item.get_text().strip() for item in body.find_all('span', attrs={'data-name': True})]
+
+
+def measure(func, pages, repeat):
+    """Return the mean time and the mean peak memory per page of an extraction function."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, page in pages:
+            func(page)
+    elapsed = (time.perf_counter() - start) / (repeat * len(pages))
+    peaks = []
+    for _, page in pages:
+        tracemalloc.start()
+        func(page)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed, sum(peaks) / len(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', help="Glob pattern of recorded song pages.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of passes over the pages (default: 5).")
+    args = parser.parse_args()
+    pages = load_pages(args.pages)
+    size = sum(len(page) for _, page in pages) / len(pages)
+    print(f"{len(pages)} pages, {size / 1024:.0f} KB on average")
+    print(f"{'backend':<24}{'ms/page':>10}{'peak KB/page':>16}")
+    candidates = [('full page (html.parser)', full_page_html_parser)]
+    candidates += [(backend, lambda page, backend=backend: extract_tab(page, backend)) for backend in
+                   available_backends()]
+    for name, func in candidates:
+        elapsed, peak = measure(func, pages, args.repeat)
+        print(f"{name:<24}{elapsed * 1000:>10.2f}{peak / 1024:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
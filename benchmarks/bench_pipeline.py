@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark of the scraping pipeline against local stand-ins of Ultimate Guitar and Spotify.
+
+main.py runs unchanged with the http backend in a temporary working directory, fetching its songs from the fake
+Spotify API and their pages from the local server. The benchmark reports the throughput, the p50/p95 latency of
+every stage, the peak resident memory and whether the stored progressions match the generated songs, and writes
+them to a JSON file so runs of different commits can be compared.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--songs 500] [--workers 16] [--latency 20] [--output bench.json]
+"""
+import argparse
+import contextlib
+import functools
+import glob
+import inspect
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from unittest import mock
+import numpy as np
+import spotipy
+from benchmarks.pages import make_catalog
+from benchmarks.server import start_server
+from src import http_fetch, spotify_api
+from src.key_estimation import KEY_SOURCES
+from src.metrics import registry
+from src.rate_limit import RateLimiter
+from src.storage import SongDatabase
+from src.web_scraper import parse_chords
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENRE = 'rock'
+# Stages timed in the http backend, as (module, function, stage)
+STAGES = [(http_fetch, 'scrape_song_http', 'song'), (http_fetch, 'search_song_http', 'search'),
+          (http_fetch, 'get_tab_http', 'tab'), (http_fetch, 'transposer', 'transpose'),
+          (http_fetch, 'parse_chords', 'parse'), (http_fetch, 'store_songs', 'store'),
+          (spotify_api, 'search_page', 'spotify')]
+
+
+def timed(durations, func):
+    """Wrap a function or coroutine function so the duration of every call is appended to a list."""
+    if inspect.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+    return functools.wraps(func)(wrapper)
+
+
+def summarize(durations):
+    """Return the number of calls and the p50, p95 and mean durations in milliseconds."""
+    values = np.array(durations) * 1000
+    return {'count': len(values), 'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p95_ms': round(float(np.percentile(values, 95)), 3), 'mean_ms': round(float(values.mean()), 3)}
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of the process in megabytes, or None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    """Return the commit the benchmark runs on, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_mismatches(catalog):
+    """Count the generated songs whose stored progression differs from the one expected."""
+    expected = {(song['song_name'], song['artist']): parse_chords(song['expected']) for song in catalog
+                if song['found']}
+    database = SongDatabase()
+    stored = {(song['song_name'], song['artist']): song['progression'] for song in database.iter_songs(GENRE)}
+    database.close()
+    return sum(stored.get(song) != [tuple(sequence) for sequence in progression]
+               for song, progression in expected.items())
+
+
+def run_pipeline(args, base_url, stages):
+    """Run main.py once in the current working directory against the stand-ins."""
+    # Imported here, once the working directory holds the log directory main.py logs to
+    import main as pipeline
+
+    def spotify_client():
+        client = spotipy.Spotify(auth='benchmark', status_retries=0)
+        client.prefix = f'{base_url}/v1/'
+        return client
+
+    def user_preference(audio_features=True):
+        songs = spotify_api.save_songs(spotify_api.stream_songs(GENRE, args.songs, 2010, 2020, audio_features), GENRE)
+        return {'songs': songs, 'genre': GENRE, 'delay': 0}
+
+    argv = ['main.py', '--backend', 'http', '--workers', str(args.workers), '--no-cache', '--base-url', base_url,
+            '--key-source', args.key_source]
+    if args.metrics:
+        argv.append('--metrics')
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(sys, 'argv', argv))
+        stack.enter_context(mock.patch.object(spotify_api, 'get_spotify_client', spotify_client))
+        stack.enter_context(mock.patch.object(pipeline, 'get_user_preference', user_preference))
+        if args.max_rate:
+            stack.enter_context(mock.patch.object(pipeline.RateLimiter, 'from_delay',
+                                                  lambda delay: RateLimiter(args.max_rate, rate=args.max_rate)))
+        for module, name, stage in STAGES:
+            stack.enter_context(mock.patch.object(module, name, timed(stages[stage], getattr(module, name))))
+        start = time.perf_counter()
+        pipeline.main()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=500, help="Number of songs fetched from Spotify (default: 500).")
+    parser.add_argument('--workers', type=int, default=16, help="Concurrent requests (default: 16).")
+    parser.add_argument('--latency', type=float, default=20,
+                        help="Delay added to every response of the stand-ins in milliseconds (default: 20).")
+    parser.add_argument('--max-rate', type=float, default=1000,
+                        help="Requests per second allowed by the rate limiter, 0 to keep main.py's limit "
+                             "(default: 1000).")
+    parser.add_argument('--pages', help="Glob pattern of recorded song pages served instead of generated ones.")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Run main.py with --metrics, to measure the cost of the instrumentation and include its "
+                             "metrics in the results.")
+    parser.add_argument('--key-source', choices=KEY_SOURCES, default='spotify',
+                        help="Run main.py with --key-source; mismatches then count the songs whose estimated key "
+                             "transposes them differently from Spotify's (default: spotify).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generated songs (default: 0).")
+    parser.add_argument('--output', default='bench_pipeline.json',
+                        help="JSON file the results are written to (default: bench_pipeline.json).")
+    args = parser.parse_args()
+    recorded = []
+    for path in sorted(glob.glob(args.pages)) if args.pages else []:
+        with open(path, mode='r', encoding='utf-8') as file:
+            recorded.append((os.path.basename(path), file.read()))
+    catalog = make_catalog(args.songs, args.seed)
+    server, base_url = start_server(args.songs, args.seed, recorded, args.latency / 1000)
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    # main.py reads and writes relative to the working directory, so run it in a scratch copy of the layout
+    workdir = tempfile.mkdtemp(prefix='chordcrawler-bench-')
+    shutil.copytree(os.path.join(ROOT, 'config'), os.path.join(workdir, 'config'))
+    for directory in ('data', 'output', 'log'):
+        os.makedirs(os.path.join(workdir, directory))
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    stages = defaultdict(list)
+    try:
+        os.chdir(workdir)
+        elapsed = run_pipeline(args, base_url, stages)
+        metrics = registry.snapshot() if args.metrics else None
+        registry.disable()
+        # Recorded pages don't hold the generated songs, so there is nothing to compare them with
+        mismatches = None if recorded else count_mismatches(catalog)
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+    songs = len(stages['song'])
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'parameters': {'songs': args.songs, 'workers': args.workers, 'latency_ms': args.latency,
+                       'max_rate': args.max_rate, 'recorded_pages': len(recorded), 'seed': args.seed,
+                       'key_source': args.key_source},
+        'elapsed_s': round(elapsed, 3),
+        'songs_scraped': songs,
+        'songs_per_s': round(songs / elapsed, 2) if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'mismatches': mismatches,
+        'stages': {stage: summarize(durations) for stage, durations in stages.items() if durations},
+        'metrics': metrics
+    }
+    with open(output, mode='w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"{songs} songs in {elapsed:.2f}s, {results['songs_per_s']} songs/s, peak RSS {results['peak_rss_mb']} MB")
+    print(f"{'stage':<12}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, summary in results['stages'].items():
+        print(f"{stage:<12}{summary['count']:>8}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}")
+    if mismatches:
+        print(f"{mismatches} songs were not stored as expected!")
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import glob
+import html
+import json
+import os
+import random
+import re
+
+CHORD_SHAPES = ["C", "G", "Am", "F", "Em", "Dm", "D", "E", "A", "Bb", "G/B", "Cmaj7", "Am7", "Fsus2", "E7"]
+# Spelled like the pipeline spells transposed chords, but kept separate so the benchmark checks the pipeline
+# against its own transposition rather than against itself
+NOTES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+SHAPE_PATTERN = re.compile(r'^([A-G]b?)([^/]*)(?:/([A-G]b?))?$')
+
+
+def store_div(data):
+    """Render the js-store element Ultimate Guitar embeds in its pages."""
+    content = html.escape(json.dumps({'store': {'page': {'data': data}}}), quote=True)
+    return f'<div class="js-store" data-content="{content}"></div>'
+
+
+def make_song_page(chords, capo=0, padding_kb=300):
+    """
+    Build a song page shaped like an Ultimate Guitar chord sheet.
+
+    Parameters:
+    - chords (list): List of chord names of the song.
+    - capo (int): Fret of the capo.
+    - padding_kb (int): Approximate size of the markup surrounding the chord sheet, in kilobytes.
+
+    Returns:
+    - str: HTML of the song page.
+    """
+    lines = []
+    for start in range(0, len(chords), 4):
+        lines.append(' '.join(f'<span class="fciXY _Oy28" data-name="{chord}">{chord}</span>'
+                              for chord in chords[start:start + 4]))
+        lines.append('<span class="y68er">Some lyrics of the song go here</span>')
+    capo_text = f"{capo}{'st' if capo == 1 else 'nd' if capo == 2 else 'rd' if capo == 3 else 'th'} fret" \
+        if capo else 'no capo'
+    content = ''.join(f'[ch]{chord}[/ch] ' for chord in chords)
+    filler = '<div class="aEuTB"><a href="/tab/other">Other tab</a><span>Related content</span></div>\n'
+    padding = filler * (padding_kb * 1024 // len(filler))
+    return (f'<html><head><title>Song chords</title></head><body>{padding}'
+            f'<table><tr><th>Capo: </th><td><span>{capo_text}</span></td></tr></table>'
+            f'<pre class="tK8GG Ty_RP">{chr(10).join(lines)}</pre>{padding}'
+            + store_div({'tab_view': {'wiki_tab': {'content': content}, 'meta': {'capo': capo}}})
+            + '</body></html>')
+
+
+def make_search_page(results):
+    """
+    Build a chord search results page shaped like Ultimate Guitar's.
+
+    Parameters:
+    - results (list): Search results with type, votes and tab_url.
+
+    Returns:
+    - str: HTML of the search page.
+    """
+    if not results:
+        return '<html><body><h2>Nothing found for this search</h2>' + store_div({'results': []}) + '</body></html>'
+    rows = ''.join(f'<div class="LQUZJ"><div class="lIKMM PdXKy">{result["type"]}</div>'
+                   f'<div class="djFV9">{result["votes"]:,}</div>'
+                   f'<a class="HT3w5 lBssT" href="{result["tab_url"]}">Song</a></div>' for result in results)
+    return f'<html><body>{rows}' + store_div({'results': results}) + '</body></html>'
+
+
+def random_song(rng, length=120):
+    """Generate the chords of a song from a few repeating progressions."""
+    progressions = [rng.sample(CHORD_SHAPES, 4) for _ in range(3)]
+    chords = []
+    while len(chords) < length:
+        chords.extend(rng.choice(progressions))
+    return chords[:length]
+
+
+def shift_shape(chord, semitones):
+    """Shift a chord of CHORD_SHAPES, or a shift of one, by a number of semitones."""
+    root, suffix, bass = SHAPE_PATTERN.match(chord).groups()
+    shifted = NOTES[(NOTES.index(root) + semitones) % 12] + suffix
+    return shifted + '/' + NOTES[(NOTES.index(bass) + semitones) % 12] if bass else shifted
+
+
+def written_offset(key, mode, capo):
+    """
+    Return the number of semitones between chords in C and the chord shapes a song is written in.
+
+    The chords of a major song are written in its key and those of a minor song in its relative major, three
+    semitones up, and a capo on fret n lets the shapes sit n semitones below the key that sounds.
+    """
+    tonic = key if mode == 1 else key + 3
+    return (tonic - capo) % 12
+
+
+def load_pages(pattern, count=20, seed=0):
+    """
+    Load recorded song pages, or generate synthetic ones when none match.
+
+    Parameters:
+    - pattern (str): Glob pattern of recorded HTML pages.
+    - count (int): Number of synthetic pages to generate when no recorded pages are found.
+    - seed (int): Seed of the synthetic pages.
+
+    Returns:
+    - list: List of (name, HTML) tuples.
+    """
+    paths = sorted(glob.glob(pattern)) if pattern else []
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path, mode='r', encoding='utf-8') as file:
+                pages.append((os.path.basename(path), file.read()))
+        return pages
+    rng = random.Random(seed)
+    return [(f'synthetic-{i}', make_song_page(random_song(rng), rng.randint(0, 5))) for i in range(count)]
+
+
+def make_catalog(count, seed=0, missing=0.1):
+    """
+    Generate the songs served by the benchmark stand-ins of Spotify and Ultimate Guitar.
+
+    Every song has Spotify's key and mode, chords in C written on its page in the song's key and relative to its
+    capo, and the chords expected once the pipeline has transposed them back to C. The written chords are
+    derived without the pipeline's transposition, see written_offset.
+
+    Parameters:
+    - count (int): Number of songs.
+    - seed (int): Seed of the catalog, so the server and the benchmark generate the same songs.
+    - missing (float): Share of the songs without a chord sheet.
+
+    Returns:
+    - list: List of song dictionaries with id, song_name, artist, key, mode, capo, year, chords, expected and
+      found.
+    """
+    rng = random.Random(seed)
+    catalog = []
+    for index in range(count):
+        key, mode, capo = rng.randrange(12), rng.randint(0, 1), rng.choice([0, 0, 0, 1, 2, 3, 5])
+        chords = random_song(rng, rng.randint(60, 200))
+        offset = written_offset(key, mode, capo)
+        catalog.append({'id': f'track{index:06d}', 'song_name': f'Song {index}', 'artist': f'Artist {index % 97}',
+                        'key': key, 'mode': mode, 'capo': capo, 'year': 2010 + index % 11,
+                        'chords': [shift_shape(chord, offset) for chord in chords], 'expected': chords,
+                        'found': rng.random() >= missing})
+    return catalog
@@ -0,0 +1,112 @@
+"""
+Local stand-ins of Ultimate Guitar and the Spotify Web API for the pipeline benchmark.
+
+Search and song pages are rendered from a generated catalog, or replayed from recorded song pages, and the
+Spotify endpoints used by src/spotify_api.py answer from the same catalog. The server runs in its own process
+so it doesn't take CPU time or memory from the measured pipeline.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import re
+from aiohttp import web
+from benchmarks.pages import make_catalog, make_search_page, make_song_page
+
+TAB_PATH_PATTERN = re.compile(r'^/tab/(\d+)$')
+
+
+def create_app(catalog, recorded_pages=(), latency=0.0):
+    """
+    Build the stand-in application.
+
+    Parameters:
+    - catalog (list): Songs from make_catalog.
+    - recorded_pages (list): Optional (name, HTML) tuples of recorded song pages, served in turn instead of the
+      generated song pages.
+    - latency (float): Delay added to every response in seconds, to mimic the network.
+
+    Returns:
+    - aiohttp.web.Application: Application serving /search.php, /tab/(index) and /v1/.
+    """
+    songs = {f"{song['artist']} {song['song_name']}".lower(): index for index, song in enumerate(catalog)}
+    features = {song['id']: {'id': song['id'], 'key': song['key'], 'mode': song['mode']} for song in catalog}
+    recorded = itertools.cycle([page for _, page in recorded_pages]) if recorded_pages else None
+
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def search(request):
+        await delay()
+        index = songs.get(request.query.get('value', '').lower())
+        results = []
+        if index is not None and catalog[index]['found']:
+            # A popular community sheet, a less rated one and an official version the pipeline must skip
+            results = [{'type': 'Chords', 'votes': 10, 'tab_url': f'/tab/{index}?version=2'},
+                       {'type': 'Chords', 'votes': 1200, 'tab_url': f'/tab/{index}'},
+                       {'type': 'Chords', 'votes': 5000, 'tab_url': f'/tab/{index}', 'marketing_type': 'TabPro'}]
+        return web.Response(text=make_search_page(results), content_type='text/html')
+
+    async def tab(request):
+        await delay()
+        match = TAB_PATH_PATTERN.match(request.path)
+        index = int(match.group(1)) if match else len(catalog)
+        if index >= len(catalog) or not catalog[index]['found']:
+            raise web.HTTPNotFound()
+        song = catalog[index]
+        page = next(recorded) if recorded else make_song_page(song['chords'], song['capo'], padding_kb=100)
+        return web.Response(text=page, content_type='text/html')
+
+    async def spotify_search(request):
+        await delay()
+        offset, limit = int(request.query.get('offset', 0)), int(request.query.get('limit', 20))
+        items = [{'id': song['id'], 'name': song['song_name'], 'artists': [{'name': song['artist']}],
+                  'album': {'release_date': f"{song['year']}-01-01"}}
+                 for song in catalog[offset:offset + limit]]
+        return web.json_response({'tracks': {'items': items, 'total': len(catalog), 'offset': offset}})
+
+    async def audio_features(request):
+        await delay()
+        ids = request.query.get('ids', '').split(',')
+        return web.json_response({'audio_features': [features.get(track_id) for track_id in ids]})
+
+    app = web.Application()
+    app.router.add_get('/search.php', search)
+    app.router.add_get('/tab/{index}', tab)
+    app.router.add_get('/v1/search', spotify_search)
+    app.router.add_get('/v1/audio-features', audio_features)
+    app.router.add_get('/v1/audio-features/', audio_features)
+    return app
+
+
+def serve(connection, count, seed, recorded_pages, latency):
+    """Run the stand-ins on a free local port, sending the port back over a pipe."""
+    async def run():
+        runner = web.AppRunner(create_app(make_catalog(count, seed), recorded_pages, latency), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        connection.send(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def start_server(count, seed=0, recorded_pages=(), latency=0.0):
+    """
+    Start the stand-ins in a separate process.
+
+    Parameters:
+    - count (int): Number of songs of the catalog.
+    - seed (int): Seed of the catalog.
+    - recorded_pages (list): Optional recorded song pages, see create_app.
+    - latency (float): Delay added to every response in seconds.
+
+    Returns:
+    - tuple: Server process, to be terminated when done, and base URL of the server.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=serve, args=(sender, count, seed, list(recorded_pages), latency),
+                                      daemon=True)
+    process.start()
+    return process, f'http://127.0.0.1:{receiver.recv()}'
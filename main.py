@@ -1,12 +1,55 @@
+import argparse
 import logging
-import time
-from tqdm import tqdm
-from src.standardize import transposer
-from src.utilities import create_driver, write_csv, get_existing_songs, get_user_preference
-from src.web_scraper import search_song, parse_chords
+from src.analytics import refresh_stats
+from src.archive import ChordArchive
+from src.cache import PageCache
+from src.corpus import export_corpus
+from src.crawl import crawl
+from src.journal import CrawlJournal
+from src.key_estimation import KEY_SOURCES
+from src.metrics import MetricsExporter, registry
+from src.progression_index import ProgressionIndex
+from src.rate_limit import RateLimiter, get_host
+from src.storage import SongDatabase
+from src.utilities import get_user_preference
+from src.web_scraper import BASE_URL
 
 logging.basicConfig(filename='log/scraping.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+                    format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+
+
+def parse_args():
+    """
+    Parse the command line arguments of ChordCrawler.
+
+    Returns:
+    - argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Scrape chord progressions from Ultimate Guitar.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of headless browsers, or concurrent requests with the http backend, "
+                             "scraping songs in parallel (default: 1).")
+    parser.add_argument('--backend', choices=['selenium', 'http'], default='selenium',
+                        help="Fetch pages with headless Chrome, or over plain HTTP with Chrome only as a fallback "
+                             "for pages that need JavaScript (default: selenium).")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always fetch search and song pages from the site instead of the page cache.")
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help="Scheme and host of the site the pages are fetched from, e.g. a local server replaying "
+                             "recorded pages (default: %(default)s).")
+    parser.add_argument('--key-source', choices=KEY_SOURCES, default='spotify',
+                        help="Transpose songs from Spotify's key, from the key estimated from their chords without "
+                             "requesting audio features, or from the estimate when it is confident (auto). Keys "
+                             "are always estimated for songs Spotify has none for (default: spotify).")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Time every stage and count song outcomes, exporting them to output/metrics.json and "
+                             "the Prometheus textfile output/metrics.prom.")
+    parser.add_argument('--metrics-interval', type=float, default=30,
+                        help="Seconds between two exports of the metrics during a run (default: 30).")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer.")
+    return args
 
 
 def main():
@@ -14,74 +57,76 @@ def main():
     Main function to orchestrate the process of scraping song data.
 
     The function performs the following steps:
-    1. Prompt the user for a genre and delay, then validates each input.
-    2. Optionally fetch new songs from Spotify based on the genre.
-    3. Initialize a Selenium WebDriver.
-    4. Iterate over the songs, searching for each song on Ultimate Guitar.
-    5. Transpose the song to C Major and parse its chords into roman numeral notation.
-    6. Save the song data to a CSV file.
-    7. Handle exceptions and log errors or information as needed.
-    8. Close the WebDriver upon completion.
+    1. Prompt the user for a genre and the minimum delay between requests, then validates each input.
+    2. Optionally fetch new songs from Spotify based on the genre, streaming them page by page into the crawl.
+    3. Skip the songs that already exist in the song database, and the songs the crawl journal marks as not
+       found or waiting for a retry, as they stream in.
+    4. Create the rate limiter shared by the workers and open the page cache of previously fetched pages.
+    5. Start a pool of Selenium WebDriver workers fed from a bounded song queue, or fetch the pages over plain
+       HTTP with the http backend, so the song stream is only read as fast as songs are scraped.
+    6. Each worker searches for its songs on Ultimate Guitar, reads the song page once, transposes its chords
+       to C Major locally from Spotify's key or the key estimated from its chords, and parses them into roman
+       numeral notation.
+    7. Save the song data to the song database from a single writer, and export it to a CSV file and a columnar
+       corpus.
+    8. Handle exceptions and log errors or information as needed, and export the timing metrics when enabled.
+    9. Close the WebDrivers upon completion.
 
     Note: The function uses various helper functions from other modules to perform specific tasks.
     """
+    args = parse_args()
+    exporter = None
+    if args.metrics:
+        registry.enable()
+        exporter = MetricsExporter(args.metrics_interval).start()
     # Fetch songs from Spotify based on genre
-    preference = get_user_preference()
+    preference = get_user_preference(audio_features=args.key_source != 'chords')
     songs = preference["songs"]
     genre = preference["genre"]
     delay = preference["delay"]
 
-    # Get existing songs from (genre)_database.csv
-    existing_songs = get_existing_songs(genre)
-    # Initialize the WebDriver
-    driver = create_driver()
+    # Keep the progression index up to date with the songs that are added, and archive their raw chords
+    database = SongDatabase(index=ProgressionIndex(), archive=ChordArchive())
+    # Move songs saved by earlier versions from (genre)_database.csv into the database
+    if not database.count_songs(genre):
+        imported = database.import_csv(genre)
+        if imported:
+            logging.info(f"Imported {imported} songs from 'output/{genre}_database.csv'.")
+    # Resume from the crawl journal, skipping songs that are not found or waiting for a retry
+    journal = CrawlJournal()
+    # Adapt the request rate to the site, never exceeding one request per delay
+    limiter = RateLimiter.from_delay(delay)
+    # Reuse the search and song pages fetched by earlier runs
+    cache = None if args.no_cache else PageCache()
     try:
-        for song in tqdm(songs, desc=f"Scraping {genre} songs", unit="song"):
-            # Get song data from spotify_songs_(genre).csv
-            song_name = song['song_name']
-            artist = song['artist']
-            # Skip the song if it already exists in (genre)_database.csv
-            if (song_name, artist) in existing_songs:
-                logging.info(f"Song '{song_name}' by {artist} already exists in 'data/{genre}_database.csv'.")
-                continue
-            key = int(song['key'])
-            mode = int(song['mode'])
-            try:
-                # Search for the song on Ultimate Guitar
-                song_found = search_song(driver, song_name, artist)
-                if not song_found:
-                    logging.info(f"Song '{song_name}' by {artist} not available on Ultimate Guitar!")
-                    continue
-                # Wait set time before transposing/parsing the song
-                time.sleep(delay)
-                # Transpose the song to C Major
-                transposed = transposer(driver, key, mode)
-                if not transposed:
-                    logging.error(f"Song '{song_name}' by {artist} could not be transposed!")
-                    continue
-                # Parse chords from the song
-                progression = parse_chords(driver)
-                song_data = {
-                    'song_name': song_name,
-                    'artist': artist,
-                    'key': key,
-                    'mode': mode,
-                    'progression': progression
-                }
-                # Write song data to (genre)_database.csv
-                write_csv(song_data, genre)
-                existing_songs.add((song_name, artist))
-                logging.info(f"Song '{song_name}' by {artist} has been saved to 'data/{genre}_database.csv'.")
-                # Wait set time before scraping the next song
-                time.sleep(delay)
-            except Exception as e:
-                logging.error(f"Error processing song '{song_name}' by {artist}: {e}")
+        # Scrape the songs that are not stored yet
+        crawl(songs, database, genre, limiter, journal, cache, args.backend, args.workers, args.base_url,
+              args.key_source)
     except KeyboardInterrupt:
         logging.info("Keyboard interrupt detected!")
     finally:
-        # Close the WebDriver
+        try:
+            # Keep (genre)_database.csv as an export of the database, a memory-mappable corpus for analysis and
+            # the cached progression analytics; a failed export must not keep the stores from being closed
+            exports = [("CSV export", SongDatabase.export_csv), ("Corpus export", export_corpus),
+                       ("Analytics refresh", refresh_stats)]
+            for name, export in exports:
+                try:
+                    export(database, genre)
+                except Exception as e:
+                    logging.error(f"{name} of the {genre} songs failed: {e}")
+        finally:
+            database.close()
+            logging.info(f"Crawl journal: {journal.summary(genre)}")
+            logging.info(f"Rate limit: {limiter.state(get_host(args.base_url))}")
+            journal.close()
+            if cache:
+                logging.info(f"Page cache: {cache.stats()}")
+                cache.close()
+            if exporter:
+                exporter.stop()
+                logging.info(f"Metrics: {registry.snapshot()['counters']}")
         logging.info("All songs have been scraped!")
-        driver.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,388 @@
+"""
+Analytics of the stored Roman numeral progressions of a genre: chord frequencies, transition matrices, n-gram
+frequency tables and top progressions, per release year and across genres.
+
+N-gram counts are cached in output/analytics/(genre) and refreshed from the song database incrementally, so
+only the songs added since the last refresh are counted:
+
+    python -m src.analytics top rock --n 4 --k 10           # most frequent progressions of four chords
+    python -m src.analytics transitions rock --year 2015    # chord transition probabilities
+    python -m src.analytics years rock --n 1                # chord frequencies per release year
+    python -m src.analytics compare rock pop --n 4          # progression frequencies across genres
+"""
+import argparse
+import json
+import os
+import numpy as np
+from src.metrics import timed
+from src.ngrams import ChordVocabulary, corpus_ngrams, first_occurrences
+from src.web_scraper import WINDOW_SIZE
+
+ANALYTICS_DIR = 'output/analytics'
+# Year of the songs whose release year is unknown
+UNKNOWN_YEAR = 0
+NGRAM_SIZES = range(1, WINDOW_SIZE + 1)
+# Caches written with other counting rules are counted again
+CACHE_VERSION = 2
+
+
+def encode_songs(songs, vocabulary):
+    """
+    Encode the stored progressions of songs as arrays of chord ids.
+
+    Parameters:
+    - songs (iterable): Song data dictionaries with id, year and progression, as SongDatabase.iter_songs.
+    - vocabulary (ChordVocabulary): Vocabulary the chords are encoded with, extended with new chords.
+
+    Returns:
+    - tuple: List of arrays of chord ids, one per progression, the index of the song of every progression, the
+      release year of every song, and the largest song id.
+    """
+    progressions, owners, years = [], [], []
+    last_id = 0
+    for song in songs:
+        for sequence in song['progression']:
+            progressions.append(vocabulary.encode(sequence))
+            owners.append(len(years))
+        years.append(song.get('year') or UNKNOWN_YEAR)
+        last_id = max(last_id, song['id'])
+    return progressions, np.array(owners, dtype=np.int64), np.array(years, dtype=np.int32), last_id
+
+
+def count_ngrams(progressions, owners, years, vocabulary_size):
+    """
+    Count the songs every n-gram of every size occurs in, per release year.
+
+    Stored progressions are overlapping windows of a song, so an n-gram shorter than a window may occur in
+    several of them; every n-gram is counted once per song rather than once per window.
+
+    Parameters:
+    - progressions (list): List of arrays of chord ids, one per progression.
+    - owners (numpy.ndarray): Index of the song of every progression.
+    - years (numpy.ndarray): Release year of every song.
+    - vocabulary_size (int): Number of distinct chord ids.
+
+    Returns:
+    - dict: Dictionary mapping every n-gram size to a tuple of the (number of distinct rows, n + 1) array of
+      release year and chord ids, and the count of every row.
+    """
+    tables = {}
+    windows = corpus_ngrams(progressions, NGRAM_SIZES, vocabulary_size, unique=False, filtered=False)
+    for n, (progression_index, grams) in windows.items():
+        songs = owners[progression_index]
+        if len(grams):
+            indexes = first_occurrences(songs, *grams.T)
+            songs, grams = songs[indexes], grams[indexes]
+        rows = np.column_stack([years[songs], grams]).astype(np.int32)
+        tables[n] = aggregate(rows, np.ones(len(rows), dtype=np.int64))
+    return tables
+
+
+def aggregate(rows, counts):
+    """
+    Sum the counts of identical rows.
+
+    Parameters:
+    - rows (numpy.ndarray): Array of shape (number of rows, width).
+    - counts (numpy.ndarray): Count of every row.
+
+    Returns:
+    - tuple: Distinct rows, sorted, and their summed counts.
+    """
+    if not len(rows):
+        return rows, counts.astype(np.int64)
+    unique, inverse = np.unique(rows, axis=0, return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=counts, minlength=len(unique)).astype(np.int64)
+
+
+class GenreStats:
+    """
+    N-gram counts of the stored progressions of a genre per release year, cached on disk.
+
+    Counts are numbers of songs: a stored progression is one of the overlapping windows of a song, so counting
+    windows would count a chord or transition up to WINDOW_SIZE - 1 times for a single occurrence. Counts only
+    grow as songs are added, so refresh counts the songs added since the last refresh and adds them to the
+    cached counts instead of counting the whole genre again. Chord frequencies and transition matrices are the
+    counts of unigrams and bigrams.
+    """
+
+    def __init__(self, genre, directory=ANALYTICS_DIR):
+        self.genre = genre
+        self.directory = os.path.join(directory, genre)
+        self.clear()
+        self._load()
+
+    def clear(self):
+        """Forget the counted songs."""
+        self.vocabulary = ChordVocabulary()
+        self.database = None
+        self.num_songs = 0
+        self.last_id = 0
+        self.tables = {n: (np.empty((0, n + 1), dtype=np.int32), np.empty(0, dtype=np.int64)) for n in NGRAM_SIZES}
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, 'stats.json'), mode='r', encoding='utf-8') as file:
+                metadata = json.load(file)
+            if metadata.get('version') != CACHE_VERSION:
+                return
+            with np.load(os.path.join(self.directory, 'stats.npz')) as arrays:
+                self.tables = {n: (arrays[f'rows_{n}'], arrays[f'counts_{n}']) for n in NGRAM_SIZES}
+        except (FileNotFoundError, KeyError):
+            return
+        self.vocabulary = ChordVocabulary(metadata['vocabulary'])
+        self.database = metadata.get('database')
+        self.num_songs = metadata['songs']
+        self.last_id = metadata['last_id']
+
+    def save(self):
+        """Write the counts to the cache, replacing the files atomically."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, 'stats.npz')
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, **{f'{name}_{n}': array for n, table in self.tables.items()
+                              for name, array in zip(('rows', 'counts'), table)})
+        os.replace(path + '.tmp', path)
+        path = os.path.join(self.directory, 'stats.json')
+        with open(path + '.tmp', mode='w', encoding='utf-8') as file:
+            json.dump({'version': CACHE_VERSION, 'genre': self.genre, 'database': self.database,
+                       'songs': self.num_songs, 'last_id': self.last_id, 'vocabulary': self.vocabulary.symbols},
+                      file, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    @timed('analytics')
+    def refresh(self, database):
+        """
+        Count the songs added to the database since the last refresh.
+
+        The counts are recomputed from scratch if they were counted from another database, e.g. a merged batch
+        database or a reanalysis, or if the database holds fewer songs than were counted, e.g. after it was
+        rebuilt.
+
+        Parameters:
+        - database (SongDatabase): Database the songs are stored in.
+
+        Returns:
+        - int: Number of songs counted.
+        """
+        path = os.path.abspath(database.filename)
+        if path != self.database or database.count_songs(self.genre) < self.num_songs:
+            self.clear()
+            self.database = path
+        progressions, owners, years, last_id = encode_songs(
+            database.iter_songs(self.genre, after=self.last_id), self.vocabulary)
+        num_songs = len(years)
+        if not num_songs:
+            return 0
+        tables = count_ngrams(progressions, owners, years, len(self.vocabulary))
+        for n, (rows, counts) in tables.items():
+            cached_rows, cached_counts = self.tables[n]
+            self.tables[n] = aggregate(np.concatenate([cached_rows, rows]), np.concatenate([cached_counts, counts]))
+        self.num_songs += num_songs
+        self.last_id = max(self.last_id, last_id)
+        self.save()
+        return num_songs
+
+    def years(self):
+        """Return the release years of the counted songs, UNKNOWN_YEAR for songs without one."""
+        return np.unique(self.tables[1][0][:, 0]).tolist()
+
+    def table(self, n, year=None):
+        """
+        Return the n-gram frequency table of a year, or of all years.
+
+        Parameters:
+        - n (int): Number of chords of the n-grams, from 1 to WINDOW_SIZE.
+        - year (int): Release year, or None for all years.
+
+        Returns:
+        - tuple: Array of shape (number of n-grams, n) of chord ids and the count of every n-gram.
+        """
+        rows, counts = self.tables[n]
+        if year is not None:
+            selected = rows[:, 0] == year
+            return rows[selected, 1:], counts[selected]
+        return aggregate(rows[:, 1:], counts)
+
+    def top(self, n=WINDOW_SIZE, k=10, year=None):
+        """
+        Return the most frequent n-grams, e.g. the most frequent progressions for n = WINDOW_SIZE.
+
+        Parameters:
+        - n (int): Number of chords of the n-grams.
+        - k (int): Number of n-grams to return.
+        - year (int): Release year, or None for all years.
+
+        Returns:
+        - list: List of (tuple of Roman numeral chords, count) tuples, most frequent first.
+        """
+        grams, counts = self.table(n, year)
+        order = np.argsort(-counts, kind='stable')[:k]
+        return [(self.vocabulary.decode(grams[index]), int(counts[index])) for index in order]
+
+    def chord_frequencies(self, year=None):
+        """
+        Count every chord of the vocabulary.
+
+        Parameters:
+        - year (int): Release year, or None for all years.
+
+        Returns:
+        - numpy.ndarray: Count of every chord id.
+        """
+        grams, counts = self.table(1, year)
+        return np.bincount(grams[:, 0], weights=counts, minlength=len(self.vocabulary)).astype(np.int64)
+
+    def transition_matrix(self, year=None, normalize=True):
+        """
+        Count the songs in which every chord follows every other chord.
+
+        Parameters:
+        - year (int): Release year, or None for all years.
+        - normalize (bool): Divide every row by its sum, giving the probability of the next chord.
+
+        Returns:
+        - numpy.ndarray: Array of shape (vocabulary size, vocabulary size), rows being the current chord.
+        """
+        size = len(self.vocabulary)
+        grams, counts = self.table(2, year)
+        matrix = np.bincount(grams[:, 0].astype(np.int64) * size + grams[:, 1], weights=counts,
+                             minlength=size * size).reshape(size, size).astype(float)
+        if not normalize:
+            return matrix.astype(np.int64)
+        totals = matrix.sum(axis=1, keepdims=True)
+        return np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+
+    def by_year(self, n=1, k=10):
+        """
+        Compare the relative frequencies of the most frequent n-grams across release years.
+
+        Parameters:
+        - n (int): Number of chords of the n-grams.
+        - k (int): Number of n-grams to compare, the most frequent over all years.
+
+        Returns:
+        - tuple: List of years, list of n-grams, and array of shape (years, n-grams) of the share of every
+          n-gram among the n-grams of its year.
+        """
+        rows, counts = self.tables[n]
+        grams, gram_index = np.unique(rows[:, 1:], axis=0, return_inverse=True)
+        years, year_index = np.unique(rows[:, 0], return_inverse=True)
+        gram_index, year_index = gram_index.ravel(), year_index.ravel()
+        # Pivot the counts into a years by n-grams matrix in one pass
+        matrix = np.bincount(year_index * len(grams) + gram_index, weights=counts,
+                             minlength=len(years) * len(grams)).reshape(len(years), len(grams)).astype(float)
+        totals = matrix.sum(axis=1, keepdims=True)
+        shares = np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+        selected = np.argsort(-matrix.sum(axis=0), kind='stable')[:k]
+        return years.tolist(), [self.vocabulary.decode(grams[index]) for index in selected], shares[:, selected]
+
+
+def compare_genres(stats, n=1, k=10):
+    """
+    Compare the relative frequencies of the most frequent n-grams across genres.
+
+    Parameters:
+    - stats (list): GenreStats of every genre.
+    - n (int): Number of chords of the n-grams.
+    - k (int): Number of most frequent n-grams taken from every genre.
+
+    Returns:
+    - tuple: List of n-grams, the union of the top k of every genre, and array of shape (n-grams, genres) of the
+      share of every n-gram among the n-grams of its genre.
+    """
+    tables = [genre_stats.table(n) for genre_stats in stats]
+    # Every genre has its own vocabulary, so n-grams are compared by their chord symbols
+    selected = []
+    for genre_stats, (grams, counts) in zip(stats, tables):
+        for index in np.argsort(-counts, kind='stable')[:k]:
+            gram = genre_stats.vocabulary.decode(grams[index])
+            if gram not in selected:
+                selected.append(gram)
+    shares = np.zeros((len(selected), len(stats)))
+    for column, (genre_stats, (grams, counts)) in enumerate(zip(stats, tables)):
+        total = counts.sum()
+        ids = genre_stats.vocabulary.ids
+        for row, gram in enumerate(selected):
+            if total and all(chord in ids for chord in gram):
+                match = np.all(grams == [ids[chord] for chord in gram], axis=1)
+                shares[row, column] = counts[match].sum() / total
+    return selected, shares
+
+
+def refresh_stats(database, genre, directory=ANALYTICS_DIR):
+    """
+    Refresh the cached analytics of a genre with the songs added to the database since the last refresh.
+
+    Parameters:
+    - database (SongDatabase): Database the songs are stored in.
+    - genre (str): Genre of the songs.
+    - directory (str): Directory of the analytics cache.
+
+    Returns:
+    - GenreStats: Refreshed statistics of the genre.
+    """
+    stats = GenreStats(genre, directory)
+    stats.refresh(database)
+    return stats
+
+
+def format_gram(gram):
+    """Format an n-gram of Roman numeral chords as 'I-V-vi-IV'."""
+    return '-'.join(gram)
+
+
+def main():
+    """Print analytics of the stored progressions from the command line."""
+    # Imported here so cached analytics can be read without the storage module
+    from src.storage import DATABASE_FILE, SongDatabase
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['refresh', 'top', 'transitions', 'years', 'compare'])
+    parser.add_argument('genres', nargs='+')
+    parser.add_argument('--n', type=int, default=WINDOW_SIZE, choices=NGRAM_SIZES,
+                        help="Number of chords of the n-grams (default: %(default)s).")
+    parser.add_argument('--k', type=int, default=10, help="Number of n-grams or chords shown (default: 10).")
+    parser.add_argument('--year', type=int, help="Only count songs released in this year.")
+    parser.add_argument('--database', default=DATABASE_FILE, help="Song database (default: %(default)s).")
+    parser.add_argument('--directory', default=ANALYTICS_DIR,
+                        help="Directory of the analytics cache (default: %(default)s).")
+    args = parser.parse_args()
+    database = SongDatabase(args.database)
+    try:
+        stats = [refresh_stats(database, genre, args.directory) for genre in args.genres]
+    finally:
+        database.close()
+    if args.command == 'refresh':
+        for genre_stats in stats:
+            print(f"{genre_stats.genre}: {genre_stats.num_songs} songs, {len(genre_stats.vocabulary)} chords")
+    elif args.command == 'top':
+        for genre_stats in stats:
+            print(f"{genre_stats.genre}:")
+            for gram, count in genre_stats.top(args.n, args.k, args.year):
+                print(f"  {format_gram(gram):<24}{count:>10}")
+    elif args.command == 'transitions':
+        for genre_stats in stats:
+            # Show the transitions between the most frequent chords only
+            chords = np.argsort(-genre_stats.chord_frequencies(args.year), kind='stable')[:args.k]
+            matrix = genre_stats.transition_matrix(args.year)[np.ix_(chords, chords)]
+            symbols = genre_stats.vocabulary.decode(chords)
+            print(f"{genre_stats.genre}:")
+            print(' ' * 8 + ''.join(f"{symbol:>8}" for symbol in symbols))
+            for symbol, row in zip(symbols, matrix):
+                print(f"{symbol:>8}" + ''.join(f"{value:>8.2f}" for value in row))
+    elif args.command == 'years':
+        for genre_stats in stats:
+            years, grams, shares = genre_stats.by_year(args.n, args.k)
+            print(f"{genre_stats.genre}:")
+            print(f"{'year':<8}" + ''.join(f"{format_gram(gram):>16}" for gram in grams))
+            for year, row in zip(years, shares):
+                print(f"{year or 'unknown':<8}" + ''.join(f"{value:>16.3f}" for value in row))
+    else:
+        grams, shares = compare_genres(stats, args.n, args.k)
+        print(f"{'':<24}" + ''.join(f"{genre_stats.genre:>12}" for genre_stats in stats))
+        for gram, row in zip(grams, shares):
+            print(f"{format_gram(gram):<24}" + ''.join(f"{value:>12.3f}" for value in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""
+Archive of the raw chords of every scraped song, so songs can be analyzed again without crawling the site.
+
+Every song is archived with its chords as written on the page, the capo, the tab it was read from and the key,
+mode and release year Spotify reported. Re-analysis rebuilds the song database, the progression index, the CSV
+export and the corpus of a genre from the archive on all cores:
+
+    python -m src.archive reanalyze rock                     # writes output/reanalysis/rock/
+    python -m src.archive reanalyze rock --window-size 5 --key-source chords
+    python -m src.archive stats
+"""
+import argparse
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from src.key_estimation import KEY_SOURCES, resolve_key
+from src.progression_index import ProgressionIndex, progression_keys
+from src.standardize import transposer
+from src.web_scraper import WINDOW_SIZE, parse_chords
+
+ARCHIVE_FILE = 'data/chord_archive.sqlite'
+REANALYSIS_DIR = 'output/reanalysis'
+# Number of songs handed to a process at once
+CHUNK_SIZE = 500
+TAB_ID_PATTERN = re.compile(r'(\d+)/?(?:[?#].*)?$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tabs (
+    song_name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    key INTEGER,
+    mode INTEGER,
+    capo INTEGER NOT NULL DEFAULT 0,
+    tab_id INTEGER,
+    tab_url TEXT,
+    chords BLOB NOT NULL,
+    scraped REAL NOT NULL,
+    year INTEGER,
+    PRIMARY KEY (song_name, artist, genre)
+);
+"""
+COLUMNS = ('song_name', 'artist', 'genre', 'key', 'mode', 'capo', 'tab_id', 'tab_url', 'chords', 'scraped', 'year')
+INSERT = f"INSERT OR REPLACE INTO tabs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+def get_tab_id(url):
+    """Return the id Ultimate Guitar ends its tab URLs with, or None."""
+    match = TAB_ID_PATTERN.search(url or '')
+    return int(match.group(1)) if match else None
+
+
+def encode_chords(chords):
+    """Compress the chords of a song, which repeat the same few progressions, to a few bytes per chord."""
+    return zlib.compress('\n'.join(chords).encode('utf-8'), 9)
+
+
+def decode_chords(data):
+    """Decompress chords encoded by encode_chords."""
+    text = zlib.decompress(data).decode('utf-8')
+    return text.split('\n') if text else []
+
+
+def raw_tab(song, chords, capo, tab_url):
+    """
+    Describe the raw tab a song was analyzed from, to be archived with the song data.
+
+    Parameters:
+    - song (dict): Song dictionary with the key and mode from Spotify, which may be missing.
+    - chords (list): List of chord names as written on the song page.
+    - capo (int): Fret of the capo on the song page.
+    - tab_url (str): URL of the song page.
+
+    Returns:
+    - dict: Raw chords, capo, tab URL and Spotify key and mode of the song.
+    """
+    return {'chords': list(chords), 'capo': capo, 'tab_url': tab_url,
+            'spotify_key': song.get('key'), 'spotify_mode': song.get('mode')}
+
+
+def optional_int(value):
+    """Convert a key or mode read from Spotify or a CSV file to an integer, or None if it is empty."""
+    return None if value in (None, '') else int(value)
+
+
+class ChordArchive:
+    """
+    SQLite archive of the raw tabs of scraped songs.
+
+    Songs are keyed by (song_name, artist, genre) like the song database, and archiving a song again replaces
+    its tab. The archive can be shared by several threads.
+    """
+
+    def __init__(self, filename=ARCHIVE_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        # Archives created before songs had a release year are migrated in place
+        if 'year' not in {row[1] for row in self.connection.execute("PRAGMA table_info(tabs)")}:
+            with self.connection:
+                self.connection.execute("ALTER TABLE tabs ADD COLUMN year INTEGER")
+
+    def add(self, songs, genre):
+        """
+        Archive the raw tabs of a batch of songs in a single transaction.
+
+        Parameters:
+        - songs (list): List of song data dictionaries; songs without raw chords (see raw_tab) are skipped.
+        - genre (str): Genre of the songs.
+
+        Returns:
+        - int: Number of songs archived.
+        """
+        now = time.time()
+        rows = [(song['song_name'], song['artist'], genre, optional_int(song.get('spotify_key')),
+                 optional_int(song.get('spotify_mode')), song.get('capo') or 0, get_tab_id(song.get('tab_url')),
+                 song.get('tab_url'), encode_chords(song['chords']), now, optional_int(song.get('year')))
+                for song in songs if song.get('chords') is not None]
+        with self.lock, self.connection:
+            self.connection.executemany(INSERT, rows)
+        return len(rows)
+
+    def merge(self, other, genre=None):
+        """
+        Copy the tabs of another archive, such as the archive of a shard, into this one.
+
+        Parameters:
+        - other (ChordArchive): Archive to copy.
+        - genre (str): Genre of the tabs to copy, or None for all genres.
+
+        Returns:
+        - int: Number of tabs copied.
+        """
+        query = f"SELECT {', '.join(COLUMNS)} FROM tabs" + (" WHERE genre = ?" if genre else "")
+        with other.lock:
+            rows = other.connection.execute(query, (genre,) if genre else ()).fetchall()
+        with self.lock, self.connection:
+            self.connection.executemany(INSERT, rows)
+        return len(rows)
+
+    def count(self, genre=None):
+        """
+        Count the archived songs.
+
+        Parameters:
+        - genre (str): Genre of songs to count, or None for all genres.
+
+        Returns:
+        - dict: Number of songs and compressed size of their chords in bytes per genre.
+        """
+        query = "SELECT genre, COUNT(*), SUM(LENGTH(chords)) FROM tabs"
+        query += " WHERE genre = ? GROUP BY genre" if genre else " GROUP BY genre"
+        with self.lock:
+            rows = self.connection.execute(query, (genre,) if genre else ()).fetchall()
+        return {row_genre: {'songs': songs, 'bytes': size} for row_genre, songs, size in rows}
+
+    def iter_chunks(self, genre, chunk_size=CHUNK_SIZE):
+        """
+        Iterate over the archived songs of a genre in chunks, reading one chunk at a time.
+
+        Parameters:
+        - genre (str): Genre of the songs.
+        - chunk_size (int): Number of songs per chunk.
+
+        Returns:
+        - generator: Lists of (song_name, artist, key, mode, year, capo, compressed chords) tuples.
+        """
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT rowid, song_name, artist, key, mode, year, capo, chords FROM tabs "
+                    "WHERE genre = ? AND rowid > ? ORDER BY rowid LIMIT ?", (genre, last, chunk_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [row[1:] for row in rows]
+
+    def close(self):
+        """Close the archive."""
+        with self.lock:
+            self.connection.close()
+
+
+def analyze_chunk(rows, key_source='spotify', window_size=WINDOW_SIZE):
+    """
+    Transpose and parse a chunk of archived songs, in a worker process.
+
+    Parameters:
+    - rows (list): Chunk from ChordArchive.iter_chunks.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+    - window_size (int): Number of chords in a sequence.
+
+    Returns:
+    - tuple: List of song data dictionaries ready to be written to the database, with the keys of their
+      progressions in the progression index, and number of songs that could not be transposed.
+    """
+    songs = []
+    failed = 0
+    for song_name, artist, key, mode, year, capo, data in rows:
+        chords = decode_chords(data)
+        key, mode = resolve_key({'key': key, 'mode': mode}, chords, capo, key_source)
+        transposed = transposer(chords, key, mode, capo) if key is not None else None
+        if not transposed:
+            failed += 1
+            continue
+        progression = parse_chords(transposed, window_size)
+        # Hashing the n-grams of the progression is most of the work of indexing, so it is done here as well
+        songs.append({'song_name': song_name, 'artist': artist, 'key': key, 'mode': mode, 'year': year,
+                      'progression': progression, 'index_keys': progression_keys(progression)})
+    return songs, failed
+
+
+def reanalyze(archive, genre, directory=REANALYSIS_DIR, key_source='spotify', window_size=WINDOW_SIZE,
+              workers=None):
+    """
+    Rebuild the song database, progression index, CSV export and corpus of a genre from the archive.
+
+    Chunks of songs are analyzed by a pool of processes while the songs of finished chunks are written, so
+    the output is rebuilt on all cores with a single writer. The output of an earlier re-analysis of the genre
+    is replaced.
+
+    Parameters:
+    - archive (ChordArchive): Archive of the raw tabs.
+    - genre (str): Genre to rebuild.
+    - directory (str): Directory the database, index, CSV file and corpus are rebuilt in, under the genre.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+    - window_size (int): Number of chords in a sequence.
+    - workers (int): Number of processes, all cores by default.
+
+    Returns:
+    - tuple: Number of songs stored and number of songs that could not be transposed.
+    """
+    # Imported here so worker processes don't load the storage and export modules
+    from src.corpus import export_corpus
+    from src.storage import SongDatabase
+    directory = os.path.join(directory, genre)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    workers = workers or os.cpu_count() or 1
+    database = SongDatabase(os.path.join(directory, 'chordcrawler.sqlite'),
+                            index=ProgressionIndex(os.path.join(directory, 'index'), max_ngram=window_size))
+    stored = failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of chunks in flight, so the archive is never read into memory at once
+            pending = []
+            for chunk in archive.iter_chunks(genre):
+                pending.append(executor.submit(analyze_chunk, chunk, key_source, window_size))
+                if len(pending) >= 2 * workers:
+                    songs, chunk_failed = pending.pop(0).result()
+                    stored += len(database.add_songs(songs, genre))
+                    failed += chunk_failed
+            for future in pending:
+                songs, chunk_failed = future.result()
+                stored += len(database.add_songs(songs, genre))
+                failed += chunk_failed
+        database.export_csv(genre, os.path.join(directory, f'{genre}_database.csv'))
+        export_corpus(database, genre, os.path.join(directory, 'corpus'))
+    finally:
+        database.close()
+    logging.info(f"Rebuilt {stored} {genre} songs from the chord archive in '{directory}', "
+                 f"{failed} could not be transposed.")
+    return stored, failed
+
+
+def main():
+    """Re-analyze archived songs, or show the contents of the archive, from the command line."""
+    logging.basicConfig(filename='log/scraping.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(processName)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['reanalyze', 'stats'])
+    parser.add_argument('genres', nargs='*', help="Genres to re-analyze (default: every archived genre).")
+    parser.add_argument('--archive', default=ARCHIVE_FILE, help="Path to the chord archive (default: %(default)s).")
+    parser.add_argument('--directory', default=REANALYSIS_DIR,
+                        help="Output directory of the rebuilt databases (default: %(default)s).")
+    parser.add_argument('--key-source', choices=KEY_SOURCES, default='spotify',
+                        help="Transpose songs from Spotify's key, the key estimated from their chords, or the "
+                             "estimate when it is confident (default: spotify).")
+    parser.add_argument('--window-size', type=int, default=WINDOW_SIZE,
+                        help="Number of chords in a sequence (default: %(default)s).")
+    parser.add_argument('--workers', type=int, help="Number of processes (default: one per core).")
+    args = parser.parse_args()
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be a positive integer.")
+    if args.window_size < 1:
+        parser.error("--window-size must be a positive integer.")
+    archive = ChordArchive(args.archive)
+    try:
+        counts = archive.count()
+        if args.command == 'stats':
+            for genre, count in sorted(counts.items()):
+                print(f"{genre}: {count['songs']} songs, {count['bytes'] / 1024:.1f} KiB of chords")
+            return
+        for genre in args.genres or sorted(counts):
+            start = time.perf_counter()
+            stored, failed = reanalyze(archive, genre, args.directory, args.key_source, args.window_size,
+                                       args.workers)
+            print(f"{genre}: {stored} songs rebuilt in {time.perf_counter() - start:.1f}s, "
+                  f"{failed} could not be transposed")
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Non-interactive batch crawls, split into shards that separate machines or processes crawl independently.
+
+A job file lists the genres, year ranges and numbers of songs to crawl:
+
+    {"delay": 1, "jobs": [{"genre": "rock", "years": "2010-2020", "songs": 20000}]}
+
+Every step reads and writes a shared directory only:
+
+    python -m src.batch manifest jobs.json              # fetch the songs of every genre from Spotify, once
+    python -m src.batch crawl jobs.json --shard 3/16    # crawl the songs of shard 3 of 16, on any machine
+    python -m src.batch merge jobs.json                 # merge the shards into one database per genre
+    python -m src.archive reanalyze rock --archive DIR/merged/archive.sqlite  # re-analyze without crawling
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+from src.archive import ChordArchive
+from src.cache import PageCache
+from src.crawl import crawl
+from src.identity import SongIdentityIndex, song_key
+from src.journal import CrawlJournal
+from src.key_estimation import KEY_SOURCES
+from src.rate_limit import RateLimiter
+from src.spotify_api import fetch_songs
+from src.storage import SongDatabase
+from src.utilities import read_csv, valid_genre
+from src.web_scraper import BASE_URL
+
+BATCH_DIR = 'output/batch'
+MANIFEST_FIELDS = ['song_name', 'artist', 'key', 'mode', 'year']
+# Number of songs copied per transaction when merging shards
+MERGE_BATCH_SIZE = 500
+
+
+def read_jobs(filename):
+    """
+    Read and validate a job file.
+
+    Parameters:
+    - filename (str): Path to the JSON job file.
+
+    Returns:
+    - dict: Job file with a 'jobs' list of {'genre', 'start_year', 'end_year', 'songs'} and the 'delay' between
+      requests.
+    """
+    with open(filename, mode='r', encoding='utf-8') as file:
+        config = json.load(file)
+    jobs = []
+    for job in config.get('jobs') or []:
+        genre = str(job['genre']).lower()
+        if not valid_genre(genre):
+            raise ValueError(f"Invalid genre '{genre}' in {filename}.")
+        start_year, end_year = map(int, str(job['years']).split('-'))
+        if start_year >= end_year or int(job['songs']) <= 0:
+            raise ValueError(f"Invalid year range or number of songs for '{genre}' in {filename}.")
+        jobs.append({'genre': genre, 'start_year': start_year, 'end_year': end_year, 'songs': int(job['songs'])})
+    if not jobs:
+        raise ValueError(f"No jobs in {filename}.")
+    return {'jobs': jobs, 'delay': float(config.get('delay', 1))}
+
+
+def get_genres(jobs):
+    """Return the genres of the jobs, in order of appearance."""
+    return list(dict.fromkeys(job['genre'] for job in jobs))
+
+
+def shard_of(song, num_shards):
+    """
+    Assign a song to a shard.
+
+    The shard only depends on the canonical title and primary artist of the song, so every machine assigns
+    every song to the same shard whatever the order or content of its manifest, and releases of a song (e.g.,
+    'Song - Remastered', 'Song (Live)') land in the same shard, where the crawl skips them.
+
+    Parameters:
+    - song (dict): Song dictionary with song_name and artist.
+    - num_shards (int): Number of shards.
+
+    Returns:
+    - int: Index of the shard, from 0 to num_shards - 1.
+    """
+    title, artist = song_key(song['song_name'], song['artist'])
+    key = f"{artist}\x1f{title}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') % num_shards
+
+
+def parse_shard(text):
+    """
+    Parse a shard given as 'index/count', e.g. '3/16' for the fourth of sixteen shards.
+
+    Parameters:
+    - text (str): Shard specification.
+
+    Returns:
+    - tuple: Index and number of shards.
+    """
+    index, count = map(int, text.split('/'))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{text}', expected INDEX/COUNT with 0 <= INDEX < COUNT.")
+    return index, count
+
+
+def manifest_path(directory, genre):
+    """Return the path to the song manifest of a genre."""
+    return os.path.join(directory, 'manifest', f'{genre}.csv')
+
+
+def build_manifest(jobs, directory=BATCH_DIR, refresh=False, audio_features=True):
+    """
+    Fetch the songs of every genre of the jobs from Spotify and write them to the manifests.
+
+    Manifests that already exist are kept unless refresh is set, so every shard crawls the same songs. Songs are
+    matched on their canonical title and primary artist, so releases of the same song are listed once.
+
+    Parameters:
+    - jobs (list): Jobs from read_jobs.
+    - directory (str): Shared directory of the batch.
+    - refresh (bool): Fetch the songs again even if the manifest exists.
+    - audio_features (bool): Look up the key and mode of the songs on Spotify.
+
+    Returns:
+    - dict: Number of songs in the manifest of every genre.
+    """
+    os.makedirs(os.path.join(directory, 'manifest'), exist_ok=True)
+    counts = {}
+    for genre in get_genres(jobs):
+        path = manifest_path(directory, genre)
+        if os.path.exists(path) and not refresh:
+            counts[genre] = len(read_csv(path))
+            continue
+        songs = []
+        # Releases of a song and duplicates across the jobs of a genre are listed once
+        identities = SongIdentityIndex()
+        for job in jobs:
+            if job['genre'] == genre:
+                for song in fetch_songs(genre, job['songs'], job['start_year'], job['end_year'],
+                                         audio_features) or []:
+                    if identities.find(song['song_name'], song['artist']):
+                        continue
+                    identities.add(song['song_name'], song['artist'])
+                    songs.append(song)
+        # Write to a temporary file first, so shards never read a partial manifest
+        with open(path + '.tmp', mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=MANIFEST_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(songs)
+        os.replace(path + '.tmp', path)
+        counts[genre] = len(songs)
+        logging.info(f"Wrote {len(songs)} {genre} songs to '{path}'.")
+    return counts
+
+
+def shard_directory(directory, index, count):
+    """Return the output directory of a shard."""
+    return os.path.join(directory, 'shards', f'shard-{index:04d}-of-{count:04d}')
+
+
+def shard_cache(directory, index, count):
+    """
+    Open the page cache of a shard.
+
+    Every shard keeps its own cache in its directory, as a page cache tracks its size in the process using it
+    and can't be written by several processes at once.
+
+    Parameters:
+    - directory (str): Shared directory of the batch.
+    - index (int): Index of the shard.
+    - count (int): Number of shards.
+
+    Returns:
+    - PageCache: Page cache of the shard.
+    """
+    return PageCache(os.path.join(shard_directory(directory, index, count), 'cache'))
+
+
+def crawl_shard(config, index, count, directory=BATCH_DIR, backend='selenium', workers=1, cache=None,
+                base_url=BASE_URL, key_source='spotify'):
+    """
+    Crawl the songs of one shard of every genre of a job file.
+
+    The shard keeps its own database and crawl journal in its directory, so an interrupted shard resumes where
+    it stopped and shards never write to the same files. The page cache given should be the shard's own as well,
+    see shard_cache.
+
+    Parameters:
+    - config (dict): Job file from read_jobs.
+    - index (int): Index of the shard.
+    - count (int): Number of shards.
+    - directory (str): Shared directory of the batch.
+    - backend (str): 'selenium' or 'http'.
+    - workers (int): Number of WebDrivers, or of concurrent requests with the http backend.
+    - cache (PageCache): Optional page cache of the shard.
+    - base_url (str): Scheme and host of the site, e.g. a local server replaying recorded pages.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+    """
+    output = shard_directory(directory, index, count)
+    os.makedirs(output, exist_ok=True)
+    database = SongDatabase(os.path.join(output, 'songs.sqlite'),
+                            archive=ChordArchive(os.path.join(output, 'archive.sqlite')))
+    journal = CrawlJournal(os.path.join(output, 'journal.sqlite'))
+    limiter = RateLimiter.from_delay(config['delay'])
+    try:
+        for genre in get_genres(config['jobs']):
+            path = manifest_path(directory, genre)
+            if not os.path.exists(path):
+                logging.error(f"No manifest for '{genre}', run the manifest command first.")
+                continue
+            songs = [song for song in read_csv(path) if shard_of(song, count) == index]
+            logging.info(f"Shard {index}/{count} has {len(songs)} {genre} songs.")
+            crawl(songs, database, genre, limiter, journal, cache, backend, workers, base_url, key_source)
+            logging.info(f"Crawl journal of shard {index}/{count}: {journal.summary(genre)}")
+    finally:
+        database.close()
+        journal.close()
+
+
+def merge_shards(genres, directory=BATCH_DIR):
+    """
+    Merge the databases of all shards into one deduplicated database per genre, and their chord archives into
+    one archive.
+
+    Merging is idempotent: songs already in a merged database are skipped, so shards can be merged again as
+    they progress.
+
+    Parameters:
+    - genres (list): Genres to merge.
+    - directory (str): Shared directory of the batch.
+
+    Returns:
+    - dict: Number of songs added to the merged database of every genre.
+    """
+    output = os.path.join(directory, 'merged')
+    os.makedirs(output, exist_ok=True)
+    shards = sorted(glob.glob(os.path.join(directory, 'shards', 'shard-*', 'songs.sqlite')))
+    archive = ChordArchive(os.path.join(output, 'archive.sqlite'))
+    added = {}
+    for genre in genres:
+        merged = SongDatabase(os.path.join(output, f'{genre}.sqlite'))
+        added[genre] = 0
+        for path in shards:
+            shard = SongDatabase(path)
+            batch = []
+            for song in shard.iter_songs(genre):
+                batch.append(song)
+                if len(batch) >= MERGE_BATCH_SIZE:
+                    added[genre] += len(merged.add_songs(batch, genre))
+                    batch = []
+            added[genre] += len(merged.add_songs(batch, genre))
+            shard.close()
+            shard_archive = os.path.join(os.path.dirname(path), 'archive.sqlite')
+            if os.path.exists(shard_archive):
+                shard_archive = ChordArchive(shard_archive)
+                archive.merge(shard_archive, genre)
+                shard_archive.close()
+        merged.export_csv(genre, os.path.join(output, f'{genre}_database.csv'))
+        logging.info(f"Merged {added[genre]} new {genre} songs from {len(shards)} shards, "
+                     f"{merged.count_songs(genre)} in total.")
+        merged.close()
+    archive.close()
+    return added
+
+
+def main():
+    """Run a step of a batch crawl from the command line."""
+    logging.basicConfig(filename='log/scraping.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['manifest', 'crawl', 'merge'])
+    parser.add_argument('jobs', help="Path to the JSON job file.")
+    parser.add_argument('--directory', default=BATCH_DIR,
+                        help="Directory shared by the shards (default: %(default)s).")
+    parser.add_argument('--shard', default='0/1', help="Shard to crawl, as INDEX/COUNT (default: 0/1).")
+    parser.add_argument('--refresh', action='store_true', help="Fetch the manifests from Spotify again.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of headless browsers, or concurrent requests with the http backend.")
+    parser.add_argument('--backend', choices=['selenium', 'http'], default='selenium',
+                        help="Fetch pages with headless Chrome or over plain HTTP (default: selenium).")
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the page cache.")
+    parser.add_argument('--base-url', default=BASE_URL, help="Scheme and host of the site (default: %(default)s).")
+    parser.add_argument('--key-source', choices=KEY_SOURCES, default='spotify',
+                        help="Transpose songs from Spotify's key, the key estimated from their chords, or the "
+                             "estimate when it is confident (default: spotify).")
+    args = parser.parse_args()
+    try:
+        config = read_jobs(args.jobs)
+        shard = parse_shard(args.shard)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"Invalid job file or shard: {e}")
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer.")
+    if args.command == 'manifest':
+        for genre, count in build_manifest(config['jobs'], args.directory, args.refresh,
+                                             args.key_source != 'chords').items():
+            print(f"{genre}: {count} songs")
+    elif args.command == 'crawl':
+        cache = None if args.no_cache else shard_cache(args.directory, *shard)
+        try:
+            crawl_shard(config, *shard, args.directory, args.backend, args.workers, cache, args.base_url,
+                        args.key_source)
+        except KeyboardInterrupt:
+            logging.info("Keyboard interrupt detected!")
+        finally:
+            if cache:
+                cache.close()
+    else:
+        for genre, count in merge_shards(get_genres(config['jobs']), args.directory).items():
+            print(f"{genre}: {count} songs merged")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+CACHE_DIR = 'data/cache'
+# Pages older than a week are fetched again
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def normalize_url(url):
+    """
+    Normalize a page URL so that equivalent URLs share a cache entry.
+
+    The scheme and host are dropped, the query parameters are sorted and everything is lowercased, so a page
+    fetched from the site and from a local replay of it map to the same entry.
+
+    Parameters:
+    - url (str): URL of the page.
+
+    Returns:
+    - str: Normalized URL.
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path.rstrip('/') or '/'
+    return f"{path}?{query}".lower() if query else path.lower()
+
+
+class PageCache:
+    """
+    Persistent cache of fetched pages stored as compressed HTML under the hash of their normalized URL.
+
+    Entries expire after a TTL, and the least recently used entries are evicted once the compressed pages
+    exceed the size cap. The cache can be shared by several threads.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (digest TEXT PRIMARY KEY, url TEXT, "
+                                "size INTEGER, created REAL, accessed REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + '.html.z')
+
+    def get(self, url):
+        """
+        Read a page from the cache.
+
+        Parameters:
+        - url (str): URL of the page.
+
+        Returns:
+        - str: HTML of the page, or None if it is not cached or has expired.
+        """
+        key = normalize_url(url)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT created FROM pages WHERE digest = ?", (digest,)).fetchone()
+            if row is None or now - row[0] > self.ttl:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(digest), 'rb') as file:
+                    page = zlib.decompress(file.read()).decode('utf-8')
+            except (FileNotFoundError, zlib.error):
+                self._remove(digest)
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE pages SET accessed = ? WHERE digest = ?", (now, digest))
+            self.connection.commit()
+            self.hits += 1
+            return page
+
+    def put(self, url, page):
+        """
+        Store a page in the cache, evicting the least recently used pages if the cache is full.
+
+        Parameters:
+        - url (str): URL of the page.
+        - page (str): HTML of the page.
+        """
+        key = normalize_url(url)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        data = zlib.compress(page.encode('utf-8'), 6)
+        path = self._path(digest)
+        now = time.time()
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as file:
+                    file.write(data)
+            except PermissionError:
+                logging.error("Permission denied!")
+                return
+            row = self.connection.execute("SELECT size FROM pages WHERE digest = ?", (digest,)).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                                    (digest, key, len(data), now, now))
+            self.size += len(data)
+            self._evict()
+            self.connection.commit()
+
+    def _remove(self, digest):
+        row = self.connection.execute("SELECT size FROM pages WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return
+        self.connection.execute("DELETE FROM pages WHERE digest = ?", (digest,))
+        self.size -= row[0]
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.size > self.max_size:
+            row = self.connection.execute("SELECT digest FROM pages ORDER BY accessed LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._remove(row[0])
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Return the hit and miss counters of the cache.
+
+        Returns:
+        - dict: Hits, misses, evictions, number of entries and compressed size in bytes.
+        """
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries,
+                'size': self.size}
+
+    def close(self):
+        """Close the index of the cache."""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,116 @@
+import re
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+NOTE_NAMES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+NOTE_VALUES = {"C": 0, "C#": 1, "Db": 1, "D": 2, "D#": 3, "Eb": 3, "E": 4, "Fb": 4, "E#": 5, "F": 5, "F#": 6,
+               "Gb": 6, "G": 7, "G#": 8, "Ab": 8, "A": 9, "A#": 10, "Bb": 10, "B": 11, "Cb": 11, "B#": 0}
+# Roman numerals of every semitone above C, using flats for the borrowed degrees
+ROMAN_NUMERALS = ["I", "bII", "II", "bIII", "III", "IV", "#IV", "V", "bVI", "VI", "bVII", "VII"]
+QUALITY_SYMBOLS = {"major": "", "minor": "m", "diminished": "dim", "augmented": "aug"}
+
+# '/9' belongs to the extension of added ninth chords such as 'C6/9', any other slash to the bass note
+CHORD_PATTERN = re.compile(r'^([A-G][#b]?)(maj|Maj|M(?![a-z])|min|mi|m(?!aj)|dim|°|o(?![a-z])|aug|\+)?'
+                           r'((?:[^/]|/9)*)(?:/([A-G][#b]?))?$')
+QUALITIES = {"maj": "major", "Maj": "major", "M": "major", "min": "minor", "mi": "minor", "m": "minor",
+             "dim": "diminished", "°": "diminished", "o": "diminished", "aug": "augmented", "+": "augmented"}
+ROMAN_PATTERN = re.compile(r'^([b#]?)(VII|VI|V|IV|III|II|I|vii|vi|v|iv|iii|ii|i)([°+]?)(.*)$')
+DEGREES = {"I": 0, "II": 2, "III": 4, "IV": 5, "V": 7, "VI": 9, "VII": 11}
+
+# A parsed chord symbol: root and bass are pitch classes (0-11), bass is None for chords without a slash
+Chord = namedtuple('Chord', ['root', 'quality', 'extension', 'bass'])
+
+_interned = {}
+
+
+@lru_cache(maxsize=4096)
+def parse_chord(symbol):
+    """
+    Parse a chord symbol into its root, quality, extension and slash bass.
+
+    Parameters:
+    - symbol (str): Chord symbol (e.g., 'F#m7/C#').
+
+    Returns:
+    - Chord: Interned chord, shared by every symbol that spells the same chord, or None if the
+      symbol is not recognized.
+    """
+    match = CHORD_PATTERN.match(symbol.strip())
+    if not match:
+        return None
+    root, quality, extension, bass = match.groups()
+    quality = QUALITIES.get(quality, "major")
+    # Keep the major seventh explicit so it can't be confused with a dominant seventh
+    if match.group(2) in ("maj", "Maj", "M") and extension:
+        extension = "maj" + extension
+    chord = Chord(NOTE_VALUES[root], sys.intern(quality), sys.intern(extension),
+                  NOTE_VALUES[bass] if bass else None)
+    return _interned.setdefault(chord, chord)
+
+
+def format_chord(chord, semitones=0):
+    """
+    Spell a parsed chord as a chord symbol, optionally shifted by a number of semitones.
+
+    Parameters:
+    - chord (Chord): Parsed chord.
+    - semitones (int): Number of semitones to shift the chord by.
+
+    Returns:
+    - str: Chord symbol (e.g., 'Bbm7/F').
+    """
+    symbol = NOTE_NAMES[(chord.root + semitones) % 12] + QUALITY_SYMBOLS[chord.quality] + chord.extension
+    if chord.bass is not None:
+        symbol += "/" + NOTE_NAMES[(chord.bass + semitones) % 12]
+    return symbol
+
+
+@lru_cache(maxsize=4096)
+def to_roman(symbol):
+    """
+    Convert a single chord symbol in the key of C to Roman numeral notation.
+
+    Parameters:
+    - symbol (str): Chord symbol.
+
+    Returns:
+    - str: Roman numeral chord (e.g., 'vi7', 'bVII', 'vii°'), or a 'not recognized' note.
+    """
+    chord = parse_chord(symbol)
+    if chord is None:
+        return f"Chord {symbol} not recognized"
+    roman_chord = ROMAN_NUMERALS[chord.root]
+    if chord.quality == "minor":
+        roman_chord = roman_chord.lower()
+    elif chord.quality == "diminished":
+        roman_chord = roman_chord.lower() + "°"
+    elif chord.quality == "augmented":
+        roman_chord += "+"
+    return sys.intern(roman_chord + chord.extension)
+
+
+@lru_cache(maxsize=4096)
+def parse_roman(numeral):
+    """
+    Parse a Roman numeral chord produced by to_roman back into a chord relative to C.
+
+    Parameters:
+    - numeral (str): Roman numeral chord (e.g., 'bVII', 'vi7', 'vii°').
+
+    Returns:
+    - Chord: Chord without a bass note, or None if the numeral is not recognized.
+    """
+    match = ROMAN_PATTERN.match(numeral)
+    if not match:
+        return None
+    accidental, degree, symbol, extension = match.groups()
+    root = (DEGREES[degree.upper()] + {"b": -1, "#": 1, "": 0}[accidental]) % 12
+    if symbol == "°":
+        quality = "diminished"
+    elif symbol == "+":
+        quality = "augmented"
+    else:
+        quality = "minor" if degree.islower() else "major"
+    chord = Chord(root, sys.intern(quality), sys.intern(extension), None)
+    return _interned.setdefault(chord, chord)
@@ -0,0 +1,341 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+from collections import namedtuple
+import numpy as np
+from src.metrics import timed
+from src.ngrams import ChordVocabulary
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+CORPUS_DIR = 'output/corpus'
+# Number of songs written per chunk or record batch
+CHUNK_SIZE = 5000
+FORMATS = ['arrow', 'npy']
+# Arrow IPC when pyarrow is installed, chunks of .npy arrays otherwise; both can be memory-mapped
+DEFAULT_FORMAT = 'arrow' if pa is not None else 'npy'
+
+# One chunk of a corpus. The chords of sequence i are chords[sequence_offsets[i]:sequence_offsets[i + 1]] and the
+# sequences of song j are sequences song_offsets[j] to song_offsets[j + 1]
+CorpusChunk = namedtuple('CorpusChunk', ['ids', 'song_names', 'artists', 'keys', 'modes', 'chords',
+                                         'sequence_offsets', 'song_offsets'])
+
+
+def encode_strings(strings):
+    """Encode strings as a flat array of UTF-8 bytes and an array of offsets."""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(data, offsets):
+    """Decode strings encoded by encode_strings."""
+    data = bytes(data)
+    offsets = offsets.tolist()
+    return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class CorpusWriter:
+    """
+    Streaming writer of a genre corpus.
+
+    Songs are buffered and written in chunks of chunk_size songs: song metadata in columns and progressions as
+    flat arrays of chord ids with offsets. The chord vocabulary is written when the writer is closed. The corpus
+    is written to a sibling temporary directory that replaces any earlier export once it is complete, so an
+    export that fails leaves the earlier corpus in place.
+    """
+
+    def __init__(self, directory, genre, chunk_size=CHUNK_SIZE, format=DEFAULT_FORMAT):
+        if format == 'arrow' and pa is None:
+            raise ValueError("The arrow format requires pyarrow.")
+        self.directory = directory
+        self.genre = genre
+        self.chunk_size = chunk_size
+        self.format = format
+        self.vocabulary = ChordVocabulary()
+        self.songs = []
+        self.count = 0
+        self.chunks = 0
+        self.arrow_writer = None
+        self.temporary = directory + '.tmp'
+        # Discard what an export that failed before left behind
+        if os.path.isdir(self.temporary):
+            shutil.rmtree(self.temporary)
+        os.makedirs(self.temporary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, song):
+        """
+        Add a song to the corpus.
+
+        Parameters:
+        - song (dict): Song data dictionary with id, song_name, artist, key, mode and progression.
+        """
+        self.songs.append(song)
+        if len(self.songs) >= self.chunk_size:
+            self.flush()
+
+    def _encode(self):
+        # Encode the buffered songs as columns, keeping the offsets as int32 so Arrow can use them as they are
+        sequences = [sequence for song in self.songs for sequence in song['progression']]
+        chords = np.fromiter((self.vocabulary.id(chord) for sequence in sequences for chord in sequence),
+                             dtype=np.int32)
+        sequence_offsets = np.zeros(len(sequences) + 1, dtype=np.int32)
+        np.cumsum([len(sequence) for sequence in sequences], out=sequence_offsets[1:])
+        song_offsets = np.zeros(len(self.songs) + 1, dtype=np.int32)
+        np.cumsum([len(song['progression']) for song in self.songs], out=song_offsets[1:])
+        return CorpusChunk(
+            np.array([song.get('id', 0) for song in self.songs], dtype=np.int64),
+            [song['song_name'] for song in self.songs],
+            [song['artist'] for song in self.songs],
+            np.array([song['key'] for song in self.songs], dtype=np.int8),
+            np.array([song['mode'] for song in self.songs], dtype=np.int8),
+            chords, sequence_offsets, song_offsets)
+
+    def flush(self):
+        """Write the buffered songs as a new chunk."""
+        if not self.songs:
+            return
+        chunk = self._encode()
+        if self.format == 'arrow':
+            progressions = pa.ListArray.from_arrays(
+                pa.array(chunk.song_offsets), pa.ListArray.from_arrays(pa.array(chunk.sequence_offsets),
+                                                                      pa.array(chunk.chords)))
+            batch = pa.record_batch([pa.array(chunk.ids), pa.array(chunk.song_names), pa.array(chunk.artists),
+                                     pa.array(chunk.keys), pa.array(chunk.modes), progressions],
+                                    names=['id', 'song_name', 'artist', 'key', 'mode', 'progression'])
+            if self.arrow_writer is None:
+                self.arrow_writer = pa.ipc.new_file(os.path.join(self.temporary, 'songs.arrow'), batch.schema)
+            self.arrow_writer.write_batch(batch)
+        else:
+            path = os.path.join(self.temporary, f'chunk-{self.chunks:06d}')
+            os.makedirs(path)
+            names, name_offsets = encode_strings(chunk.song_names)
+            artists, artist_offsets = encode_strings(chunk.artists)
+            arrays = chunk._replace(song_names=names, artists=artists)._asdict()
+            arrays.update(name_offsets=name_offsets, artist_offsets=artist_offsets)
+            for name, array in arrays.items():
+                np.save(os.path.join(path, f'{name}.npy'), array)
+        self.count += len(self.songs)
+        self.chunks += 1
+        self.songs = []
+
+    def close(self):
+        """Write the buffered songs and the metadata of the corpus, and replace any earlier export with it."""
+        self.flush()
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+            self.arrow_writer = None
+        with open(os.path.join(self.temporary, 'corpus.json'), mode='w', encoding='utf-8') as file:
+            json.dump({'format': self.format, 'genre': self.genre, 'songs': self.count, 'chunks': self.chunks,
+                       'vocabulary': self.vocabulary.symbols}, file, ensure_ascii=False)
+        # A directory can't be replaced while it holds files, so the earlier export is moved aside first
+        previous = self.directory + '.old'
+        if os.path.isdir(previous):
+            shutil.rmtree(previous)
+        if os.path.isdir(self.directory):
+            os.rename(self.directory, previous)
+        os.rename(self.temporary, self.directory)
+        if os.path.isdir(previous):
+            shutil.rmtree(previous)
+
+    def abort(self):
+        """Discard the songs written so far, keeping any earlier export."""
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+            self.arrow_writer = None
+        shutil.rmtree(self.temporary, ignore_errors=True)
+
+
+class Corpus:
+    """
+    Genre corpus loaded from disk.
+
+    The chunks are memory-mapped, so loading a corpus reads its metadata only and the chord arrays are paged in
+    as they are used.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'corpus.json'), mode='r', encoding='utf-8') as file:
+            metadata = json.load(file)
+        self.directory = directory
+        self.genre = metadata['genre']
+        self.vocabulary = ChordVocabulary(metadata['vocabulary'])
+        if metadata['format'] == 'arrow':
+            self.chunks = self._load_arrow()
+        else:
+            self.chunks = [self._load_npy(path) for path in sorted(glob.glob(os.path.join(directory, 'chunk-*')))]
+
+    def _load_arrow(self):
+        if pa is None:
+            raise ValueError("Reading an arrow corpus requires pyarrow.")
+        path = os.path.join(self.directory, 'songs.arrow')
+        if not os.path.exists(path):
+            return []
+        reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+        chunks = []
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            progressions = batch.column('progression')
+            sequences = progressions.values
+            chunks.append(CorpusChunk(
+                batch.column('id').to_numpy(), batch.column('song_name').to_pylist(),
+                batch.column('artist').to_pylist(), batch.column('key').to_numpy(),
+                batch.column('mode').to_numpy(), sequences.values.to_numpy(),
+                sequences.offsets.to_numpy(), progressions.offsets.to_numpy()))
+        return chunks
+
+    @staticmethod
+    def _load_npy(path):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                  for name in CorpusChunk._fields + ('name_offsets', 'artist_offsets')}
+        return CorpusChunk(
+            arrays['ids'], decode_strings(arrays['song_names'], arrays['name_offsets']),
+            decode_strings(arrays['artists'], arrays['artist_offsets']), arrays['keys'], arrays['modes'],
+            arrays['chords'], arrays['sequence_offsets'], arrays['song_offsets'])
+
+    def __len__(self):
+        return sum(len(chunk.ids) for chunk in self.chunks)
+
+    def sequences(self):
+        """
+        Return the chords of every sequence of the corpus as flat arrays, without copying single-chunk corpora.
+
+        Returns:
+        - tuple: Array of chord ids, offsets of every sequence into it and the index of the song of every
+          sequence.
+        """
+        owners = [np.repeat(np.arange(len(chunk.ids)), np.diff(chunk.song_offsets)) for chunk in self.chunks]
+        if len(self.chunks) == 1:
+            return self.chunks[0].chords, self.chunks[0].sequence_offsets, owners[0]
+        offsets = [np.zeros(1, dtype=np.int64)]
+        songs = 0
+        for index, chunk in enumerate(self.chunks):
+            # Shift the offsets and song indexes of every chunk past the previous chunks
+            offsets.append(np.asarray(chunk.sequence_offsets[1:], dtype=np.int64) + offsets[-1][-1])
+            owners[index] = owners[index] + songs
+            songs += len(chunk.ids)
+        chords = [chunk.chords for chunk in self.chunks]
+        return (np.concatenate(chords) if chords else np.empty(0, dtype=np.int32), np.concatenate(offsets),
+                np.concatenate(owners) if owners else np.empty(0, dtype=np.int64))
+
+    def iter_songs(self):
+        """
+        Iterate over the songs of the corpus, decoding their progressions to Roman numeral chords.
+
+        Returns:
+        - generator: Song data dictionaries with id, song_name, artist, key, mode and progression.
+        """
+        symbols = self.vocabulary.symbols
+        for chunk in self.chunks:
+            chords = np.asarray(chunk.chords).tolist()
+            sequence_offsets = np.asarray(chunk.sequence_offsets).tolist()
+            song_offsets = np.asarray(chunk.song_offsets).tolist()
+            for index, song_id in enumerate(chunk.ids.tolist()):
+                progression = [tuple(symbols[chord] for chord in
+                                     chords[sequence_offsets[position]:sequence_offsets[position + 1]])
+                               for position in range(song_offsets[index], song_offsets[index + 1])]
+                yield {'id': song_id, 'song_name': chunk.song_names[index], 'artist': chunk.artists[index],
+                       'key': int(chunk.keys[index]), 'mode': int(chunk.modes[index]), 'progression': progression}
+
+
+@timed('export_corpus')
+def export_corpus(database, genre, directory=None, format=DEFAULT_FORMAT):
+    """
+    Export the songs of a genre from the song database to a corpus.
+
+    Parameters:
+    - database (SongDatabase): Database of songs.
+    - genre (str): Genre of songs to export.
+    - directory (str): Directory of the corpus, 'output/corpus/(genre)' by default.
+    - format (str): 'arrow' or 'npy'.
+
+    Returns:
+    - int: Number of songs exported.
+    """
+    directory = directory or os.path.join(CORPUS_DIR, genre)
+    try:
+        with CorpusWriter(directory, genre, format=format) as writer:
+            for song in database.iter_songs(genre):
+                writer.write(song)
+        return writer.count
+    except PermissionError:
+        logging.error("Permission denied!")
+    except OSError as e:
+        logging.error(f"Could not export the {genre} corpus: {e}")
+    return 0
+
+
+def load_corpus(genre, directory=None):
+    """
+    Load the corpus of a genre.
+
+    Parameters:
+    - genre (str): Genre of the corpus.
+    - directory (str): Directory of the corpus, 'output/corpus/(genre)' by default.
+
+    Returns:
+    - Corpus: Memory-mapped corpus.
+    """
+    return Corpus(directory or os.path.join(CORPUS_DIR, genre))
+
+
+def import_corpus(database, genre, directory=None):
+    """
+    Import the songs of a corpus into the song database.
+
+    Parameters:
+    - database (SongDatabase): Database of songs.
+    - genre (str): Genre of the corpus.
+    - directory (str): Directory of the corpus, 'output/corpus/(genre)' by default.
+
+    Returns:
+    - int: Number of songs imported.
+    """
+    imported = 0
+    songs = []
+    for song in load_corpus(genre, directory).iter_songs():
+        songs.append(song)
+        if len(songs) >= CHUNK_SIZE:
+            imported += len(database.add_songs(songs, genre))
+            songs = []
+    return imported + len(database.add_songs(songs, genre))
+
+
+def main():
+    """Export or import a genre corpus from the command line."""
+    # Imported here so corpora can be read without the storage module
+    from src.storage import SongDatabase
+    parser = argparse.ArgumentParser(description="Export the songs of a genre to a columnar corpus, or import one.")
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('genre')
+    parser.add_argument('--directory', help="Directory of the corpus (default: output/corpus/GENRE).")
+    parser.add_argument('--format', choices=FORMATS, default=DEFAULT_FORMAT,
+                        help=f"Format of exported corpora (default: {DEFAULT_FORMAT}).")
+    args = parser.parse_args()
+    database = SongDatabase()
+    if args.command == 'export':
+        print(f"Exported {export_corpus(database, args.genre, args.directory, args.format)} songs.")
+    else:
+        print(f"Imported {import_corpus(database, args.genre, args.directory)} songs.")
+    database.close()
+
+
+if __name__ == '__main__':
+    main()
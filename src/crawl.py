@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+import logging
+from tqdm import tqdm
+from src.http_fetch import run_http
+from src.identity import SongIdentityIndex
+from src.metrics import count, span
+from src.web_scraper import BASE_URL
+from src.workers import run_workers
+
+# Number of songs checked against the crawl journal at once, a page of Spotify results
+JOURNAL_BATCH_SIZE = 50
+
+
+def filter_pending(songs, database, genre, journal=None, existing_songs=None):
+    """
+    Filter a stream of songs down to the songs that still have to be scraped.
+
+    Songs are matched on their canonical title and primary artist, so releases of a stored song (e.g.,
+    'Song - Remastered 2011', 'Song (feat. X)') and duplicates within the stream are skipped before any page is
+    fetched. The crawl journal is checked for every page of songs rather than once for the whole list.
+
+    Parameters:
+    - songs (iterable): Song dictionaries.
+    - database (SongDatabase): Database the songs are stored in.
+    - genre (str): Genre of the songs.
+    - journal (CrawlJournal): Optional crawl journal, skipping songs that are not found or waiting for a retry.
+    - existing_songs (set): Set of (song_name, artist) tuples already in the database, read from it if None.
+
+    Returns:
+    - generator: Song dictionaries to scrape.
+    """
+    if existing_songs is None:
+        existing_songs = database.get_existing_songs(genre)
+    identities = SongIdentityIndex(existing_songs)
+    skipped = {'exact': 0, 'fuzzy': 0}
+    total = 0
+    songs = iter(songs)
+    while True:
+        page = list(itertools.islice(songs, JOURNAL_BATCH_SIZE))
+        if not page:
+            break
+        total += len(page)
+        pending = []
+        for song in page:
+            # Skip the song if it already exists in the database or earlier in the stream
+            match = identities.find(song['song_name'], song['artist'])
+            if match:
+                skipped[match[0]] += 1
+                count('skipped', match=match[0])
+                logging.info(f"Song '{song['song_name']}' by {song['artist']} already exists in the {genre} "
+                             f"database or the song list ({match[0]} match of '{match[1][0]}' by {match[1][1]}).")
+                continue
+            identities.add(song['song_name'], song['artist'])
+            pending.append(song)
+        # Resume from the crawl journal, skipping songs that are not found or waiting for a retry
+        yield from journal.filter_due(pending, genre) if journal else pending
+    logging.info(f"Skipped {sum(skipped.values())} of {total} {genre} songs already stored or duplicated "
+                 f"({skipped['exact']} exact, {skipped['fuzzy']} fuzzy matches).")
+
+
+def crawl(songs, database, genre, limiter, journal=None, cache=None, backend='selenium', workers=1,
+          base_url=BASE_URL, key_source='spotify'):
+    """
+    Scrape the songs of a genre that are not stored yet, showing the progress of the crawl.
+
+    Songs are streamed through the crawl: scraping starts with the first song of the stream, such as the first
+    page of Spotify results, and bounded queues between the stages hold back the stream while the workers are
+    busy.
+
+    Parameters:
+    - songs (iterable): Song dictionaries with song_name, artist and optionally key and mode, e.g. a list or
+      the generator of spotify_api.stream_songs.
+    - database (SongDatabase): Database the songs are stored in.
+    - genre (str): Genre of the songs.
+    - limiter (RateLimiter): Rate limiter shared by the workers.
+    - journal (CrawlJournal): Optional crawl journal recording the state of every song.
+    - cache (PageCache): Optional page cache.
+    - backend (str): 'selenium' for a pool of WebDrivers, 'http' for plain HTTP requests.
+    - workers (int): Number of WebDrivers, or of concurrent requests with the http backend.
+    - base_url (str): Scheme and host of the site, e.g. a local server replaying recorded pages.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+
+    Returns:
+    - int: Number of songs handed to the workers.
+    """
+    existing_songs = database.get_existing_songs(genre)
+    handed = 0
+
+    def counted(pending):
+        nonlocal handed
+        for song in pending:
+            # The number of songs to scrape is only known once the stream ends, so the bar grows with it
+            handed += 1
+            progress.total = handed
+            yield song
+
+    with tqdm(total=None, desc=f"Scraping {genre} songs", unit="song") as progress, span('scrape'):
+        pending = counted(filter_pending(songs, database, genre, journal, existing_songs))
+        if backend == 'http':
+            asyncio.run(run_http(pending, database, genre, limiter, existing_songs, workers, progress,
+                                 base_url=base_url, cache=cache, journal=journal, key_source=key_source))
+        else:
+            run_workers(pending, database, genre, limiter, existing_songs, workers, progress, cache, journal,
+                        key_source, base_url)
+    return handed
@@ -0,0 +1,110 @@
+import html
+import re
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+TAB_BODY_START = '<pre class="tK8GG Ty_RP"'
+TAB_BODY_END = '</pre>'
+CAPO_PATTERN = re.compile(r'<th[^>]*>\s*Capo:\s*</th>\s*<td[^>]*>(.*?)</td>', re.S)
+CHORD_PATTERN = re.compile(r'<span\b[^>]*\bdata-name="[^"]*"[^>]*>(.*?)</span>', re.S)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
+def strip_tags(fragment):
+    """Return the text of an HTML fragment."""
+    return html.unescape(TAG_PATTERN.sub('', fragment)).strip()
+
+
+def isolate_tab_body(page):
+    """
+    Cut the chord sheet out of a song page without parsing the rest of the document.
+
+    Parameters:
+    - page (str): HTML of a song page.
+
+    Returns:
+    - str: HTML of the <pre> block holding the chord sheet, or None if the page has none.
+    """
+    start = page.find(TAB_BODY_START)
+    if start == -1:
+        return None
+    end = page.find(TAB_BODY_END, start)
+    return page[start:] if end == -1 else page[start:end + len(TAB_BODY_END)]
+
+
+def extract_capo_text(page):
+    """
+    Read the text of the "Capo" row of a song page.
+
+    Parameters:
+    - page (str): HTML of a song page.
+
+    Returns:
+    - str: Text of the capo row (e.g., '3rd fret'), or None if the page has no capo row.
+    """
+    match = CAPO_PATTERN.search(page)
+    return strip_tags(match.group(1)) if match else None
+
+
+def chords_regex(body):
+    """Pull the chord tokens out of the chord sheet with a regular expression, without building a tree."""
+    return [strip_tags(chord) for chord in CHORD_PATTERN.findall(body)]
+
+
+def chords_selectolax(body):
+    """Pull the chord tokens out of the chord sheet with selectolax."""
+    return [node.text().strip() for node in LexborHTMLParser(body).css('span[data-name]')]
+
+
+def chords_lxml(body):
+    """Pull the chord tokens out of the chord sheet with lxml."""
+    return [node.text_content().strip() for node in lxml.html.fragment_fromstring(body).xpath('.//span[@data-name]')]
+
+
+def chords_html_parser(body):
+    """Pull the chord tokens out of the chord sheet with BeautifulSoup's pure-Python parser."""
+    soup = BeautifulSoup(body, 'html.parser')
+    return [item.get_text().strip() for item in soup.find_all('span', attrs={'data-name': True})]
+
+
+BACKENDS = {'regex': chords_regex, 'selectolax': chords_selectolax, 'lxml': chords_lxml,
+            'html.parser': chords_html_parser}
+# Fastest installed parser, falling back to BeautifulSoup's parser
+DEFAULT_BACKEND = 'selectolax' if LexborHTMLParser is not None else 'lxml' if lxml is not None else 'html.parser'
+
+
+def available_backends():
+    """
+    List the extraction backends that can run with the installed packages.
+
+    Returns:
+    - list: Names of the available backends, fastest first.
+    """
+    return [name for name, available in [('regex', True), ('selectolax', LexborHTMLParser is not None),
+                                         ('lxml', lxml is not None), ('html.parser', True)] if available]
+
+
+def extract_tab(page, backend=DEFAULT_BACKEND):
+    """
+    Read the raw chords and the capo text of a song page.
+
+    Only the chord sheet is parsed, with the requested backend; the rest of the page is never turned into a tree.
+
+    Parameters:
+    - page (str): HTML of a song page.
+    - backend (str): Name of the extraction backend, see available_backends.
+
+    Returns:
+    - tuple: List of chord names as written on the page and the text of the capo row, or None.
+    """
+    body = isolate_tab_body(page)
+    chords = BACKENDS[backend](body) if body else []
+    return chords, extract_capo_text(page)
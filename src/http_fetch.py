@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import re
+import time
+from urllib.parse import urljoin, urlsplit
+import aiohttp
+from src.standardize import transposer
+from src.utilities import create_driver, create_session
+from src.web_scraper import BASE_URL, get_search_url, extract_store, select_result, parse_chords
+from src.archive import raw_tab
+from src.journal import DONE, NOT_FOUND, FAILED
+from src.key_estimation import resolve_key
+from src.metrics import count, timed, update_progress
+from src.rate_limit import RateLimited, get_host, is_blocked
+from src.workers import WRITE_BATCH_SIZE, scrape_song, store_songs
+
+CHORD_TAG_PATTERN = re.compile(r'\[ch\](.*?)\[/ch\]')
+
+
+class BrowserRequired(Exception):
+    """Raised when a page doesn't embed its data and has to be rendered by a browser."""
+
+
+def get_tab_data(data):
+    """
+    Read the raw chords and the capo from the embedded store of a song page.
+
+    Parameters:
+    - data (dict): Page data of the store.
+
+    Returns:
+    - tuple: List of chord names as written on the page and the fret of the capo.
+    """
+    tab_view = data.get('tab_view') or {}
+    content = (tab_view.get('wiki_tab') or {}).get('content')
+    if content is None:
+        raise BrowserRequired("Song page has no chord content.")
+    chords = [chord.strip() for chord in CHORD_TAG_PATTERN.findall(content)]
+    capo = (tab_view.get('meta') or {}).get('capo') or 0
+    return chords, int(capo)
+
+
+@timed('fetch')
+async def fetch_page(session, url, cache=None, limiter=None):
+    """
+    Fetch a page with the HTTP client, from the page cache when possible.
+
+    Requests that miss the cache wait for the rate limit of their host, and report how the site responded.
+
+    Parameters:
+    - session (aiohttp.ClientSession): HTTP client session.
+    - url (str): URL of the page.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter.
+
+    Returns:
+    - str: HTML of the page, or None if the page doesn't exist.
+    """
+    page = cache.get(url) if cache else None
+    if page is not None:
+        return page
+    host = get_host(url)
+    if limiter:
+        await limiter.acquire_async(host)
+    start = time.monotonic()
+    try:
+        async with session.get(url) as response:
+            if response.status == 429 or response.status >= 500:
+                retry_after = response.headers.get('Retry-After')
+                retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+                # Server errors under load are a sign of overload as well, so they slow the host down too
+                if limiter:
+                    limiter.report(host, throttled=True, retry_after=retry_after)
+                if response.status == 429:
+                    raise RateLimited(f"Too many requests to {host}.", retry_after)
+                response.raise_for_status()
+            if response.status == 404:
+                page = None
+            else:
+                response.raise_for_status()
+                page = await response.text()
+    except asyncio.TimeoutError:
+        if limiter:
+            limiter.report(host, None)
+        raise
+    if page is not None and extract_store(page) is None and is_blocked(page):
+        if limiter:
+            limiter.report(host, throttled=True)
+        raise RateLimited(f"Blocked by {host}.")
+    if limiter:
+        limiter.report(host, time.monotonic() - start)
+    if page is None:
+        return None
+    if cache:
+        cache.put(url, page)
+    return page
+
+
+@timed('search')
+async def search_song_http(session, song, artist, base_url=BASE_URL, cache=None, limiter=None):
+    """
+    Search for a song by a specific artist on Ultimate Guitar without a browser.
+
+    Parameters:
+    - session (aiohttp.ClientSession): HTTP client session.
+    - song (str): Name of the song to search for.
+    - artist (str): Name of the artist of the song.
+    - base_url (str): Scheme and host of the site.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter.
+
+    Returns:
+    - str: URL of the best chord sheet, or None if the song was not found.
+    """
+    page = await fetch_page(session, get_search_url(song, artist, base_url), cache, limiter)
+    if page is None:
+        return None
+    if 'Nothing found for' in page:
+        return None
+    data = extract_store(page)
+    if data is None:
+        raise BrowserRequired("Search page has no embedded store.")
+    result = select_result(data.get('results') or [])
+    if result is None:
+        return None
+    # Keep the path of the result but point it at the host we are fetching from
+    return urljoin(base_url, urlsplit(result['tab_url']).path)
+
+
+@timed('tab')
+async def get_tab_http(session, url, cache=None, limiter=None):
+    """
+    Fetch a song page without a browser and read its raw chords and capo.
+
+    Parameters:
+    - session (aiohttp.ClientSession): HTTP client session.
+    - url (str): URL of the song page.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter.
+
+    Returns:
+    - tuple: List of chord names as written on the page and the fret of the capo, or None if the page
+      doesn't exist.
+    """
+    page = await fetch_page(session, url, cache, limiter)
+    if page is None:
+        return None
+    data = extract_store(page)
+    if data is None:
+        raise BrowserRequired("Song page has no embedded store.")
+    return get_tab_data(data)
+
+
+@timed('song')
+async def scrape_song_http(session, song, base_url=BASE_URL, cache=None, limiter=None, key_source='spotify'):
+    """
+    Search, transpose and parse a single song over plain HTTP.
+
+    Parameters:
+    - session (aiohttp.ClientSession): HTTP client session.
+    - song (dict): Dictionary containing song_name, artist and optionally key and mode.
+    - base_url (str): Scheme and host of the site.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter.
+    - key_source (str): Where the key of the song comes from, see resolve_key.
+
+    Returns:
+    - tuple: Outcome of the scrape (DONE, NOT_FOUND or FAILED) and the song data ready to be written to the
+      database, or None if the song could not be scraped.
+    """
+    song_name = song['song_name']
+    artist = song['artist']
+    url = await search_song_http(session, song_name, artist, base_url, cache, limiter)
+    tab = await get_tab_http(session, url, cache, limiter) if url else None
+    if tab is None:
+        logging.info(f"Song '{song_name}' by {artist} not available on Ultimate Guitar!")
+        return NOT_FOUND, None
+    chords, capo = tab
+    key, mode = resolve_key(song, chords, capo, key_source)
+    # Transpose the song to C Major
+    transposed = transposer(chords, key, mode, capo) if key is not None else None
+    if not transposed:
+        logging.error(f"Song '{song_name}' by {artist} could not be transposed!")
+        return FAILED, None
+    return DONE, {
+        'song_name': song_name,
+        'artist': artist,
+        'key': key,
+        'mode': mode,
+        'year': song.get('year'),
+        'progression': parse_chords(transposed),
+        **raw_tab(song, chords, capo, url)
+    }
+
+
+class BrowserFallback:
+    """A single WebDriver, started on first use, for the pages that can't be scraped over HTTP."""
+
+    def __init__(self, cache=None, limiter=None, key_source='spotify', base_url=BASE_URL):
+        self.driver = None
+        self.base_url = base_url
+        self.cache = cache
+        self.limiter = limiter
+        self.key_source = key_source
+        self.lock = asyncio.Lock()
+
+    async def scrape(self, song):
+        """Scrape a song with the fallback WebDriver, one song at a time."""
+        async with self.lock:
+            if self.driver is None:
+                self.driver = await asyncio.to_thread(create_driver)
+                if self.driver is None:
+                    return FAILED, "WebDriver could not be started"
+            return await asyncio.to_thread(scrape_song, self.driver, song, self.cache, self.limiter,
+                                           self.key_source, self.base_url)
+
+    def close(self):
+        """Close the fallback WebDriver if it was started."""
+        if self.driver is not None:
+            self.driver.quit()
+
+
+async def run_http(songs, database, genre, limiter, existing_songs, concurrency=8, progress=None, base_url=BASE_URL,
+                   cache=None, journal=None, key_source='spotify'):
+    """
+    Scrape songs over plain HTTP with a bounded number of concurrent requests.
+
+    The next song is only read from the stream once a request slot is free, so a stream fed by slow requests,
+    such as pages of Spotify results, is held back while every slot is busy.
+
+    Parameters:
+    - songs (iterable): Song dictionaries to scrape, e.g. a list or a generator streaming them.
+    - database (SongDatabase): Database the songs are stored in.
+    - genre (str): Genre of the songs.
+    - limiter (RateLimiter): Rate limiter shared by the concurrent requests.
+    - existing_songs (set): Set of (song_name, artist) tuples already in the database, updated in place.
+    - concurrency (int): Maximum number of songs fetched at the same time.
+    - progress (tqdm): Optional progress bar advanced once per song.
+    - base_url (str): Scheme and host of the site, overridden when replaying recorded pages.
+    - cache (PageCache): Optional page cache.
+    - journal (CrawlJournal): Optional crawl journal recording the state of every song.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    fallback = BrowserFallback(cache, limiter, key_source, base_url)
+    batch = []
+
+    async def process(session, song):
+        try:
+            if journal:
+                journal.start(song, genre)
+            try:
+                try:
+                    state, result = await scrape_song_http(session, song, base_url, cache, limiter, key_source)
+                except BrowserRequired:
+                    logging.info(f"Falling back to the browser for '{song['song_name']}' by {song['artist']}.")
+                    state, result = await fallback.scrape(song)
+            except RateLimited as e:
+                logging.warning(f"Rate limited on song '{song['song_name']}' by {song['artist']}: {e}")
+                state, result = FAILED, str(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error(f"Error fetching song '{song['song_name']}' by {song['artist']}: {e}")
+                state, result = FAILED, str(e) or type(e).__name__
+            except Exception as e:
+                logging.error(f"Error processing song '{song['song_name']}' by {song['artist']}: {e}")
+                state, result = FAILED, str(e)
+            count('songs', outcome=state)
+            # The event loop stores one batch at a time, so writes are never interleaved
+            if state == DONE:
+                batch.append(result)
+                if len(batch) >= WRITE_BATCH_SIZE:
+                    store_songs(database, batch[:], genre, existing_songs, journal)
+                    batch.clear()
+            elif journal:
+                journal.finish(song, genre, state, result)
+            update_progress(progress)
+        finally:
+            slots.release()
+
+    async def feed(session):
+        tasks = set()
+        stream = iter(songs)
+        try:
+            while True:
+                await slots.acquire()
+                # The stream may block on requests or the database, so it is read outside the event loop
+                song = await asyncio.to_thread(next, stream, None)
+                if song is None:
+                    slots.release()
+                    break
+                task = asyncio.create_task(process(session, song))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            logging.error(f"Error reading the songs to scrape: {e}")
+        finally:
+            await asyncio.gather(*tasks)
+
+    try:
+        async with create_session(concurrency) as session:
+            await feed(session)
+    finally:
+        if batch:
+            store_songs(database, batch, genre, existing_songs, journal)
+        fallback.close()
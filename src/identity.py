@@ -0,0 +1,159 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+# Parts of a title that name a release of the song rather than the song itself
+VERSION_WORDS = (r'(?:feat\.?|ft\.?|featuring|with|remaster(?:ed)?|\d{4} remaster(?:ed)?|radio edit|edit|'
+                 r'single version|album version|version|mono|stereo|deluxe|bonus track|live|explicit|clean)')
+BRACKETED_PATTERN = re.compile(r'[(\[][^)\]]*\b' + VERSION_WORDS + r'\b[^)\]]*[)\]]', re.I)
+SUFFIX_PATTERN = re.compile(r'\s+-\s+[^-]*\b' + VERSION_WORDS + r'\b.*$', re.I)
+# Separators of featured artists. Spotify names a single artist per track, so commas, '&', '/' and 'and' belong
+# to names such as 'Earth, Wind & Fire' and 'AC/DC'
+ARTIST_SEPARATOR_PATTERN = re.compile(r'\s*(?:\b(?:feat|ft)\b\.?|\bfeaturing\b)\s*', re.I)
+APOSTROPHE_PATTERN = re.compile(r"['\u2019`]")
+NON_WORD_PATTERN = re.compile(r'[^\w]+')
+DIGITS_PATTERN = re.compile(r'\d+')
+
+
+def fold(text):
+    """Fold case, accents and compatibility characters, and collapse punctuation and spaces."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    text = APOSTROPHE_PATTERN.sub('', text)
+    return NON_WORD_PATTERN.sub(' ', text.replace('&', ' and ')).strip()
+
+
+def normalize_title(title):
+    """
+    Reduce a song title to its canonical form.
+
+    Parameters:
+    - title (str): Song title (e.g., 'Song - Remastered 2011', 'Song (feat. X)').
+
+    Returns:
+    - str: Canonical title (e.g., 'song').
+    """
+    stripped = SUFFIX_PATTERN.sub('', BRACKETED_PATTERN.sub('', title))
+    return fold(stripped) or fold(title)
+
+
+def normalize_artist(artist):
+    """
+    Reduce the artist of a song to its primary artist in canonical form.
+
+    Parameters:
+    - artist (str): Artist or artists of the song (e.g., 'The Artist feat. Someone').
+
+    Returns:
+    - str: Canonical primary artist (e.g., 'artist').
+    """
+    primary = ARTIST_SEPARATOR_PATTERN.split(artist.strip(), maxsplit=1)[0] or artist
+    folded = fold(primary) or fold(artist)
+    return folded[4:] if folded.startswith('the ') and len(folded) > 4 else folded
+
+
+def song_key(song_name, artist):
+    """Return the canonical (title, primary artist) key of a song."""
+    return normalize_title(song_name), normalize_artist(artist)
+
+
+def max_distance(word):
+    """Return the number of edits tolerated in a word of a title, none for short words ('Lose' and 'Love')."""
+    return 0 if len(word) < 6 else 1 if len(word) < 12 else 2
+
+
+def bounded_distance(a, b, limit):
+    """
+    Compute the Levenshtein distance between two strings, giving up once it exceeds a limit.
+
+    Parameters:
+    - a (str): First string.
+    - b (str): Second string.
+    - limit (int): Largest distance of interest.
+
+    Returns:
+    - int: Edit distance, or limit + 1 if it exceeds the limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        # Only cells within limit of the diagonal can lead to a distance within the limit
+        current = [i] + [limit + 1] * len(b)
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != b[j - 1]))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def similar_titles(a, b):
+    """
+    Check if two canonical titles are spellings of the same title.
+
+    Parameters:
+    - a (str): First canonical title.
+    - b (str): Second canonical title.
+
+    Returns:
+    - bool: True if the titles only differ in their spaces or in a few edits of a single long word.
+    """
+    if a.replace(' ', '') == b.replace(' ', ''):
+        return True
+    words, others = a.split(), b.split()
+    if len(words) != len(others):
+        return False
+    differing = [(word, other) for word, other in zip(words, others) if word != other]
+    if len(differing) != 1:
+        return False
+    word, other = differing[0]
+    limit = max_distance(min(word, other, key=len))
+    return bool(limit) and bounded_distance(word, other, limit) <= limit
+
+
+class SongIdentityIndex:
+    """
+    Index of the songs of a crawl by canonical title and primary artist.
+
+    Lookups are a hash lookup of the canonical key first. Titles by the same artist are matched second if they
+    only differ in their spaces, or in a few edits of a single long word ('Lightning' and 'Lightening'), unless
+    their numbers differ ('Song 1' and 'Song 2' are different songs).
+    """
+
+    def __init__(self, songs=()):
+        self.keys = set()
+        self.titles = defaultdict(list)
+        for song_name, artist in songs:
+            self.add(song_name, artist)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, song_name, artist):
+        """Add a song to the index."""
+        title, primary = song_key(song_name, artist)
+        if (title, primary) not in self.keys:
+            self.keys.add((title, primary))
+            self.titles[primary].append(title)
+
+    def find(self, song_name, artist):
+        """
+        Find a song of the index that is the same song as the given one.
+
+        Parameters:
+        - song_name (str): Name of the song.
+        - artist (str): Artist of the song.
+
+        Returns:
+        - tuple: How the song matched ('exact' or 'fuzzy') and the canonical key it matched, or None.
+        """
+        title, primary = song_key(song_name, artist)
+        if (title, primary) in self.keys:
+            return 'exact', (title, primary)
+        digits = DIGITS_PATTERN.findall(title)
+        for candidate in self.titles.get(primary, ()):
+            if abs(len(candidate) - len(title)) <= 2 and DIGITS_PATTERN.findall(candidate) == digits \
+                    and similar_titles(title, candidate):
+                return 'fuzzy', (candidate, primary)
+        return None
@@ -0,0 +1,131 @@
+import logging
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILE = 'data/crawl_journal.sqlite'
+# States of a song in the journal
+PENDING = 'pending'
+IN_FLIGHT = 'in-flight'
+DONE = 'done'
+NOT_FOUND = 'not-found'
+FAILED = 'failed'
+# Songs missing on Ultimate Guitar are searched again after a month
+NOT_FOUND_TTL = 30 * 24 * 60 * 60
+RETRY_BACKOFF = 5 * 60
+MAX_RETRY_BACKOFF = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    song_name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_retry REAL NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    error TEXT,
+    PRIMARY KEY (song_name, artist, genre)
+);
+"""
+
+
+class CrawlJournal:
+    """
+    Persistent journal of the state of every song of a crawl.
+
+    Failed songs are retried with exponential backoff and songs that are not on Ultimate Guitar are kept in a
+    negative cache until their TTL expires, so a restarted crawl only scrapes the songs that are due.
+    """
+
+    def __init__(self, filename=JOURNAL_FILE, not_found_ttl=NOT_FOUND_TTL):
+        self.not_found_ttl = not_found_ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        # Songs that were in flight when the last crawl stopped are scraped again
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, IN_FLIGHT))
+
+    def filter_due(self, songs, genre):
+        """
+        Add new songs to the journal and return the songs that should be scraped now.
+
+        Parameters:
+        - songs (list): List of song dictionaries.
+        - genre (str): Genre of the songs.
+
+        Returns:
+        - list: Songs that are new, pending, due for a retry, or whose not-found entry has expired.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO jobs (song_name, artist, genre, state, updated) VALUES (?, ?, ?, ?, ?)",
+                ((song['song_name'], song['artist'], genre, PENDING, now) for song in songs))
+            skipped = set(self.connection.execute(
+                "SELECT song_name, artist FROM jobs WHERE genre = ? AND (state = ? OR next_retry > ?)",
+                (genre, DONE, now)))
+        due = [song for song in songs if (song['song_name'], song['artist']) not in skipped]
+        if len(due) < len(songs):
+            logging.info(f"Skipping {len(songs) - len(due)} songs that are done, not found or waiting for a retry.")
+        return due
+
+    def start(self, song, genre):
+        """
+        Mark a song as in flight.
+
+        Parameters:
+        - song (dict): Song dictionary.
+        - genre (str): Genre of the song.
+        """
+        self._update(song, genre, "state = ?", (IN_FLIGHT,))
+
+    def finish(self, song, genre, state, error=None):
+        """
+        Record the outcome of scraping a song and schedule its next attempt if needed.
+
+        Parameters:
+        - song (dict): Song dictionary.
+        - genre (str): Genre of the song.
+        - state (str): DONE, NOT_FOUND or FAILED.
+        - error (str): Error message of a failed attempt.
+        """
+        now = time.time()
+        if state == DONE:
+            self._update(song, genre, "state = ?, attempts = attempts + 1, next_retry = 0, error = NULL",
+                         (DONE,))
+        elif state == NOT_FOUND:
+            self._update(song, genre, "state = ?, attempts = attempts + 1, next_retry = ?, error = NULL",
+                         (NOT_FOUND, now + self.not_found_ttl))
+        else:
+            # Double the wait after every failed attempt
+            self._update(song, genre, "state = ?, attempts = attempts + 1, "
+                                      "next_retry = ? + MIN(? * (1 << MIN(attempts, 16)), ?), error = ?",
+                         (FAILED, now, RETRY_BACKOFF, MAX_RETRY_BACKOFF, error))
+
+    def _update(self, song, genre, assignments, params):
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"UPDATE jobs SET {assignments}, updated = ? WHERE song_name = ? AND artist = ? AND genre = ?",
+                (*params, time.time(), song['song_name'], song['artist'], genre))
+
+    def summary(self, genre):
+        """
+        Count the songs of a genre in each state.
+
+        Parameters:
+        - genre (str): Genre of the songs.
+
+        Returns:
+        - dict: Dictionary mapping states to numbers of songs.
+        """
+        with self.lock:
+            return dict(self.connection.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE genre = ? GROUP BY state", (genre,)))
+
+    def close(self):
+        """Close the journal."""
+        with self.lock:
+            self.connection.close()
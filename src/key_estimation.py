@@ -0,0 +1,197 @@
+import argparse
+from functools import lru_cache
+import numpy as np
+from src.chords import NOTE_NAMES, parse_chord, parse_roman
+
+# Krumhansl-Kessler probe tone profiles of C major and C minor
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+# Rows 0-11 are the major keys and rows 12-23 the minor keys, each profile rotated to its tonic
+PROFILES = np.array([np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)])
+QUALITY_INTERVALS = {"major": (0, 4, 7), "minor": (0, 3, 7), "diminished": (0, 3, 6), "augmented": (0, 4, 8)}
+# Roots and bass notes weigh more than the other chord tones
+ROOT_WEIGHT = 2.0
+BASS_WEIGHT = 1.0
+# Estimates with a smaller margin over the runner-up key are not trusted over Spotify's key
+MIN_CONFIDENCE = 0.05
+KEY_SOURCES = ['spotify', 'chords', 'auto']
+
+
+def chord_vector(chord):
+    """
+    Weigh the pitch classes of a parsed chord.
+
+    Parameters:
+    - chord (Chord): Parsed chord.
+
+    Returns:
+    - numpy.ndarray: Weight of every pitch class (0-11).
+    """
+    intervals = list(QUALITY_INTERVALS[chord.quality])
+    extension = chord.extension
+    if extension.startswith('sus'):
+        intervals[1] = 2 if extension.startswith('sus2') else 5
+    if extension.startswith('maj') and any(char.isdigit() for char in extension):
+        intervals.append(11)
+    elif extension.startswith(('7', '9', '11', '13')):
+        intervals.append(9 if chord.quality == "diminished" else 10)
+    elif extension.startswith('6'):
+        intervals.append(9)
+    vector = np.zeros(12)
+    vector[[(chord.root + interval) % 12 for interval in intervals]] = 1.0
+    vector[chord.root] += ROOT_WEIGHT - 1
+    if chord.bass is not None:
+        vector[chord.bass] += BASS_WEIGHT
+    return vector
+
+
+@lru_cache(maxsize=4096)
+def symbol_vector(symbol):
+    """Weigh the pitch classes of a chord symbol, or return None if the symbol is not recognized."""
+    chord = parse_chord(symbol)
+    return None if chord is None else chord_vector(chord)
+
+
+@lru_cache(maxsize=4096)
+def roman_vector(numeral):
+    """Weigh the pitch classes of a Roman numeral chord relative to C, or return None if it is not recognized."""
+    chord = parse_roman(numeral)
+    return None if chord is None else chord_vector(chord)
+
+
+def chord_histograms(songs, vector=symbol_vector):
+    """
+    Build the pitch class histogram of every song from its chords.
+
+    Parameters:
+    - songs (list): List of lists of chord symbols, one per song.
+    - vector (callable): Function weighing the pitch classes of a chord, symbol_vector or roman_vector.
+
+    Returns:
+    - numpy.ndarray: Array of shape (number of songs, 12).
+    """
+    histograms = np.zeros((len(songs), 12))
+    for index, chords in enumerate(songs):
+        vectors = [vector(chord) for chord in chords]
+        vectors = [weights for weights in vectors if weights is not None]
+        if vectors:
+            histograms[index] = np.sum(vectors, axis=0)
+    return histograms
+
+
+def estimate_keys(histograms):
+    """
+    Estimate the key of every song by correlating its pitch class histogram with the 24 key profiles.
+
+    Parameters:
+    - histograms (numpy.ndarray): Array of shape (number of songs, 12) from chord_histograms.
+
+    Returns:
+    - tuple: Arrays of the key (0-11, where 0 is C), the mode (0 for minor, 1 for major, as Spotify) and the
+      confidence of every song. The confidence is the margin between the correlations of the best key and the
+      best key other than its relative, 0 (and C major) for songs without chords.
+    """
+    histograms = np.atleast_2d(np.asarray(histograms, dtype=float))
+    centered = histograms - histograms.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    profiles = PROFILES - PROFILES.mean(axis=1, keepdims=True)
+    profiles /= np.linalg.norm(profiles, axis=1, keepdims=True)
+    # Pearson correlation of every song with every key, in a single matrix product
+    scores = (centered / np.where(norms > 0, norms, 1)) @ profiles.T
+    best = scores.argmax(axis=1)
+    # Relative keys (C major and A minor) transpose to the same numerals, so the confidence is the margin over
+    # the best key that would transpose the song differently
+    relatives = np.maximum(scores[:, :12], np.roll(scores[:, 12:], 3, axis=1))
+    relatives.sort(axis=1)
+    empty = norms[:, 0] == 0
+    confidence = np.where(empty, 0.0, relatives[:, -1] - relatives[:, -2])
+    return np.where(empty, 0, best % 12), np.where(empty, 1, best < 12).astype(int), confidence
+
+
+def estimate_key(chords):
+    """
+    Estimate the key of a single song from its chords.
+
+    Parameters:
+    - chords (list): List of chord symbols.
+
+    Returns:
+    - tuple: Key (0-11), mode (0 for minor, 1 for major) and confidence, see estimate_keys.
+    """
+    keys, modes, confidence = estimate_keys(chord_histograms([chords]))
+    return int(keys[0]), int(modes[0]), float(confidence[0])
+
+
+def resolve_key(song, chords, capo=0, key_source='auto'):
+    """
+    Choose the key a song is transposed from.
+
+    Keys estimated from the chords are the keys the chords are written in, so they are shifted up by the capo
+    to the key that sounds, which get_semitones shifts back down by the capo.
+
+    Parameters:
+    - song (dict): Dictionary with the key and mode from Spotify, which may be missing or empty.
+    - chords (list): List of chord names as written on the song page.
+    - capo (int): Fret of the capo on the song page.
+    - key_source (str): 'spotify' to use Spotify's key, 'chords' to estimate the key from the chords, 'auto' to
+      prefer the estimate when it is confident. Keys are estimated whenever Spotify has none.
+
+    Returns:
+    - tuple: Key (0-11) and mode (0 for minor, 1 for major) to transpose the song from, or (None, None) if
+      Spotify has no key and it can't be estimated.
+    """
+    key, mode = song.get('key'), song.get('mode')
+    spotify = (int(key), int(mode)) if key not in (None, '') and mode not in (None, '') else None
+    if key_source == 'spotify' and spotify:
+        return spotify
+    estimated_key, estimated_mode, confidence = estimate_key(chords)
+    if not confidence:
+        return spotify or (None, None)
+    if key_source == 'chords' or spotify is None or confidence >= MIN_CONFIDENCE:
+        return (estimated_key + capo) % 12, estimated_mode
+    return spotify
+
+
+def check_corpus(corpus):
+    """
+    Estimate the key of every stored progression of a corpus, which is C major or A minor for songs that were
+    transposed from the right key.
+
+    Parameters:
+    - corpus (Corpus): Corpus from src.corpus.load_corpus.
+
+    Returns:
+    - tuple: Arrays of the estimated key, mode and confidence of every song of the corpus.
+    """
+    vocabulary = np.array([roman_vector(symbol) if roman_vector(symbol) is not None else np.zeros(12)
+                           for symbol in corpus.vocabulary.symbols]).reshape(-1, 12)
+    chords, offsets, owners = corpus.sequences()
+    histograms = np.zeros((len(corpus), 12))
+    # Attribute every chord to the song of its sequence and sum the chord vectors per song in one pass
+    chord_owners = np.repeat(owners, np.diff(np.asarray(offsets)))
+    np.add.at(histograms, chord_owners, vocabulary[np.asarray(chords)])
+    return estimate_keys(histograms)
+
+
+def main():
+    """List the songs of a corpus whose progression doesn't sound like C major or A minor."""
+    # Imported here so keys can be estimated without the corpus module
+    from src.corpus import load_corpus
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('genre')
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE,
+                        help="Only list songs estimated with at least this confidence (default: %(default)s).")
+    args = parser.parse_args()
+    corpus = load_corpus(args.genre)
+    keys, modes, confidence = check_corpus(corpus)
+    # C major and its relative A minor are the keys of correctly transposed songs
+    suspicious = ~(((keys == 0) & (modes == 1)) | ((keys == 9) & (modes == 0))) & (confidence >= args.min_confidence)
+    names = [(name, artist) for chunk in corpus.chunks for name, artist in zip(chunk.song_names, chunk.artists)]
+    for index in np.flatnonzero(suspicious):
+        print(f"{names[index][0]} - {names[index][1]}: sounds like {NOTE_NAMES[keys[index]]} "
+              f"{'major' if modes[index] else 'minor'} ({confidence[index]:.2f})")
+    print(f"{int(suspicious.sum())} of {len(corpus)} songs may have been transposed from the wrong key.")
+
+
+if __name__ == '__main__':
+    main()
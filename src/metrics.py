@@ -0,0 +1,292 @@
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+METRICS_FILE = 'output/metrics.json'
+PROMETHEUS_FILE = 'output/metrics.prom'
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = 'chordcrawler'
+
+_disabled_span = nullcontext()
+
+
+class Histogram:
+    """Distribution of the durations of a stage in fixed buckets, as Prometheus histograms."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class Metrics:
+    """
+    Timing histograms of the pipeline stages and counters of song outcomes.
+
+    Metrics are disabled until enable is called; while disabled, spans and timed functions only check a flag.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started = None
+
+    def enable(self):
+        """Start collecting metrics, discarding earlier ones."""
+        with self.lock:
+            self.histograms, self.counters = {}, {}
+            self.started = time.time()
+            self.enabled = True
+
+    def disable(self):
+        """Stop collecting metrics."""
+        self.enabled = False
+
+    def observe(self, stage, seconds):
+        """Record the duration of a stage."""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1, **labels):
+        """Add to a counter, e.g. count('songs', outcome='done')."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, name, **labels):
+        """Return the value of a counter."""
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def throughput(self):
+        """Return the number of songs processed per minute since the metrics were enabled."""
+        if not self.started:
+            return 0.0
+        songs = sum(value for (name, _), value in list(self.counters.items()) if name == 'songs')
+        return songs * 60 / max(time.time() - self.started, 1e-9)
+
+    def postfix(self):
+        """
+        Summarize the outcomes and the throughput for the postfix of a progress bar.
+
+        Returns:
+        - dict: Number of songs found, not found and failed, and songs per minute.
+        """
+        return {'found': self.counter('songs', outcome='done'),
+                'missing': self.counter('songs', outcome='not-found'),
+                'errors': self.counter('songs', outcome='failed'), 'songs/min': f"{self.throughput():.1f}"}
+
+    def snapshot(self):
+        """
+        Return the current metrics.
+
+        Returns:
+        - dict: Start and update times, throughput, per stage count, total, mean, p50, p95 and maximum durations,
+          and counters.
+        """
+        with self.lock:
+            stages = {stage: {'count': histogram.count, 'sum_s': round(histogram.sum, 6),
+                              'mean_ms': round(histogram.sum * 1000 / histogram.count, 3),
+                              'p50_ms': round(histogram.quantile(0.5) * 1000, 3),
+                              'p95_ms': round(histogram.quantile(0.95) * 1000, 3),
+                              'max_ms': round(histogram.max * 1000, 3)}
+                      for stage, histogram in self.histograms.items()}
+            counters = {name + ''.join(f'[{label}={label_value}]' for label, label_value in labels): value
+                        for (name, labels), value in self.counters.items()}
+        return {'started': self.started, 'updated': time.time(), 'songs_per_min': round(self.throughput(), 2),
+                'stages': stages, 'counters': counters}
+
+    def prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+        - str: Histograms of the stages and counters.
+        """
+        lines = [f'# HELP {PREFIX}_stage_seconds Duration of the stages of the pipeline.',
+                 f'# TYPE {PREFIX}_stage_seconds histogram']
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + ('+Inf',), histogram.buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+                        lines.append(f'{PREFIX}_{name}_total{{{label_text}}} {value}' if label_text else
+                                     f'{PREFIX}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_file=METRICS_FILE, prometheus_file=PROMETHEUS_FILE):
+        """
+        Write the metrics to a JSON file and a Prometheus textfile.
+
+        Files are replaced atomically, so a collector never reads half a file.
+
+        Parameters:
+        - json_file (str): Path to the JSON file, or None to skip it.
+        - prometheus_file (str): Path to the Prometheus textfile, or None to skip it.
+        """
+        for filename, content in ((json_file, lambda: json.dumps(self.snapshot(), indent=2)),
+                                  (prometheus_file, self.prometheus)):
+            if not filename:
+                continue
+            try:
+                with open(filename + '.tmp', mode='w', encoding='utf-8') as file:
+                    file.write(content())
+                os.replace(filename + '.tmp', filename)
+            except FileNotFoundError:
+                logging.error("Directory not found!")
+            except PermissionError:
+                logging.error("Permission denied!")
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.stage, time.perf_counter() - self.start)
+
+
+registry = Metrics()
+
+
+def span(stage):
+    """
+    Time a block of code as a stage of the pipeline.
+
+    Parameters:
+    - stage (str): Name of the stage.
+
+    Returns:
+    - context manager: Span recording the duration of the block, or a no-op when metrics are disabled.
+    """
+    return _Span(stage) if registry.enabled else _disabled_span
+
+
+def timed(stage):
+    """
+    Decorate a function or coroutine function so every call is timed as a stage of the pipeline.
+
+    Parameters:
+    - stage (str): Name of the stage.
+
+    Returns:
+    - function: Decorator.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not registry.enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    registry.observe(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not registry.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    registry.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    """Add to a counter of the registry, see Metrics.count."""
+    registry.count(name, value, **labels)
+
+
+def update_progress(progress):
+    """
+    Advance a progress bar by one song, showing the outcomes and the throughput in its postfix.
+
+    Parameters:
+    - progress (tqdm): Progress bar, or None.
+    """
+    if progress is None:
+        return
+    if registry.enabled:
+        progress.set_postfix(registry.postfix(), refresh=False)
+    progress.update(1)
+
+
+class MetricsExporter:
+    """Background thread exporting the metrics periodically during a run, and once more when stopped."""
+
+    def __init__(self, interval=30, json_file=METRICS_FILE, prometheus_file=PROMETHEUS_FILE):
+        self.interval = interval
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            registry.export(self.json_file, self.prometheus_file)
+
+    def start(self):
+        """Start exporting the metrics."""
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread and write the final metrics."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        registry.export(self.json_file, self.prometheus_file)
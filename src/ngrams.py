@@ -0,0 +1,200 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# A chord may appear at most this many times in a progression window
+MAX_CHORD_REPEATS = 2
+
+
+class ChordVocabulary:
+    """Mapping between chord symbols and the small integer ids used to encode progressions."""
+
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.ids = {}
+        for symbol in symbols:
+            self.id(symbol)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def id(self, symbol):
+        """Return the id of a chord symbol, adding it to the vocabulary if it is new."""
+        chord_id = self.ids.get(symbol)
+        if chord_id is None:
+            chord_id = self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return chord_id
+
+    def encode(self, chords):
+        """
+        Encode a sequence of chord symbols as an array of chord ids.
+
+        Parameters:
+        - chords (list): List of chord symbols.
+
+        Returns:
+        - numpy.ndarray: Array of chord ids.
+        """
+        return np.fromiter((self.id(chord) for chord in chords), dtype=np.int32, count=len(chords))
+
+    def decode(self, codes):
+        """
+        Decode an array of chord ids back into chord symbols.
+
+        Parameters:
+        - codes (numpy.ndarray): Array of chord ids.
+
+        Returns:
+        - tuple: Tuple of chord symbols.
+        """
+        return tuple(self.symbols[code] for code in codes.tolist())
+
+
+def sliding_windows(codes, n):
+    """
+    Return every window of n consecutive chords as a read-only view, without copying the chords.
+
+    Parameters:
+    - codes (numpy.ndarray): Array of chord ids.
+    - n (int): Size of the windows.
+
+    Returns:
+    - numpy.ndarray: Array of shape (number of windows, n).
+    """
+    if len(codes) < n:
+        return np.empty((0, n), dtype=codes.dtype)
+    return sliding_window_view(codes, n)
+
+
+def bits_per_chord(vocabulary_size):
+    """Return the number of bits needed to store a chord id."""
+    return max(1, int(vocabulary_size - 1).bit_length())
+
+
+def pack_windows(windows, vocabulary_size):
+    """
+    Pack every window into a single 64-bit integer, so windows can be hashed and compared as scalars.
+
+    Parameters:
+    - windows (numpy.ndarray): Array of shape (number of windows, n) of chord ids.
+    - vocabulary_size (int): Number of distinct chord ids.
+
+    Returns:
+    - numpy.ndarray: Array of packed windows, or None if the windows don't fit in 64 bits.
+    """
+    n = windows.shape[1]
+    bits = bits_per_chord(vocabulary_size)
+    if bits * n > 64:
+        return None
+    packed = np.zeros(len(windows), dtype=np.uint64)
+    for column in range(n):
+        packed = (packed << np.uint64(bits)) | windows[:, column].astype(np.uint64)
+    return packed
+
+
+def first_occurrences(*keys):
+    """
+    Return the indexes of the first occurrence of every distinct key, in order of appearance.
+
+    Parameters:
+    - *keys (numpy.ndarray): Arrays of equal length whose values, taken together, form the keys.
+
+    Returns:
+    - numpy.ndarray: Sorted array of indexes.
+    """
+    # A stable sort keeps the first occurrence of every key at the start of its group
+    order = np.argsort(keys[0], kind='stable') if len(keys) == 1 else np.lexsort(keys[::-1])
+    starts = np.ones(len(order), dtype=bool)
+    for key in keys:
+        ordered = key[order]
+        starts[1:] &= ordered[1:] == ordered[:-1]
+    starts[1:] = ~starts[1:]
+    return np.sort(order[starts])
+
+
+def repetition_mask(windows, max_repeats=MAX_CHORD_REPEATS):
+    """
+    Flag the windows that don't repeat a chord back to back or more than max_repeats times.
+
+    Parameters:
+    - windows (numpy.ndarray): Array of shape (number of windows, n) of chord ids.
+    - max_repeats (int): Maximum number of times a chord may appear in a window.
+
+    Returns:
+    - numpy.ndarray: Boolean array, True for the windows that pass the filter.
+    """
+    if not len(windows):
+        return np.ones(0, dtype=bool)
+    repeated = (windows[:, 1:] == windows[:, :-1]).any(axis=1)
+    counts = (windows[:, :, None] == windows[:, None, :]).sum(axis=2, dtype=np.uint8)
+    return ~repeated & (counts.max(axis=1) <= max_repeats)
+
+
+def song_ngrams(codes, n, vocabulary_size=None, unique=True, filtered=True):
+    """
+    Extract the n-gram progressions of a single song.
+
+    Parameters:
+    - codes (numpy.ndarray): Array of chord ids of the song.
+    - n (int): Size of the progressions.
+    - vocabulary_size (int): Number of distinct chord ids, derived from the codes by default.
+    - unique (bool): Keep only the first occurrence of every progression.
+    - filtered (bool): Drop progressions with repeated chords, see repetition_mask.
+
+    Returns:
+    - numpy.ndarray: Array of shape (number of progressions, n) of chord ids, in order of appearance.
+    """
+    windows = sliding_windows(codes, n)
+    # Filtering first leaves fewer windows to deduplicate
+    if filtered:
+        windows = windows[repetition_mask(windows)]
+    if unique and len(windows):
+        if vocabulary_size is None:
+            vocabulary_size = int(codes.max()) + 1
+        packed = pack_windows(windows, vocabulary_size)
+        windows = windows[first_occurrences(*(windows.T if packed is None else [packed]))]
+    return windows
+
+
+def corpus_ngrams(songs, sizes, vocabulary_size, unique=True, filtered=True):
+    """
+    Extract the n-gram progressions of several sizes from a whole corpus in one pass per size.
+
+    The songs are concatenated into a single array, and windows that would span two songs are dropped.
+
+    Parameters:
+    - songs (list): List of arrays of chord ids, one per song.
+    - sizes (iterable): Sizes of the progressions (e.g., range(2, 9)).
+    - vocabulary_size (int): Number of distinct chord ids.
+    - unique (bool): Keep only the first occurrence of every progression within a song.
+    - filtered (bool): Drop progressions with repeated chords, see repetition_mask.
+
+    Returns:
+    - dict: Dictionary mapping every size to a tuple of the song index of every progression and the
+      (number of progressions, size) array of their chord ids.
+    """
+    lengths = np.array([len(song) for song in songs], dtype=np.int64)
+    codes = np.concatenate(songs) if songs else np.empty(0, dtype=np.int32)
+    song_index = np.repeat(np.arange(len(songs)), lengths)
+    output = {}
+    for n in sizes:
+        windows = sliding_windows(codes, n)
+        owners = song_index[:len(windows)]
+        # Windows must start and end within the same song
+        keep = owners == song_index[n - 1:] if len(windows) else np.zeros(0, dtype=bool)
+        if filtered:
+            keep &= repetition_mask(windows)
+        windows, owners = windows[keep], owners[keep]
+        if unique and len(windows):
+            packed = pack_windows(windows, vocabulary_size)
+            shift = bits_per_chord(vocabulary_size) * n
+            if packed is None:
+                indexes = first_occurrences(owners, *windows.T)
+            elif shift + int(owners[-1]).bit_length() <= 64:
+                # Sort on a single key holding both the song and the packed window
+                indexes = first_occurrences((owners.astype(np.uint64) << np.uint64(shift)) | packed)
+            else:
+                indexes = first_occurrences(owners, packed)
+            windows, owners = windows[indexes], owners[indexes]
+        output[n] = (owners, np.ascontiguousarray(windows))
+    return output
@@ -0,0 +1,367 @@
+import argparse
+import glob
+import hashlib
+import os
+import re
+import shutil
+from functools import lru_cache
+import numpy as np
+from src.chords import parse_roman
+from src.web_scraper import WINDOW_SIZE
+
+INDEX_DIR = 'output/index'
+# Number of buffered postings written to a new segment at once
+FLUSH_THRESHOLD = 500_000
+# Namespaces of the index keys
+EXACT = 'exact'
+PREFIX = 'prefix'
+RELATIVE = 'relative'
+SEGMENT_PATTERN = re.compile(r'segment-(\d+)(?:\.tmp)?$')
+
+
+@lru_cache(maxsize=1 << 16)
+def ngram_key(namespace, ngram):
+    """
+    Hash an n-gram of chords into a 64-bit index key.
+
+    Parameters:
+    - namespace (str): EXACT, PREFIX or RELATIVE.
+    - ngram (tuple): Tuple of chords.
+
+    Returns:
+    - int: Index key.
+    """
+    digest = hashlib.blake2b('\x1f'.join((namespace, *ngram)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def relative_form(ngram):
+    """
+    Describe an n-gram of Roman numeral chords by the intervals between its roots, so every transposition of
+    a progression has the same form.
+
+    Parameters:
+    - ngram (tuple): Tuple of Roman numeral chords.
+
+    Returns:
+    - tuple: Tuple of 'interval:quality:extension' strings, the interval of the first chord being '_'.
+    """
+    form = []
+    previous = None
+    for numeral in ngram:
+        chord = parse_roman(numeral)
+        if chord is None:
+            form.append(numeral)
+            previous = None
+            continue
+        interval = '_' if previous is None else (chord.root - previous) % 12
+        form.append(f"{interval}:{chord.quality}:{chord.extension}")
+        previous = chord.root
+    return tuple(form)
+
+
+def progression_keys(progression):
+    """
+    Compute the index keys of a song's progression.
+
+    Every contiguous n-gram of every sequence is indexed as it is and in its relative form, and every prefix of
+    every sequence is indexed separately for prefix lookups.
+
+    Parameters:
+    - progression (list): List of chord sequences in Roman numeral notation.
+
+    Returns:
+    - numpy.ndarray: Array of distinct index keys.
+    """
+    keys = set()
+    for sequence in progression:
+        sequence = tuple(sequence)
+        for end in range(1, len(sequence) + 1):
+            keys.add(ngram_key(PREFIX, sequence[:end]))
+            for start in range(end):
+                ngram = sequence[start:end]
+                keys.add(ngram_key(EXACT, ngram))
+                if len(ngram) > 1:
+                    keys.add(ngram_key(RELATIVE, relative_form(ngram)))
+    return np.fromiter(keys, dtype=np.uint64, count=len(keys))
+
+
+def parse_query(text):
+    """
+    Split a progression query such as 'I-V-vi-IV' or 'I V vi IV' into chords.
+
+    Parameters:
+    - text (str): Progression query.
+
+    Returns:
+    - tuple: Tuple of Roman numeral chords.
+    """
+    return tuple(chord for chord in re.split(r'[\s,\-–]+', text.strip()) if chord)
+
+
+class ProgressionIndex:
+    """
+    On-disk inverted index from progression n-grams to song ids.
+
+    Songs are buffered and written as immutable segments of sorted keys, offsets and postings. Queries
+    memory-map the segments and binary search their keys, so only the pages holding the matching postings are
+    read. compact merges the segments into one. Every segment records the largest song id it holds, so songs
+    stored but lost from the buffer, e.g. by a crash, can be indexed again with catch_up. Segment numbers are
+    reserved atomically, so several processes may write to the same index.
+    """
+
+    def __init__(self, directory=INDEX_DIR, max_ngram=WINDOW_SIZE):
+        self.directory = directory
+        self.max_ngram = max_ngram
+        self.buffer_keys = []
+        self.buffer_ids = []
+        self.buffered = 0
+        self.segments = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_paths(self):
+        # Segments still being written are skipped until they are renamed into place
+        return sorted(path for path in glob.glob(os.path.join(self.directory, 'segment-*'))
+                      if os.path.isdir(path) and not path.endswith('.tmp'))
+
+    def _reserve_segment(self):
+        paths = glob.glob(os.path.join(self.directory, 'segment-*'))
+        numbers = [int(match.group(1)) for match in map(SEGMENT_PATTERN.search, paths) if match]
+        number = max(numbers) + 1 if numbers else 0
+        while True:
+            path = os.path.join(self.directory, f'segment-{number:06d}')
+            # Creating the temporary directory is atomic, so only one process can reserve a number; the number
+            # is taken once its segment exists as well
+            try:
+                os.mkdir(path + '.tmp')
+            except FileExistsError:
+                number += 1
+                continue
+            if not os.path.exists(path):
+                return path
+            os.rmdir(path + '.tmp')
+            number += 1
+
+    def _load_segments(self):
+        if self.segments is None:
+            self.segments = [tuple(np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                                   for name in ('keys', 'offsets', 'postings')) for path in self._segment_paths()]
+        return self.segments
+
+    def add(self, song_id, progression, keys=None):
+        """
+        Add the progression of a song to the index.
+
+        Parameters:
+        - song_id (int): Id of the song in the database.
+        - progression (list): List of chord sequences in Roman numeral notation.
+        - keys (numpy.ndarray): Index keys of the progression if they were computed already, e.g. by another
+          process.
+        """
+        keys = progression_keys(progression) if keys is None else keys
+        self.buffer_keys.append(keys)
+        self.buffer_ids.append(np.full(len(keys), song_id, dtype=np.int64))
+        self.buffered += len(keys)
+        if self.buffered >= FLUSH_THRESHOLD:
+            self.flush()
+
+    def _write_segment(self, keys, ids):
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys)).astype(np.int64)
+        path = self._reserve_segment()
+        # Write to a temporary directory first, so readers never see half a segment
+        temporary = path + '.tmp'
+        np.save(os.path.join(temporary, 'keys.npy'), unique_keys)
+        np.save(os.path.join(temporary, 'offsets.npy'), offsets)
+        np.save(os.path.join(temporary, 'postings.npy'), ids)
+        np.save(os.path.join(temporary, 'last_id.npy'), ids.max() if len(ids) else np.int64(0))
+        os.rename(temporary, path)
+        self.segments = None
+
+    def flush(self):
+        """Write the buffered songs to a new segment."""
+        if not self.buffered:
+            return
+        self._write_segment(np.concatenate(self.buffer_keys), np.concatenate(self.buffer_ids))
+        self.buffer_keys, self.buffer_ids, self.buffered = [], [], 0
+
+    def last_song_id(self):
+        """Return the largest song id in the index, 0 if it is empty."""
+        last = max((int(ids.max()) for ids in self.buffer_ids if len(ids)), default=0)
+        for path in self._segment_paths():
+            filename = os.path.join(path, 'last_id.npy')
+            if os.path.exists(filename):
+                last = max(last, int(np.load(filename)))
+            else:
+                # Segments written before they recorded their largest song id
+                postings = np.load(os.path.join(path, 'postings.npy'), mmap_mode='r')
+                last = max(last, int(postings.max()) if len(postings) else 0)
+        return last
+
+    def catch_up(self, database):
+        """
+        Add the songs stored after the largest song id in the index, e.g. songs whose postings were still
+        buffered when a crawl crashed.
+
+        Parameters:
+        - database (SongDatabase): Database of songs.
+
+        Returns:
+        - int: Number of songs added.
+        """
+        added = 0
+        for song in database.iter_songs(after=self.last_song_id()):
+            self.add(song['id'], song['progression'])
+            added += 1
+        self.flush()
+        return added
+
+    def compact(self):
+        """Merge all segments into a single segment."""
+        self.flush()
+        paths = self._segment_paths()
+        if len(paths) < 2:
+            return
+        keys, ids = [], []
+        for segment_keys, offsets, postings in self._load_segments():
+            keys.append(np.repeat(np.asarray(segment_keys), np.diff(offsets)))
+            ids.append(np.asarray(postings))
+        keys, ids = np.concatenate(keys), np.concatenate(ids)
+        self.segments = None
+        self._write_segment(keys, ids)
+        for path in paths:
+            shutil.rmtree(path)
+        self.segments = None
+
+    def clear(self):
+        """Remove every segment and buffered song from the index."""
+        for path in self._segment_paths():
+            shutil.rmtree(path)
+        self.buffer_keys, self.buffer_ids, self.buffered = [], [], 0
+        self.segments = None
+
+    def lookup(self, key):
+        """
+        Return the ids of the songs posted under an index key.
+
+        Parameters:
+        - key (int): Index key.
+
+        Returns:
+        - numpy.ndarray: Sorted array of distinct song ids.
+        """
+        key = np.uint64(key)
+        matches = []
+        for keys, offsets, postings in self._load_segments():
+            position = np.searchsorted(keys, key)
+            if position < len(keys) and keys[position] == key:
+                matches.append(np.asarray(postings[offsets[position]:offsets[position + 1]]))
+        for keys, ids in zip(self.buffer_keys, self.buffer_ids):
+            if len(keys) and (keys == key).any():
+                matches.append(ids[:1])
+        if not matches:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(matches))
+
+    def _contains(self, namespace, progression, transform=tuple):
+        # Longer progressions match the songs holding all of their indexed n-grams
+        n = min(len(progression), self.max_ngram)
+        result = None
+        for start in range(len(progression) - n + 1):
+            ids = self.lookup(ngram_key(namespace, transform(progression[start:start + n])))
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+            if not len(result):
+                break
+        return result if result is not None else np.empty(0, dtype=np.int64)
+
+    def exact(self, progression):
+        """
+        Find the songs containing a progression.
+
+        Progressions longer than the indexed n-grams return the songs containing all of their n-grams.
+
+        Parameters:
+        - progression (tuple): Tuple of Roman numeral chords.
+
+        Returns:
+        - numpy.ndarray: Sorted array of song ids.
+        """
+        return self._contains(EXACT, tuple(progression))
+
+    def prefix(self, progression):
+        """
+        Find the songs with a chord sequence starting with a progression.
+
+        Parameters:
+        - progression (tuple): Tuple of at most max_ngram Roman numeral chords.
+
+        Returns:
+        - numpy.ndarray: Sorted array of song ids.
+        """
+        return self.lookup(ngram_key(PREFIX, tuple(progression)[:self.max_ngram]))
+
+    def transposed(self, progression):
+        """
+        Find the songs containing a progression in any transposition (e.g., 'I-V-vi-IV' also matches
+        'IV-I-ii-bVII').
+
+        Parameters:
+        - progression (tuple): Tuple of at least two Roman numeral chords.
+
+        Returns:
+        - numpy.ndarray: Sorted array of song ids.
+        """
+        return self._contains(RELATIVE, tuple(progression), relative_form)
+
+    def rebuild(self, database):
+        """
+        Rebuild the index from every song of a database.
+
+        Parameters:
+        - database (SongDatabase): Database of songs.
+        """
+        self.clear()
+        for song in database.iter_songs():
+            self.add(song['id'], song['progression'])
+        self.compact()
+
+    def close(self):
+        """Write the buffered songs to disk."""
+        self.flush()
+
+
+def main():
+    """Query the progression index from the command line."""
+    # Imported here so the index can be used without the storage module
+    from src.storage import SongDatabase
+    parser = argparse.ArgumentParser(description="Query the index of stored Roman numeral progressions.")
+    parser.add_argument('command', choices=['exact', 'prefix', 'transposed', 'build', 'compact'])
+    parser.add_argument('progression', nargs='?', help="Progression to look up, e.g. 'I-V-vi-IV'.")
+    parser.add_argument('--genre', help="Only list songs of this genre.")
+    parser.add_argument('--limit', type=int, default=50, help="Maximum number of songs listed (default: 50).")
+    args = parser.parse_args()
+    index = ProgressionIndex()
+    if args.command in ('build', 'compact'):
+        if args.command == 'build':
+            database = SongDatabase()
+            index.rebuild(database)
+            database.close()
+        else:
+            index.compact()
+        print(f"Index has {len(index._segment_paths())} segment(s).")
+        return
+    if not args.progression:
+        parser.error("a progression is required for lookups.")
+    ids = getattr(index, args.command)(parse_query(args.progression))
+    database = SongDatabase()
+    songs = [song for song in database.get_songs(ids.tolist()) if args.genre in (None, song['genre'])]
+    database.close()
+    print(f"{len(songs)} song(s) found.")
+    for song in songs[:args.limit]:
+        print(f"{song['song_name']} - {song['artist']} ({song['genre']})")
+
+
+if __name__ == '__main__':
+    main()
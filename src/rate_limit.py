@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_MAX_RATE = 4.0
+DEFAULT_MIN_RATE = 1 / 60
+# Additive increase per healthy response and multiplicative decrease per throttled response
+RATE_INCREASE = 0.05
+RATE_DECREASE = 0.5
+# Responses slower than this multiple of the average latency count as a sign of load
+SLOW_RESPONSE_FACTOR = 2.5
+# Milder multiplicative decrease per slow response, halfway between no decrease and RATE_DECREASE
+SLOW_RESPONSE_DECREASE = (1 + RATE_DECREASE) / 2
+MAX_BACKOFF = 300
+BLOCKED_MARKERS = ("Just a moment...", "Attention Required! | Cloudflare", "Sorry, you have been blocked",
+                   "captcha", "Too Many Requests")
+
+
+class RateLimited(Exception):
+    """Raised when the site throttles or blocks our requests."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_blocked(text):
+    """
+    Check if a page or page title is a captcha, block or throttling page.
+
+    Parameters:
+    - text (str): HTML or title of the page.
+
+    Returns:
+    - bool: True if the page blocks our requests, False otherwise.
+    """
+    return bool(text) and any(marker in text for marker in BLOCKED_MARKERS)
+
+
+def get_host(url):
+    """Return the host of a URL, used to key the rate limits."""
+    return urlsplit(url).netloc or url
+
+
+class HostLimit:
+    """Token bucket and congestion state of a single host."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.backoff_until = 0.0
+        self.failures = 0
+        self.latency = None
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter per host, shared by all workers of a crawl.
+
+    The rate of a host grows additively while its responses are fast and healthy, and is cut multiplicatively
+    on timeouts, HTTP 429s, captcha pages and slow responses (AIMD). Throttled responses also pause the host
+    with an exponential backoff, or for as long as the site asks with Retry-After.
+    """
+
+    def __init__(self, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE, rate=None):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.initial_rate = min(rate or 1.0, max_rate)
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_delay(cls, delay):
+        """
+        Create a rate limiter that never sends requests to a host closer together than a delay.
+
+        Parameters:
+        - delay (float): Minimum delay between requests to a host in seconds, 0 for the default maximum rate.
+
+        Returns:
+        - RateLimiter: Rate limiter bounded by the delay.
+        """
+        return cls(max_rate=1 / delay if delay > 0 else DEFAULT_MAX_RATE)
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostLimit(self.initial_rate)
+        return self.hosts[host]
+
+    def reserve(self, host):
+        """
+        Take a token from the bucket of a host.
+
+        Parameters:
+        - host (str): Host the request is sent to.
+
+        Returns:
+        - float: Number of seconds to wait before sending the request.
+        """
+        with self.lock:
+            limit = self._host(host)
+            now = time.monotonic()
+            limit.tokens = min(1.0, limit.tokens + (now - limit.updated) * limit.rate)
+            limit.updated = now
+            limit.tokens -= 1
+            wait = -limit.tokens / limit.rate if limit.tokens < 0 else 0.0
+            return max(wait, limit.backoff_until - now)
+
+    def acquire(self, host):
+        """Block the calling thread until a request may be sent to a host."""
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, host):
+        """Wait without blocking the event loop until a request may be sent to a host."""
+        wait = self.reserve(host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def report(self, host, latency=None, throttled=False, retry_after=None):
+        """
+        Adjust the rate of a host to the outcome of a request.
+
+        Parameters:
+        - host (str): Host the request was sent to.
+        - latency (float): Duration of the request in seconds, None if it timed out.
+        - throttled (bool): True if the response was an HTTP 429 or 5xx, a captcha or a block page.
+        - retry_after (float): Seconds the site asked us to wait, if any.
+        """
+        with self.lock:
+            limit = self._host(host)
+            if throttled or latency is None:
+                limit.failures += 1
+                limit.rate = max(self.min_rate, limit.rate * RATE_DECREASE)
+                backoff = retry_after if retry_after is not None else min(2 ** limit.failures, MAX_BACKOFF)
+                limit.backoff_until = time.monotonic() + backoff
+                logging.warning(f"Throttled by {host}, slowing down to {limit.rate:.3f} requests/s "
+                                f"and pausing for {backoff:.0f} seconds.")
+                return
+            limit.failures = 0
+            if limit.latency is not None and latency > SLOW_RESPONSE_FACTOR * limit.latency:
+                limit.rate = max(self.min_rate, limit.rate * SLOW_RESPONSE_DECREASE)
+            else:
+                limit.rate = min(self.max_rate, limit.rate + RATE_INCREASE)
+            # Exponentially weighted average of the latency
+            limit.latency = latency if limit.latency is None else 0.8 * limit.latency + 0.2 * latency
+
+    def state(self, host):
+        """
+        Return the current rate and backoff state of a host.
+
+        Parameters:
+        - host (str): Host to describe.
+
+        Returns:
+        - dict: Rate in requests per second, remaining backoff in seconds, consecutive throttled responses
+          and average latency in seconds.
+        """
+        with self.lock:
+            limit = self._host(host)
+            return {'rate': limit.rate, 'backoff': max(0.0, limit.backoff_until - time.monotonic()),
+                    'failures': limit.failures, 'latency': limit.latency}
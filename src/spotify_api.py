@@ -1,13 +1,28 @@
 import os
 import csv
+import time
+import itertools
 import spotipy
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyClientCredentials
+from src.metrics import timed
 
 # Load environment variables for Spotify API credentials
 load_dotenv()
 
+PAGE_SIZE = 50
+# Maximum number of track ids accepted by a single audio features request
+AUDIO_FEATURES_BATCH = 100
+# Pages of search results requested ahead of the songs being consumed
+MAX_CONCURRENT_PAGES = 4
+MAX_RETRIES = 5
+TRACK_METADATA_FILE = 'data/track_metadata.csv'
+SPOTIFY_FIELDS = ['artist', 'song_name', 'key', 'mode', 'year']
+
 
 def get_spotify_client():
     """
@@ -18,86 +33,219 @@ def get_spotify_client():
     """
     client_id = os.getenv("CLIENT_ID")
     client_secret = os.getenv("CLIENT_SECRET")
-    return spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=client_id, client_secret=client_secret))
+    # Rate limited requests are retried by call_with_retry, so they aren't retried a second time by spotipy
+    return spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=client_id, client_secret=client_secret),
+                           status_retries=0)
 
 
-def fetch_songs(genre, num_songs, start_year, end_year):
+def call_with_retry(func, *args, **kwargs):
     """
-    Fetch songs from Spotify based on the provided genre.
+    Call the Spotify API, backing off and retrying when the request is rate limited or the server fails.
 
     Parameters:
-    - genre (str): The genre of songs to fetch.
+    - func (callable): Spotify client method to call.
+    - *args, **kwargs: Arguments passed to the method.
 
     Returns:
-    - list: List of dictionaries containing song details.
+    - dict: Response of the Spotify API.
     """
-    sp = get_spotify_client()
-    songs = []
-    full_pages = num_songs // 50  # Number of full pages
-    remaining_songs = num_songs % 50  # Songs on the last page
-    offset = 0
+    for attempt in range(MAX_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except SpotifyException as e:
+            if (e.http_status != 429 and e.http_status < 500) or attempt == MAX_RETRIES - 1:
+                raise
+            retry_after = (e.headers or {}).get('Retry-After')
+            wait = int(retry_after) if retry_after else 2 ** attempt
+            logging.warning(f"Spotify request failed with status {e.http_status}, retrying in {wait} seconds.")
+            time.sleep(wait)
+
+
+def read_track_metadata(filename=TRACK_METADATA_FILE):
+    """
+    Read the key and mode of every track fetched by earlier runs.
 
+    Parameters:
+    - filename (str): Path to the track metadata CSV file.
+
+    Returns:
+    - dict: Dictionary mapping track ids to (key, mode) tuples.
+    """
     try:
-        # Fetch full pages of songs
-        for _ in range(full_pages):
-            results = sp.search(q=f'genre:"{genre}" year:{start_year}-{end_year}',
-                                market='US', type='track', limit=50, offset=offset)
-            # Process results and update offset
-            songs.extend(process_results(results, sp))
-            offset += 50
-
-        # Fetch remaining songs
-        if remaining_songs > 0:
-            results = sp.search(q=f'genre:"{genre}" year:{start_year}-{end_year}',
-                                market='US', type='track', limit=remaining_songs, offset=offset)
-            songs.extend(process_results(results, sp))
-
-        # Save songs to spotify_songs_(genre).csv
-        spotify_save(songs, genre)
-        logging.info(f"Saved {len(songs)} songs to 'spotify_songs_{genre}.csv'.")
-        return songs
+        with open(filename, mode='r', encoding='utf-8') as file:
+            return {row['track_id']: (int(row['key']), int(row['mode'])) for row in csv.DictReader(file)}
+    except FileNotFoundError:
+        return {}
+
+
+def save_track_metadata(metadata, filename=TRACK_METADATA_FILE):
+    """
+    Append the key and mode of newly fetched tracks to the track metadata CSV file.
+
+    Parameters:
+    - metadata (dict): Dictionary mapping track ids to (key, mode) tuples.
+    - filename (str): Path to the track metadata CSV file.
+    """
+    try:
+        new_file = not os.path.exists(filename)
+        with open(filename, mode='a', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(['track_id', 'key', 'mode'])
+            for track_id, (key, mode) in metadata.items():
+                writer.writerow([track_id, key, mode])
     except FileNotFoundError:
         logging.error("Directory not found!")
     except PermissionError:
         logging.error("Permission denied!")
-    except UnicodeEncodeError as e:
-        logging.error(f"Encoding error: {e}")
 
 
-def process_results(results, sp):
-    """Process the results from the Spotify search and return a list of song details."""
-    songs = []
-    fetched_songs = results['tracks']['items']
-    for track in fetched_songs:
-        track_id = track['id']
-        features = sp.audio_features([track_id])[0]
-        if features:
-            key = features['key']
-            mode = features['mode']
-            songs.append(
-                {'artist': track['artists'][0]['name'],
-                 'song_name': track['name'], 'key': key, 'mode': mode})
-    return songs
+@timed('audio_features')
+def get_audio_features(sp, track_ids, metadata=None):
+    """
+    Get the key and mode of tracks, requesting only the tracks that are not stored locally yet.
 
+    Parameters:
+    - sp (spotipy.Spotify): Spotify client.
+    - track_ids (list): List of Spotify track ids.
+    - metadata (dict): Track metadata read by read_track_metadata, updated in place; read from disk if None.
 
-def spotify_save(songs, genre):
+    Returns:
+    - dict: Dictionary mapping track ids to (key, mode) tuples, missing tracks without audio features.
     """
-    Save song details to a CSV file named 'spotify_songs_(genre).csv'.
+    metadata = read_track_metadata() if metadata is None else metadata
+    missing = list(dict.fromkeys(track_id for track_id in track_ids if track_id not in metadata))
+    fetched = {}
+    for start in range(0, len(missing), AUDIO_FEATURES_BATCH):
+        batch = missing[start:start + AUDIO_FEATURES_BATCH]
+        for track_id, features in zip(batch, call_with_retry(sp.audio_features, batch)):
+            if features:
+                fetched[track_id] = (features['key'], features['mode'])
+    if fetched:
+        save_track_metadata(fetched)
+        metadata.update(fetched)
+    logging.info(f"Fetched audio features of {len(fetched)} tracks, {len(track_ids) - len(missing)} were stored.")
+    return metadata
+
+
+@timed('spotify')
+def search_page(sp, query, offset, limit):
+    """Request a page of track search results from Spotify."""
+    return call_with_retry(sp.search, q=query, market='US', type='track', limit=limit, offset=offset)
+
+
+def stream_songs(genre, num_songs, start_year, end_year, audio_features=True):
+    """
+    Fetch songs from Spotify based on the provided genre, yielding the songs of every page as soon as it arrives.
+
+    A few pages are requested ahead, in order, and no more are requested while the songs are not consumed, so
+    a slow consumer holds back the requests and memory stays flat whatever the number of songs. Pages of tracks
+    without stored audio features are yielded once AUDIO_FEATURES_BATCH of them can be looked up at once.
 
     Parameters:
-    - songs (list): List of dictionaries containing song details.
+    - genre (str): The genre of songs to fetch.
+    - num_songs (int): Number of songs to fetch.
+    - start_year (int): First year of the release date range.
+    - end_year (int): Last year of the release date range.
+    - audio_features (bool): Look up the key and mode of the songs, which are otherwise estimated from their
+      chords.
+
+    Returns:
+    - generator: Dictionaries containing song details.
+    """
+    sp = get_spotify_client()
+    query = f'genre:"{genre}" year:{start_year}-{end_year}'
+    # Offset and size of every page of search results
+    pages = iter([(offset, min(PAGE_SIZE, num_songs - offset)) for offset in range(0, num_songs, PAGE_SIZE)])
+    metadata = read_track_metadata() if audio_features else None
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGES) as executor:
+        requests = deque(executor.submit(search_page, sp, query, offset, limit)
+                         for offset, limit in itertools.islice(pages, MAX_CONCURRENT_PAGES))
+        buffered, missing = [], 0
+        while requests:
+            result = requests.popleft().result()
+            for offset, limit in itertools.islice(pages, 1):
+                requests.append(executor.submit(search_page, sp, query, offset, limit))
+            buffered.append(result)
+            if audio_features:
+                missing += sum(track['id'] not in metadata for track in result['tracks']['items'])
+            # Pages whose tracks aren't stored locally are held back until their audio features fill a request
+            if not missing or missing >= AUDIO_FEATURES_BATCH or not requests:
+                yield from process_results(buffered, sp, audio_features, metadata)
+                buffered, missing = [], 0
+
+
+def save_songs(songs, genre):
+    """
+    Save song details to a CSV file named 'spotify_songs_(genre).csv' as they stream through.
+
+    Parameters:
+    - songs (iterable): Dictionaries containing song details.
     - genre (str): Genre of the songs.
+
+    Returns:
+    - generator: The songs, unchanged.
     """
+    file = writer = None
     try:
-        with open(f'data/spotify_songs_{genre}.csv', 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['artist', 'song_name', 'key', 'mode']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for song in songs:
-                writer.writerow(song)
+        file = open(f'data/spotify_songs_{genre}.csv', 'w', newline='', encoding='utf-8')
+        writer = csv.DictWriter(file, fieldnames=SPOTIFY_FIELDS)
+        writer.writeheader()
     except FileNotFoundError:
         logging.error("Directory not found!")
     except PermissionError:
         logging.error("Permission denied!")
-    except UnicodeEncodeError as e:
-        logging.error(f"Encoding error: {e}")
\ No newline at end of file
+    saved = 0
+    try:
+        for song in songs:
+            if writer:
+                try:
+                    writer.writerow(song)
+                    saved += 1
+                except UnicodeEncodeError as e:
+                    logging.error(f"Encoding error: {e}")
+            yield song
+    finally:
+        if file:
+            file.close()
+            logging.info(f"Saved {saved} songs to 'spotify_songs_{genre}.csv'.")
+
+
+def fetch_songs(genre, num_songs, start_year, end_year, audio_features=True):
+    """
+    Fetch songs from Spotify based on the provided genre.
+
+    Parameters:
+    - genre (str): The genre of songs to fetch.
+    - num_songs (int): Number of songs to fetch.
+    - start_year (int): First year of the release date range.
+    - end_year (int): Last year of the release date range.
+    - audio_features (bool): Look up the key and mode of the songs, which are otherwise estimated from their
+      chords.
+
+    Returns:
+    - list: List of dictionaries containing song details.
+    """
+    return list(save_songs(stream_songs(genre, num_songs, start_year, end_year, audio_features), genre))
+
+
+def process_results(results, sp, audio_features=True, metadata=None):
+    """
+    Process the pages of results from the Spotify search and return a list of song details.
+
+    Songs without audio features keep an empty key and mode, which are estimated from their chords when they
+    are scraped.
+    """
+    tracks = [track for result in results for track in result['tracks']['items']]
+    # Look up the key and mode of all tracks at once
+    features = get_audio_features(sp, [track['id'] for track in tracks], metadata) if audio_features else {}
+    songs = []
+    for track in tracks:
+        key, mode = features.get(track['id'], (None, None))
+        # Release dates are 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' depending on their precision
+        release_date = (track.get('album') or {}).get('release_date') or ''
+        songs.append(
+            {'artist': track['artists'][0]['name'],
+             'song_name': track['name'], 'key': key, 'mode': mode,
+             'year': int(release_date[:4]) if release_date[:4].isdigit() else None})
+    return songs
@@ -1,51 +1,88 @@
-from selenium.webdriver.common.by import By
 import re
 import logging
+from src.chords import parse_chord, format_chord, to_roman
+from src.metrics import timed
 
 
-def transposer(driver, key, mode):
+def parse_capo(capo_text):
     """
-    Transpose the chords of a song to the key of C using the Ultimate Guitar website's transpose feature.
+    Parse the capo position from the text of the "Capo" row on a song page.
+
+    Parameters:
+    - capo_text (str): Text of the capo row (e.g., '3rd fret', 'no capo'), or None if the row is missing.
+
+    Returns:
+    - int: Fret of the capo, 0 if there is no capo.
+    """
+    if not capo_text:
+        logging.warning("Capo not found! Defaulting to 0.")
+        return 0
+    if capo_text == 'no capo':
+        return 0
+    match = re.search(r'\d+', capo_text)
+    return int(match.group()) if match else 0
+
+
+def get_semitones(key, mode, capo=0):
+    """
+    Calculate how many semitones a song has to be shifted to end up in C Major.
 
     Parameters:
-    - driver (WebDriver): Selenium WebDriver object positioned on a song page.
     - key (int): Key of the song (0-11, where 0 is C, 1 is C#/Db, etc.).
     - mode (int): Mode of the song (0 for minor, 1 for major).
+    - capo (int): Fret of the capo on the song page.
 
     Returns:
-    - bool: True if the transposition was successful, False otherwise.
+    - int: Shift in semitones between -5 and 6.
     """
-    capo_row = driver.find_elements(By.XPATH, "//th[text()='Capo: ']/following-sibling::td/span")
-    capo_text = capo_row[0].text
-    if capo_text:
-        if capo_text == 'no capo':
-            capo = 0
-        else:
-            capo = int(re.search(r'\d+', capo_text).group())
-    else:
-        capo = 0
-        logging.warning("Capo not found! Defaulting to 0.")
-    # Get transpose buttons
-    transpose_down = driver.find_element(By.XPATH, "//span[contains(text(), 'Transpose')]//following-sibling"
-                                                   "::span//button[span[text()='−1']]")
-    transpose_up = driver.find_element(By.XPATH, "//span[contains(text(), 'Transpose')]//following-sibling"
-                                                 "::span//button[span[text()='+1']]")
     # Transpose up three half steps if the song is in minor
     if mode == 0:
         key = (key + 3) % 12
-    # Transpose up by the capo
-    if capo != 0:
-        key = (key + capo) % 12
-    # Transpose to C Major
-    if key in [6, 7, 8, 9, 10, 11]:
-        while key != 0:
-            key = (key + 1) % 12
-            transpose_up.click()
-    elif key in [1, 2, 3, 4, 5]:
-        while key != 0:
-            key = (key - 1) % 12
-            transpose_down.click()
-    return True
+    # The chords are written as shapes below a capo, so they sit capo semitones below the key that sounds
+    key = (key - capo) % 12
+    # Keys above the tritone are shifted up, the rest are shifted down
+    return 12 - key if key >= 6 else -key
+
+
+def transpose_chord(chord, semitones):
+    """
+    Transpose a single chord symbol, including the bass note of slash chords.
+
+    Parameters:
+    - chord (str): Chord symbol (e.g., 'F#m7/C#').
+    - semitones (int): Number of semitones to shift the chord by.
+
+    Returns:
+    - str: Transposed chord symbol, or the original symbol if it has no recognizable root.
+    """
+    parsed = parse_chord(chord)
+    if not semitones or parsed is None:
+        return chord
+    return format_chord(parsed, semitones)
+
+
+@timed('transpose')
+def transposer(chords, key, mode, capo=0):
+    """
+    Transpose the chords of a song to the key of C without interacting with the song page.
+
+    Parameters:
+    - chords (list): List of chord names as written on the song page.
+    - key (int): Key of the song (0-11, where 0 is C, 1 is C#/Db, etc.).
+    - mode (int): Mode of the song (0 for minor, 1 for major).
+    - capo (int): Fret of the capo on the song page.
+
+    Returns:
+    - list: List of chord names transposed to C Major.
+    """
+    semitones = get_semitones(key, mode, capo)
+    cache = {}
+    transposed = []
+    for chord in chords:
+        if chord not in cache:
+            cache[chord] = transpose_chord(chord, semitones)
+        transposed.append(cache[chord])
+    return transposed
 
 
 def convert_to_roman(chords):
@@ -58,42 +95,29 @@ def convert_to_roman(chords):
     Returns:
     - str: String of chords in Roman numeral notation separated by hyphens.
     """
-    # Define the diatonic chords and their Roman numerals in C major
-    roman_numerals = ["I", "II", "III", "IV", "V", "VI", "VII"]
-    all_roots = ["C", "D", "E", "F", "G", "A", "B", "C#", "D#", "F#", "G#", "A#", "Db", "Eb", "Gb", "Ab", "Bb"]
+    return '-'.join(to_roman(chord) for chord in chords)
 
-    output = []
 
-    for chord in chords:
-        # Handle slash chords by removing the bass note
-        if '/' in chord:
-            chord = chord.split('/')[0]
-
-        # Extract the root, sharp/flat, and type of the chord
-        root = chord[0]  # First character is always part of the root
-        if len(chord) > 1 and chord[1] in ['#', 'b']:
-            root += chord[1]
-            chord_type = chord[2:]
-        else:
-            chord_type = chord[1:]
-
-        # Convert the root to Roman numeral
-        try:
-            index = all_roots.index(root)
-            roman_chord = roman_numerals[index % 7]
-            chord_type = chord_type.lower()
-            # Handle common chord types
-            if 'maj' in chord_type:
-                pass  # Major chords are already uppercase
-            elif 'dim' in chord_type:
-                roman_chord += "°"  # Diminished chords are represented with a degree symbol
-            elif 'aug' in chord_type:
-                roman_chord += "+"  # Augmented chords are represented with a plus symbol
-            elif 'm' in chord_type or 'min' in chord_type:
-                roman_chord = roman_chord.lower()
-            # Append the rest of the chord type (like 7sus4, 7add9, etc.)
-            roman_chord += chord_type.replace('maj', '').replace('min', '').replace('dim', '').replace('m', '')
-            output.append(roman_chord)
-        except ValueError:
-            output.append(f"Chord {chord} not recognized")
-    return '-'.join(output)
+def convert_many(sequences):
+    """
+    Convert many chord sequences to Roman numeral notation at once.
+
+    Every distinct chord is only converted once, however many of the sequences it appears in.
+
+    Parameters:
+    - sequences (list): List of chord sequences in the key of C.
+
+    Returns:
+    - list: List of tuples of chords in Roman numeral notation, in the same order as the input.
+    """
+    converted = {}
+    output = []
+    for seq in sequences:
+        roman_sequence = []
+        for chord in seq:
+            roman_chord = converted.get(chord)
+            if roman_chord is None:
+                roman_chord = converted[chord] = to_roman(chord)
+            roman_sequence.append(roman_chord)
+        output.append(tuple(roman_sequence))
+    return output
@@ -0,0 +1,245 @@
+import ast
+import csv
+import json
+import logging
+import sqlite3
+import threading
+from src.metrics import timed
+
+DATABASE_FILE = 'output/chordcrawler.sqlite'
+CSV_FIELDS = ['song_name', 'artist', 'key', 'mode', 'progression']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY,
+    song_name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    key INTEGER,
+    mode INTEGER,
+    year INTEGER,
+    UNIQUE (song_name, artist, genre)
+);
+CREATE INDEX IF NOT EXISTS songs_genre ON songs (genre);
+CREATE TABLE IF NOT EXISTS progressions (
+    song_id INTEGER NOT NULL REFERENCES songs (id),
+    position INTEGER NOT NULL,
+    chords TEXT NOT NULL,
+    PRIMARY KEY (song_id, position)
+) WITHOUT ROWID;
+"""
+
+
+class SongDatabase:
+    """
+    SQLite database of scraped songs and their chord progressions.
+
+    Songs are keyed by (song_name, artist, genre) and each sequence of a progression is stored as its own row
+    holding a JSON list of Roman numeral chords. The database runs in WAL mode, so readers don't block the
+    writer and several processes can write to it safely. Songs added while a progression index is attached are
+    added to the index once committed, songs missing from it are added when the database is opened, and the raw
+    tabs of songs added while a chord archive is attached are archived.
+    """
+
+    def __init__(self, filename=DATABASE_FILE, index=None, archive=None):
+        self.filename = filename
+        self.index = index
+        self.archive = archive
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Databases created before songs had a release year are migrated in place
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(songs)")}
+        if 'year' not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE songs ADD COLUMN year INTEGER")
+        # Index the songs whose postings were lost, e.g. when an earlier crawl crashed before flushing them
+        if index is not None:
+            caught_up = index.catch_up(self)
+            if caught_up:
+                logging.info(f"Added {caught_up} songs missing from the progression index.")
+
+    def get_existing_songs(self, genre):
+        """
+        Retrieve the songs of a genre that are already stored.
+
+        Parameters:
+        - genre (str): Genre of songs to retrieve.
+
+        Returns:
+        - set: Set of tuples containing song_name and artist.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT song_name, artist FROM songs WHERE genre = ?", (genre,))
+            return set(rows)
+
+    def count_songs(self, genre):
+        """
+        Count the songs stored for a genre.
+
+        Parameters:
+        - genre (str): Genre of songs to count.
+
+        Returns:
+        - int: Number of songs.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM songs WHERE genre = ?", (genre,)).fetchone()[0]
+
+    def add_songs(self, songs, genre):
+        """
+        Store a batch of songs and their progressions in a single transaction.
+
+        Songs that are already stored for the genre are left unchanged.
+
+        Parameters:
+        - songs (list): List of song data dictionaries with song_name, artist, key, mode, progression and
+          optionally the release year.
+        - genre (str): Genre of the songs.
+
+        Returns:
+        - list: Ids of the songs that were added, in the order of the batch.
+        """
+        added = []
+        with self.lock:
+            with self.connection:
+                for song in songs:
+                    cursor = self.connection.execute(
+                        "INSERT OR IGNORE INTO songs (song_name, artist, genre, key, mode, year) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (song['song_name'], song['artist'], genre, song['key'], song['mode'],
+                         song.get('year') or None))
+                    if not cursor.rowcount:
+                        continue
+                    song_id = cursor.lastrowid
+                    self.connection.executemany(
+                        "INSERT INTO progressions (song_id, position, chords) VALUES (?, ?, ?)",
+                        ((song_id, position, json.dumps(list(sequence), ensure_ascii=False))
+                         for position, sequence in enumerate(song['progression'])))
+                    added.append((song_id, song))
+            # Songs are only indexed and archived once committed, so a rolled back batch leaves nothing behind
+            if self.index is not None:
+                for song_id, song in added:
+                    self.index.add(song_id, song['progression'], song.get('index_keys'))
+        # Songs that were already stored keep the tab they were stored from
+        if self.archive is not None and added:
+            self.archive.add([song for _, song in added], genre)
+        return [song_id for song_id, _ in added]
+
+    def iter_songs(self, genre=None, after=0):
+        """
+        Iterate over the stored songs together with their progressions.
+
+        Parameters:
+        - genre (str): Genre of songs to read, or None for all genres.
+        - after (int): Only read the songs added after the song with this id.
+
+        Returns:
+        - generator: Song data dictionaries with id, song_name, artist, genre, key, mode, year and progression.
+        """
+        query = "SELECT id, song_name, artist, genre, key, mode, year FROM songs WHERE id > ?"
+        params = (after,)
+        if genre is not None:
+            query += " AND genre = ?"
+            params += (genre,)
+        with self.lock:
+            songs = self.connection.execute(query + " ORDER BY id", params).fetchall()
+        for song_id, song_name, artist, song_genre, key, mode, year in songs:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT chords FROM progressions WHERE song_id = ? ORDER BY position", (song_id,)).fetchall()
+            yield {
+                'id': song_id,
+                'song_name': song_name,
+                'artist': artist,
+                'genre': song_genre,
+                'key': key,
+                'mode': mode,
+                'year': year,
+                'progression': [tuple(json.loads(chords)) for (chords,) in rows]
+            }
+
+    @timed('export_csv')
+    def export_csv(self, genre, filename=None):
+        """
+        Export the songs of a genre to a CSV file.
+
+        Parameters:
+        - genre (str): Genre of songs to export.
+        - filename (str): Path to the CSV file, 'output/(genre)_database.csv' by default.
+        """
+        filename = filename or f'output/{genre}_database.csv'
+        try:
+            with open(filename, mode='w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(CSV_FIELDS)
+                for song in self.iter_songs(genre):
+                    writer.writerow([song['song_name'], song['artist'], song['key'], song['mode'],
+                                     song['progression']])
+        except FileNotFoundError:
+            logging.warning("Directory not found!")
+        except PermissionError:
+            logging.error("Permission denied!")
+        except UnicodeEncodeError as e:
+            logging.error(f"Encoding error: {e}")
+
+    def import_csv(self, genre, filename=None):
+        """
+        Import the songs of a genre from a CSV file written by earlier versions of ChordCrawler.
+
+        Parameters:
+        - genre (str): Genre of the songs.
+        - filename (str): Path to the CSV file, 'output/(genre)_database.csv' by default.
+
+        Returns:
+        - int: Number of songs imported.
+        """
+        filename = filename or f'output/{genre}_database.csv'
+        songs = []
+        try:
+            with open(filename, mode='r', encoding='utf-8') as file:
+                for row in csv.reader(file):
+                    if not row or row == CSV_FIELDS:
+                        continue
+                    song_name, artist, key, mode, progression = row
+                    songs.append({'song_name': song_name, 'artist': artist, 'key': int(key), 'mode': int(mode),
+                                  'progression': ast.literal_eval(progression)})
+        except FileNotFoundError:
+            return 0
+        except (ValueError, SyntaxError) as e:
+            logging.error(f"Could not import '{filename}': {e}")
+            return 0
+        return len(self.add_songs(songs, genre))
+
+    def get_songs(self, ids):
+        """
+        Retrieve stored songs by id, without their progressions.
+
+        Parameters:
+        - ids (list): Ids of the songs, such as the results of a progression index query.
+
+        Returns:
+        - list: Song data dictionaries with id, song_name, artist, genre, key, mode and year, ordered by id.
+        """
+        songs = []
+        ids = list(ids)
+        with self.lock:
+            # Stay under SQLite's limit on the number of query parameters
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                songs.extend(self.connection.execute(
+                    f"SELECT id, song_name, artist, genre, key, mode, year FROM songs WHERE id IN "
+                    f"({', '.join('?' * len(chunk))})", chunk))
+        return [{'id': song_id, 'song_name': song_name, 'artist': artist, 'genre': genre, 'key': key, 'mode': mode,
+                 'year': year} for song_id, song_name, artist, genre, key, mode, year in sorted(songs)]
+
+    def close(self):
+        """Close the database, writing the songs buffered by the progression index, and the chord archive."""
+        with self.lock:
+            if self.index is not None:
+                self.index.close()
+            if self.archive is not None:
+                self.archive.close()
+            self.connection.close()
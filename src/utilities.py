@@ -2,9 +2,10 @@ import csv
 import logging
 import traceback
 import random
+import aiohttp
 from selenium import webdriver
 from selenium.common.exceptions import WebDriverException
-from src.spotify_api import fetch_songs
+from src.spotify_api import save_songs, stream_songs
 
 
 def read_csv(filename):
@@ -35,34 +36,16 @@ def read_csv(filename):
         return []
 
 
-def write_csv(song_data, genre):
+def get_user_preference(audio_features=True):
     """
-    Write song data to a CSV file based on genre.
+    Prompt the user for various preferences including genre, delay, and song fetching options.
 
     Parameters:
-    - song_data (dict): Dictionary containing song details.
-    - genre (str): Genre of the song.
-    """
-    filename = f'output/{genre}_database.csv'
-    try:
-        with open(filename, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow([song_data['song_name'], song_data['artist'], song_data['key'], song_data['mode'],
-                             song_data['progression']])
-    except FileNotFoundError:
-        logging.warning("Directory not found!")
-    except PermissionError:
-        logging.error("Permission denied!")
-    except UnicodeEncodeError as e:
-        logging.error(f"Encoding error: {e}")
-
-
-def get_user_preference():
-    """
-    Prompt the user for various preferences including genre, delay, and song fetching options.
+    - audio_features (bool): Look up the key and mode of new songs on Spotify.
 
     Returns:
-    - dict: A dictionary containing the user's preferences including songs, genre, and delay.
+    - dict: A dictionary containing the user's preferences including songs, genre, and delay. Songs fetched from
+      Spotify are a generator that fetches them as they are consumed.
     """
     # Get genre input from the user
     while True:
@@ -73,7 +56,8 @@ def get_user_preference():
     # Get delay input from the user
     while True:
         try:
-            delay = int(input("Enter the delay between songs (in seconds): "))
+            delay = int(input("Enter the minimum delay between requests to Ultimate Guitar "
+                              "(in seconds, 0 for no limit): "))
             if delay >= 0:
                 break
             logging.error("Delay must be a positive integer, please try again.")
@@ -98,7 +82,8 @@ def get_user_preference():
                     break
             except ValueError:
                 logging.error("Please enter a valid year range.")
-        songs = fetch_songs(genre, num_songs, start_year, end_year)
+        # Stream the songs, so scraping starts with the first page of Spotify results
+        songs = save_songs(stream_songs(genre, num_songs, start_year, end_year, audio_features), genre)
     else:
         songs = read_csv(f'./output/spotify_songs_{genre}.csv')
     return {
@@ -147,33 +132,34 @@ def create_driver():
         return None
 
 
-def valid_genre(genre):
+def create_session(limit=8):
     """
-    Check if the provided genre is valid based on a predefined list.
+    Initialize and return a pooled HTTP client for fetching pages without a browser.
+
+    Must be called from within a running event loop.
 
     Parameters:
-    - genre (str): Genre to be checked.
+    - limit (int): Maximum number of simultaneous connections kept in the pool.
 
     Returns:
-    - bool: True if genre is valid, False otherwise.
+    - aiohttp.ClientSession: HTTP client session.
     """
-    genres = read_file('./config/genres.txt')
-    return genre.lower() in genres
+    user_agent = random.choice(read_file('./config/user_agents.txt'))
+    connector = aiohttp.TCPConnector(limit=limit, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=30)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'User-Agent': user_agent})
 
 
-def get_existing_songs(genre):
+def valid_genre(genre):
     """
-    Retrieve existing songs from a CSV file based on genre.
+    Check if the provided genre is valid based on a predefined list.
 
     Parameters:
-    - genre (str): Genre of songs to retrieve.
+    - genre (str): Genre to be checked.
 
     Returns:
-    - set: Set of tuples containing song_name and artist.
+    - bool: True if genre is valid, False otherwise.
     """
-    try:
-        existing_songs = read_csv(f'./output/{genre}_database.csv')
-        return {(song['song_name'], song['artist']) for song in existing_songs}
-    except FileNotFoundError:
-        logging.warning("Directory not found, returning empty set!")
-        return set()
\ No newline at end of file
+    genres = read_file('./config/genres.txt')
+    return genre.lower() in genres
+
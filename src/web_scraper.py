@@ -1,105 +1,247 @@
+import html
+import json
+import re
+import time
+from urllib.parse import quote_plus, urljoin, urlsplit
+import numpy as np
 from selenium.common import TimeoutException
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
-from src.standardize import convert_to_roman
+from src.ngrams import song_ngrams
+from src.extract import DEFAULT_BACKEND, extract_tab
+from src.metrics import timed
+from src.rate_limit import RateLimited, get_host, is_blocked
+from src.standardize import convert_many, parse_capo
 
 WINDOW_SIZE = 4
+BASE_URL = "https://www.ultimate-guitar.com"
+# Ultimate Guitar's search filter value for chord sheets
+CHORDS_TYPE = 300
+STORE_PATTERN = re.compile(r'<div class="js-store" data-content="([^"]*)"')
+UNAVAILABLE_PATTERN = re.compile(r'<h1[^>]*>[^<]*Sorry, this artist')
 
 
-def search_song(driver, song, artist):
+def get_search_url(song, artist, base_url=BASE_URL):
     """
-    Search for a song by a specific artist on Ultimate Guitar and navigate to its page.
+    Build the URL of the chord search results for a song.
 
     Parameters:
-    - driver (WebDriver): Selenium WebDriver object.
     - song (str): Name of the song to search for.
     - artist (str): Name of the artist of the song.
+    - base_url (str): Scheme and host of the site, overridden when replaying recorded pages.
+
+    Returns:
+    - str: URL of the search results page filtered to chords.
+    """
+    return f"{base_url}/search.php?search_type=title&value={quote_plus(f'{artist} {song}')}&type={CHORDS_TYPE}"
+
+
+def extract_store(page):
+    """
+    Extract the JSON store that Ultimate Guitar embeds in the server-rendered HTML.
+
+    Parameters:
+    - page (str): HTML of a search or song page.
 
     Returns:
-    - bool: True if the song was found and navigated to, False otherwise.
+    - dict: Page data of the store, or None if the page has no embedded store.
     """
-    driver.get("https://www.ultimate-guitar.com/")
-    # Wait for the search bar to load
+    match = STORE_PATTERN.search(page)
+    if not match:
+        return None
     try:
-        search_bar = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "input"))
-        )
-    except TimeoutException:
-        return False
-    # Search for the song
-    search_bar.send_keys(f"{artist} {song}")
-    search_bar.send_keys(Keys.ENTER)
-    # Check if song exists
-    if driver.find_elements(By.XPATH, "//h2[contains(text(), 'Nothing found for')]"):
-        return False
-    # Filter out songs that are not chords
+        store = json.loads(html.unescape(match.group(1)))
+    except json.JSONDecodeError:
+        return None
+    return store.get('store', {}).get('page', {}).get('data')
+
+
+def parse_search_results(page):
+    """
+    Read the results of a search page, from its embedded store or else from the rendered result rows.
+
+    Parameters:
+    - page (str): HTML of a search results page.
+
+    Returns:
+    - list: List of dictionaries with the type, number of ratings (votes) and tab_url of every result.
+    """
+    data = extract_store(page)
+    if data is not None:
+        return data.get('results') or []
+    results = []
+    soup = BeautifulSoup(page, 'html.parser')
+    for row in soup.find_all('div', attrs={'class': 'LQUZJ'}):
+        link = row.select_one('a.HT3w5.lBssT')
+        if link is None:
+            continue
+        type_element = row.select_one('div.lIKMM.PdXKy')
+        rating_element = row.select_one('div.djFV9')
+        results.append({
+            'type': type_element.get_text().strip() if type_element else '',
+            # Handle ratings with a comma
+            'votes': int(rating_element.get_text().replace(',', '')) if rating_element else None,
+            'tab_url': link.get('href')
+        })
+    return results
+
+
+def select_result(results):
+    """
+    Select the chord sheet with the most ratings from the results of a search page.
+
+    Parameters:
+    - results (list): Search results from parse_search_results.
+
+    Returns:
+    - dict: Best search result, or None if there are no community chord sheets.
+    """
+    # Filter out results that are not chords, including the "Official" and "Pro" versions
+    chords = [result for result in results
+              if (result.get('type') or 'chords').lower() == 'chords' and not result.get('marketing_type')]
+    if not chords:
+        return None
+    # Results without ratings are only selected when no result has any
+    return max(chords, key=lambda result: -1 if result.get('votes') is None else result['votes'])
+
+
+def rank_search_results(page):
+    """
+    Find the URL of the best chord sheet on a search results page.
+
+    Parameters:
+    - page (str): HTML of a search results page.
+
+    Returns:
+    - str: URL of the best chord sheet, or None if there are no community chord sheets.
+    """
+    if 'Nothing found for' in page:
+        return None
+    result = select_result(parse_search_results(page))
+    return result['tab_url'] if result else None
+
+
+@timed('fetch')
+def navigate(driver, url, limiter=None):
+    """
+    Load a page in the browser, waiting for the rate limit of its host and reporting how the site responded.
+
+    Parameters:
+    - driver (WebDriver): Selenium WebDriver object.
+    - url (str): URL of the page.
+    - limiter (RateLimiter): Optional rate limiter shared by the workers.
+    """
+    host = get_host(url)
+    if limiter:
+        limiter.acquire(host)
+    start = time.monotonic()
     try:
-        chords_button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.LINK_TEXT, "Chords"))
-        )
+        driver.get(url)
     except TimeoutException:
-        return False
-    chords_button.click()
-    # Get a list of all songs
-    songs = driver.find_elements(By.XPATH, "//div[@class='LQUZJ']")
-    # Filter out songs with the type "Official" or "Pro"
-    filtered_songs = [song for song in songs if not any(
-        bad_type in song.find_element(By.XPATH, ".//div[@class='lIKMM PdXKy']").text for bad_type in
-        ["Official", "Pro"])]
-    # If there are songs with ratings, select the one with the highest rating
-    if filtered_songs:
-        highest_rating = -1
-        best_song = None
-        for song in filtered_songs:
-            rating_elements = song.find_elements(By.XPATH, ".//div[@class='djFV9']")
-            if rating_elements:
-                # Handle ratings with a comma
-                rating = int(rating_elements[0].text.replace(',', ''))
-                if rating > highest_rating:
-                    highest_rating = rating
-                    best_song = song
-        if best_song:
-            # Adjust the XPath to be more specific to the song link
-            link = best_song.find_element(By.XPATH, ".//a[contains(@class, 'HT3w5 lBssT')]")
-            driver.execute_script("arguments[0].click();", link)
-        else:
-            # If there are no ratings, click the only song left
-            link = filtered_songs[0].find_element(By.XPATH, ".//a[contains(@class, 'HT3w5 lBssT')]")
-            driver.execute_script("arguments[0].click();", link)
-    else:
-        return False
-    if driver.find_elements(By.XPATH, "//h1[contains(text(), 'Sorry, this artist')]"):
-        return False
-    return True
-
-
-def parse_chords(driver):
-    """
-       Parse the chords of a song from the current page of the provided WebDriver.
+        if limiter:
+            limiter.report(host, None)
+        raise
+    if is_blocked(driver.title):
+        if limiter:
+            limiter.report(host, throttled=True)
+        raise RateLimited(f"Blocked by {host}.")
+    if limiter:
+        limiter.report(host, time.monotonic() - start)
+
+
+def load_page(driver, url, cache=None, limiter=None):
+    """
+    Return the HTML of a song page, from the page cache when possible, navigating to it otherwise.
+
+    Parameters:
+    - driver (WebDriver): Selenium WebDriver object.
+    - url (str): URL of the song page.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter shared by the workers.
+
+    Returns:
+    - str: HTML of the song page, or None if the page is not available.
+    """
+    page = cache.get(url) if cache else None
+    if page is not None:
+        return page
+    navigate(driver, url, limiter)
+    page = driver.page_source
+    if UNAVAILABLE_PATTERN.search(page):
+        return None
+    if cache:
+        cache.put(url, page)
+    return page
+
+
+@timed('search')
+def search_song(driver, song, artist, cache=None, limiter=None, base_url=BASE_URL):
+    """
+    Search for a song by a specific artist on Ultimate Guitar and navigate to its page.
+
+    The browser loads the chord search results directly and the results are ranked from a single snapshot of
+    the page. When a page cache is provided, the search results and song pages are read from it before falling
+    back to the browser, and pages fetched by the browser are added to it.
+
+    Parameters:
+    - driver (WebDriver): Selenium WebDriver object.
+    - song (str): Name of the song to search for.
+    - artist (str): Name of the artist of the song.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter shared by the workers.
+    - base_url (str): Scheme and host of the site, e.g. a local server replaying recorded pages.
+
+    Returns:
+    - tuple: URL and HTML of the song page if the song was found, (None, None) otherwise.
+    """
+    search_url = get_search_url(song, artist, base_url)
+    search_page = cache.get(search_url) if cache else None
+    if search_page is None:
+        navigate(driver, search_url, limiter)
+        search_page = driver.page_source
+        if cache:
+            cache.put(search_url, search_page)
+    tab_url = rank_search_results(search_page)
+    if not tab_url:
+        return None, None
+    # Keep the path of the result but point it at the host we are fetching from
+    tab_url = urljoin(base_url, urlsplit(tab_url).path)
+    page = load_page(driver, tab_url, cache, limiter)
+    return (tab_url, page) if page else (None, None)
+
+
+@timed('tab')
+def get_tab(page_source, backend=DEFAULT_BACKEND):
+    """
+    Read the raw chords and the capo of a song from a single snapshot of its page.
+
+    Parameters:
+    - page_source (str): HTML of a song page, either from a WebDriver or from a cached copy.
+    - backend (str): Name of the extraction backend used to parse the chord sheet.
+
+    Returns:
+    - tuple: List of chord names as written on the page and the fret of the capo.
+    """
+    chords, capo_text = extract_tab(page_source, backend)
+    return chords, parse_capo(capo_text)
+
+
+@timed('parse')
+def parse_chords(chords, window_size=WINDOW_SIZE):
+    """
+       Split the chords of a song into sequences and convert them to Roman numeral notation.
+
+       Sequences are deduplicated, and sequences that repeat a chord back to back or more than twice are dropped.
 
        Parameters:
-       - driver (WebDriver): Selenium WebDriver object positioned on a song page.
+       - chords (list): List of chord names transposed to C Major.
+       - window_size (int): Number of chords in a sequence.
 
        Returns:
        - list: List of chord sequences in Roman numeral notation.
     """
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    body = soup.find('pre', attrs={'class': 'tK8GG Ty_RP'})
-    chords_elements = body.find_all('span', attrs={'data-name': True})
-    chords = [item.get_text().strip() for item in chords_elements]
-    sequences = [tuple(chords[i:i + WINDOW_SIZE]) for i in range(len(chords) - WINDOW_SIZE + 1)]
-    sequences = list(dict.fromkeys(sequences))
-    filtered_sequences = []
-    for seq in sequences:
-        valid = True
-        for chord in seq:
-            if seq.count(chord) > 2 or (chord, chord) in zip(seq, seq[1:]):
-                valid = False
-                break
-        if valid:
-            filtered_sequences.append(seq)
-    roman_numeral_sequences = [tuple(convert_to_roman(list(seq)).split('-')) for seq in sequences]
-    return roman_numeral_sequences
+    if len(chords) < window_size:
+        return []
+    # Encode the chords of the song as small integers
+    symbols, codes = np.unique(np.array(chords), return_inverse=True)
+    windows = song_ngrams(codes, window_size, vocabulary_size=len(symbols))
+    return convert_many(symbols[windows].tolist())
@@ -0,0 +1,298 @@
+import logging
+import queue
+import threading
+from selenium.common.exceptions import WebDriverException
+from src.archive import raw_tab
+from src.journal import DONE, NOT_FOUND, FAILED
+from src.key_estimation import resolve_key
+from src.metrics import count, timed, update_progress
+from src.rate_limit import RateLimited
+from src.standardize import transposer
+from src.utilities import create_driver
+from src.web_scraper import BASE_URL, search_song, get_tab, parse_chords
+
+# Number of times a song is handed to a fresh driver after its driver crashed
+MAX_RESTARTS = 2
+# Maximum number of songs stored in a single transaction
+WRITE_BATCH_SIZE = 50
+# Songs waiting for a worker, per worker, and results waiting for the writer
+SONG_QUEUE_DEPTH = 2
+RESULT_QUEUE_SIZE = 2 * WRITE_BATCH_SIZE
+# Seconds between two checks of the stop event by a blocked stage
+QUEUE_TIMEOUT = 0.5
+
+
+@timed('song')
+def scrape_song(driver, song, cache=None, limiter=None, key_source='spotify', base_url=BASE_URL):
+    """
+    Search, transpose and parse a single song with the provided WebDriver.
+
+    Parameters:
+    - driver (WebDriver): Selenium WebDriver object.
+    - song (dict): Dictionary containing song_name, artist and optionally key and mode.
+    - cache (PageCache): Optional page cache.
+    - limiter (RateLimiter): Optional rate limiter shared by the workers.
+    - key_source (str): Where the key of the song comes from, see resolve_key.
+    - base_url (str): Scheme and host of the site.
+
+    Returns:
+    - tuple: Outcome of the scrape (DONE, NOT_FOUND or FAILED) and the song data ready to be written to the
+      database, or None if the song could not be scraped.
+    """
+    song_name = song['song_name']
+    artist = song['artist']
+    # Search for the song on Ultimate Guitar
+    tab_url, page = search_song(driver, song_name, artist, cache, limiter, base_url)
+    if not page:
+        logging.info(f"Song '{song_name}' by {artist} not available on Ultimate Guitar!")
+        return NOT_FOUND, None
+    # Read the chords and capo from a single snapshot of the song page
+    chords, capo = get_tab(page)
+    key, mode = resolve_key(song, chords, capo, key_source)
+    # Transpose the song to C Major
+    transposed = transposer(chords, key, mode, capo) if key is not None else None
+    if not transposed:
+        logging.error(f"Song '{song_name}' by {artist} could not be transposed!")
+        return FAILED, None
+    return DONE, {
+        'song_name': song_name,
+        'artist': artist,
+        'key': key,
+        'mode': mode,
+        'year': song.get('year'),
+        'progression': parse_chords(transposed),
+        **raw_tab(song, chords, capo, tab_url)
+    }
+
+
+def restart_driver(driver, worker_id):
+    """
+    Quit a crashed WebDriver and start a new one in its place.
+
+    Parameters:
+    - driver (WebDriver): Crashed Selenium WebDriver object, or None.
+    - worker_id (int): Number of the worker owning the driver.
+
+    Returns:
+    - WebDriver: New Selenium WebDriver object, or None if it could not be started.
+    """
+    logging.warning(f"Restarting WebDriver of worker {worker_id}.")
+    if driver is not None:
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+    return create_driver()
+
+
+def put(item_queue, item, stop_event):
+    """
+    Put an item in a bounded queue, waiting for room unless the crawl is interrupted.
+
+    Parameters:
+    - item_queue (Queue): Bounded queue.
+    - item: Item to put in the queue.
+    - stop_event (Event): Event set when the crawl is interrupted.
+
+    Returns:
+    - bool: True if the item was put in the queue, False if the crawl was interrupted first.
+    """
+    while not stop_event.is_set():
+        try:
+            item_queue.put(item, timeout=QUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def feed_songs(songs, song_queue, num_workers, stop_event):
+    """
+    Hand the songs of a stream to the workers, then tell every worker to stop.
+
+    The song queue is bounded, so the stream is only read as fast as the workers scrape.
+
+    Parameters:
+    - songs (iterable): Song dictionaries to scrape.
+    - song_queue (Queue): Bounded queue of song dictionaries, terminated by one None per worker.
+    - num_workers (int): Number of workers reading the queue.
+    - stop_event (Event): Event set when the crawl is interrupted.
+    """
+    try:
+        for song in songs:
+            if not put(song_queue, song, stop_event):
+                return
+    except Exception as e:
+        logging.error(f"Error reading the songs to scrape: {e}")
+    finally:
+        for _ in range(num_workers):
+            put(song_queue, None, stop_event)
+
+
+def scrape_worker(worker_id, song_queue, result_queue, genre, limiter, stop_event, cache=None, journal=None,
+                  key_source='spotify', base_url=BASE_URL):
+    """
+    Scrape songs from a shared queue with a dedicated WebDriver until the queue is drained.
+
+    The workers share a single rate limiter, so adding workers doesn't increase the load on the site beyond
+    what it tolerates.
+
+    Parameters:
+    - worker_id (int): Number of the worker, used in log messages.
+    - song_queue (Queue): Queue of song dictionaries, terminated by None.
+    - result_queue (Queue): Bounded queue receiving (song, outcome, song data or error) tuples, and None once
+      the worker stops.
+    - genre (str): Genre of the songs.
+    - limiter (RateLimiter): Rate limiter shared by the workers.
+    - stop_event (Event): Event set when the crawl is interrupted.
+    - cache (PageCache): Optional page cache shared by the workers.
+    - journal (CrawlJournal): Optional crawl journal, marking the songs in flight.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+    - base_url (str): Scheme and host of the site.
+    """
+    driver = create_driver()
+    try:
+        while not stop_event.is_set():
+            try:
+                song = song_queue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+            if song is None:
+                break
+            if journal:
+                journal.start(song, genre)
+            state, result = FAILED, "WebDriver could not be started"
+            for _ in range(MAX_RESTARTS + 1):
+                if driver is None:
+                    driver = restart_driver(driver, worker_id)
+                    if driver is None:
+                        continue
+                try:
+                    state, result = scrape_song(driver, song, cache, limiter, key_source, base_url)
+                    break
+                except RateLimited as e:
+                    logging.warning(f"Rate limited on song '{song['song_name']}' by {song['artist']}: {e}")
+                    state, result = FAILED, str(e)
+                    break
+                except WebDriverException as e:
+                    logging.error(f"WebDriver of worker {worker_id} crashed on song '{song['song_name']}' "
+                                  f"by {song['artist']}: {e}")
+                    state, result = FAILED, str(e)
+                    driver = restart_driver(driver, worker_id)
+                except Exception as e:
+                    logging.error(f"Error processing song '{song['song_name']}' by {song['artist']}: {e}")
+                    state, result = FAILED, str(e)
+                    break
+            if not put(result_queue, (song, state, result), stop_event):
+                break
+    finally:
+        if driver is not None:
+            driver.quit()
+        put(result_queue, None, stop_event)
+
+
+def write_results(result_queue, database, genre, existing_songs, num_workers, progress=None, journal=None):
+    """
+    Store scraped songs in the database from a single thread, in batched transactions, until every worker has
+    stopped.
+
+    A batch is written once it is full or as soon as no more results are waiting, so songs are never held back
+    while the workers are busy.
+
+    Parameters:
+    - result_queue (Queue): Queue of (song, outcome, song data or error) tuples, and None from every worker
+      that stopped.
+    - database (SongDatabase): Database the songs are stored in.
+    - genre (str): Genre of the songs.
+    - existing_songs (set): Set of (song_name, artist) tuples already in the database, updated in place.
+    - num_workers (int): Number of workers writing to the queue.
+    - progress (tqdm): Optional progress bar advanced once per song.
+    - journal (CrawlJournal): Optional crawl journal recording the outcome of every song.
+    """
+    batch = []
+    running = num_workers
+    try:
+        while running:
+            item = result_queue.get()
+            if item is None:
+                running -= 1
+                continue
+            song, state, result = item
+            count('songs', outcome=state)
+            update_progress(progress)
+            if state == DONE:
+                batch.append(result)
+            elif journal:
+                journal.finish(song, genre, state, result)
+            if len(batch) >= WRITE_BATCH_SIZE or (batch and result_queue.empty()):
+                store_songs(database, batch, genre, existing_songs, journal)
+                batch = []
+    finally:
+        if batch:
+            store_songs(database, batch, genre, existing_songs, journal)
+
+
+@timed('store')
+def store_songs(database, batch, genre, existing_songs, journal=None):
+    """
+    Store a batch of scraped songs in the database and remember them as existing.
+
+    Parameters:
+    - database (SongDatabase): Database the songs are stored in.
+    - batch (list): List of song data dictionaries.
+    - genre (str): Genre of the songs.
+    - existing_songs (set): Set of (song_name, artist) tuples already in the database, updated in place.
+    - journal (CrawlJournal): Optional crawl journal, where the songs are marked as done once stored.
+    """
+    database.add_songs(batch, genre)
+    for song_data in batch:
+        existing_songs.add((song_data['song_name'], song_data['artist']))
+        if journal:
+            journal.finish(song_data, genre, DONE)
+        logging.info(f"Song '{song_data['song_name']}' by {song_data['artist']} has been saved to the "
+                     f"{genre} database.")
+
+
+def run_workers(songs, database, genre, limiter, existing_songs, num_workers=1, progress=None, cache=None,
+                journal=None, key_source='spotify', base_url=BASE_URL):
+    """
+    Scrape songs with a pool of WebDriver workers fed from a shared queue.
+
+    The stages are connected by bounded queues: a feeder thread reads the songs into the song queue, the
+    workers scrape them into the result queue and the calling thread writes the results. A slow stage fills the
+    queue in front of it and holds back the stages feeding it, down to the stream of songs.
+
+    Parameters:
+    - songs (iterable): Song dictionaries to scrape, e.g. a list or a generator streaming them.
+    - database (SongDatabase): Database the songs are stored in.
+    - genre (str): Genre of the songs.
+    - limiter (RateLimiter): Rate limiter shared by the workers.
+    - existing_songs (set): Set of (song_name, artist) tuples already in the database.
+    - num_workers (int): Number of WebDriver workers.
+    - progress (tqdm): Optional progress bar advanced once per song.
+    - cache (PageCache): Optional page cache shared by the workers.
+    - journal (CrawlJournal): Optional crawl journal recording the state of every song.
+    - key_source (str): Where the key of every song comes from, see resolve_key.
+    - base_url (str): Scheme and host of the site.
+    """
+    song_queue = queue.Queue(maxsize=num_workers * SONG_QUEUE_DEPTH)
+    result_queue = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+    stop_event = threading.Event()
+    # The feeder may be blocked reading the stream when the crawl is interrupted, so it is not joined
+    feeder = threading.Thread(target=feed_songs, args=(songs, song_queue, num_workers, stop_event),
+                              name='feeder', daemon=True)
+    feeder.start()
+    workers = [threading.Thread(target=scrape_worker,
+                                args=(i, song_queue, result_queue, genre, limiter, stop_event, cache, journal,
+                                      key_source, base_url),
+                                daemon=True) for i in range(num_workers)]
+    for thread in workers:
+        thread.start()
+    try:
+        write_results(result_queue, database, genre, existing_songs, num_workers, progress, journal)
+    finally:
+        stop_event.set()
+        # Wait for the workers to quit their WebDrivers even when the crawl is interrupted, as daemon threads
+        # would otherwise leave their browsers running when the process exits
+        for thread in workers:
+            thread.join()
@@ -0,0 +1,81 @@
+import pytest
+from src.chords import Chord, parse_chord, parse_roman, to_roman
+from src.standardize import transpose_chord, transposer
+
+PARSED = [
+    ('C', Chord(0, 'major', '', None)),
+    ('F#m7/C#', Chord(6, 'minor', '7', 1)),
+    ('Bbmaj7', Chord(10, 'major', 'maj7', None)),
+    ('CM7', Chord(0, 'major', 'maj7', None)),
+    ('Cmi', Chord(0, 'minor', '', None)),
+    ('Cmi7', Chord(0, 'minor', '7', None)),
+    ('Cmin7', Chord(0, 'minor', '7', None)),
+    ('Cm7b5', Chord(0, 'minor', '7b5', None)),
+    ('Cdim7', Chord(0, 'diminished', '7', None)),
+    ('C°', Chord(0, 'diminished', '', None)),
+    ('Caug', Chord(0, 'augmented', '', None)),
+    ('C+', Chord(0, 'augmented', '', None)),
+    ('Csus4', Chord(0, 'major', 'sus4', None)),
+    ('Cadd9/E', Chord(0, 'major', 'add9', 4)),
+    ('C6/9', Chord(0, 'major', '6/9', None)),
+    ('C6/9/G', Chord(0, 'major', '6/9', 7)),
+    ('Cm6/9', Chord(0, 'minor', '6/9', None)),
+    ('N.C.', None),
+    ('H7', None),
+]
+
+ROMAN = [
+    ('C', 'I'),
+    ('Am', 'vi'),
+    ('Ami', 'vi'),
+    ('Bb', 'bVII'),
+    ('Bdim', 'vii°'),
+    ('Eaug', 'III+'),
+    ('G7/B', 'V7'),
+    ('Fmaj7', 'IVmaj7'),
+    ('C6/9', 'I6/9'),
+    ('Dmi7', 'ii7'),
+]
+
+TRANSPOSED = [
+    ('C', 2, 'D'),
+    ('F#m7/C#', -1, 'Fm7/C'),
+    ('C6/9', 2, 'D6/9'),
+    ('C6/9/G', 5, 'F6/9/C'),
+    ('Cmi', 9, 'Am'),
+    ('Bbmaj7', 2, 'Cmaj7'),
+    ('N.C.', 3, 'N.C.'),
+]
+
+# Songs in A major and F# minor played with G shapes below a capo on the second fret, and without a capo
+TRANSPOSED_SONGS = [
+    (['G', 'D', 'Em', 'C'], 9, 1, 2, ['C', 'G', 'Am', 'F']),
+    (['Em', 'C', 'G', 'D'], 6, 0, 2, ['Am', 'F', 'C', 'G']),
+    (['A', 'E', 'F#m', 'D'], 9, 1, 0, ['C', 'G', 'Am', 'F']),
+]
+
+
+@pytest.mark.parametrize('symbol, expected', PARSED)
+def test_parse_chord(symbol, expected):
+    assert parse_chord(symbol) == expected
+
+
+@pytest.mark.parametrize('symbol, expected', ROMAN)
+def test_to_roman(symbol, expected):
+    assert to_roman(symbol) == expected
+
+
+@pytest.mark.parametrize('symbol, expected', ROMAN)
+def test_parse_roman_round_trip(symbol, expected):
+    chord = parse_chord(symbol)
+    assert parse_roman(expected) == chord._replace(bass=None)
+
+
+@pytest.mark.parametrize('symbol, semitones, expected', TRANSPOSED)
+def test_transpose_chord(symbol, semitones, expected):
+    assert transpose_chord(symbol, semitones) == expected
+
+
+@pytest.mark.parametrize('chords, key, mode, capo, expected', TRANSPOSED_SONGS)
+def test_transposer(chords, key, mode, capo, expected):
+    assert transposer(chords, key, mode, capo) == expected
@@ -0,0 +1,69 @@
+import pytest
+from src.identity import SongIdentityIndex, normalize_artist, normalize_title
+
+TITLES = [
+    ('Song', 'song'),
+    ('Song - Remastered 2011', 'song'),
+    ('Song - 2011 Remaster', 'song'),
+    ('Song (feat. Someone)', 'song'),
+    ('Song [Live]', 'song'),
+    ('Song - Radio Edit', 'song'),
+    ("Don't Stop Me Now", 'dont stop me now'),
+    ('Café del Mar', 'cafe del mar'),
+    ('Rock & Roll', 'rock and roll'),
+    ('Live and Let Die', 'live and let die'),
+    ('With or Without You', 'with or without you'),
+    ('(Live)', 'live'),
+]
+
+ARTISTS = [
+    ('The Beatles', 'beatles'),
+    ('Beatles', 'beatles'),
+    ('The The', 'the'),
+    ('Drake feat. Rihanna', 'drake'),
+    ('Drake ft. Rihanna', 'drake'),
+    ('Drake Featuring Rihanna', 'drake'),
+    ('Simon & Garfunkel', 'simon and garfunkel'),
+    ('Simon and Garfunkel', 'simon and garfunkel'),
+    ('Earth, Wind & Fire', 'earth wind and fire'),
+    ('Tyler, The Creator', 'tyler the creator'),
+    ('AC/DC', 'ac dc'),
+    ('Daft Punk', 'daft punk'),
+    ('Feather', 'feather'),
+    ('Beyoncé', 'beyonce'),
+]
+
+STORED = [('Lose Yourself', 'Eminem'), ('Lightning Crashes', 'Live'), ('Song 1', 'Artist'),
+          ('Simon & Garfunkel Song', 'Simon & Garfunkel'), ('Hey Ya', 'OutKast')]
+
+MATCHES = [
+    ('Lose Yourself', 'Eminem', 'exact'),
+    ('Lose Yourself - Soundtrack Version', 'Eminem', 'exact'),
+    ('Lose Yourself', 'Eminem feat. Someone', 'exact'),
+    ('Simon & Garfunkel Song', 'Simon and Garfunkel', 'exact'),
+    ('Lightening Crashes', 'Live', 'fuzzy'),
+    ('HeyYa', 'OutKast', 'fuzzy'),
+    ('Love Yourself', 'Eminem', None),
+    ('Lose Yourself', 'Someone Else', None),
+    ('Song 2', 'Artist', None),
+    ('Lightning Strikes', 'Live', None),
+    ('Simon & Garfunkel Song', 'Simon', None),
+    ('Song', 'Tyler, The Creator', None),
+]
+
+
+@pytest.mark.parametrize('title, expected', TITLES)
+def test_normalize_title(title, expected):
+    assert normalize_title(title) == expected
+
+
+@pytest.mark.parametrize('artist, expected', ARTISTS)
+def test_normalize_artist(artist, expected):
+    assert normalize_artist(artist) == expected
+
+
+@pytest.mark.parametrize('song_name, artist, expected', MATCHES)
+def test_find(song_name, artist, expected):
+    index = SongIdentityIndex(STORED + [('Song', 'Tyler')])
+    match = index.find(song_name, artist)
+    assert (match[0] if match else None) == expected
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from src.key_estimation import PROFILES, chord_histograms, estimate_key, resolve_key
+
+KEYS = [
+    (['C', 'F', 'G', 'Am'] * 4, 0, 1),
+    (['G', 'C', 'D', 'Em'] * 4, 7, 1),
+    (['Am', 'Dm', 'E', 'Am'] * 4, 9, 0),
+]
+
+
+def correlations(chords):
+    """Correlate the pitch classes of a song with every key profile, without estimate_keys."""
+    histogram = chord_histograms([chords])[0]
+    return np.array([np.corrcoef(histogram, profile)[0, 1] for profile in PROFILES])
+
+
+@pytest.mark.parametrize('chords, key, mode', KEYS)
+def test_estimate_key(chords, key, mode):
+    assert estimate_key(chords)[:2] == (key, mode)
+
+
+def test_confidence_ignores_relative_key():
+    chords = ['C', 'F', 'G', 'Am'] * 4
+    scores = correlations(chords)
+    # C major (0) and its relative A minor (12 + 9) transpose to the same numerals
+    others = np.delete(np.arange(24), [0, 21])
+    runner_up = others[scores[others].argmax()]
+    assert estimate_key(chords)[2] == pytest.approx(scores[0] - scores[runner_up])
+    # The runner-up is F major, not A minor
+    assert runner_up == 5
+
+
+def test_empty_song():
+    assert estimate_key([]) == (0, 1, 0.0)
+
+
+@pytest.mark.parametrize('song, key_source, expected', [
+    ({'key': 2, 'mode': 1}, 'spotify', (2, 1)),
+    ({'key': 2, 'mode': 1}, 'chords', (0, 1)),
+    ({'key': 2, 'mode': 1}, 'auto', (0, 1)),
+    ({'key': None, 'mode': None}, 'spotify', (0, 1)),
+])
+def test_resolve_key(song, key_source, expected):
+    assert resolve_key(song, ['C', 'F', 'G', 'Am'] * 4, 0, key_source) == expected
+
+
+def test_resolve_key_with_capo():
+    # G shapes below a capo on the second fret sound in A major
+    assert resolve_key({}, ['G', 'C', 'D', 'Em'] * 4, 2, 'chords') == (9, 1)
@@ -0,0 +1,60 @@
+import re
+import pytest
+from benchmarks.pages import make_search_page
+from src.web_scraper import extract_store, parse_search_results, rank_search_results, select_result
+
+STORE_DIV_PATTERN = re.compile(r'<div class="js-store"[^>]*></div>')
+
+
+def result(type, votes, name, **extra):
+    return {'type': type, 'votes': votes, 'tab_url': f'https://tabs.ultimate-guitar.com/tab/artist/{name}', **extra}
+
+
+def rows_only(page):
+    """Drop the embedded store of a search page, leaving the rendered result rows."""
+    page = STORE_DIV_PATTERN.sub('', page)
+    assert extract_store(page) is None
+    return page
+
+
+RANKED = [
+    ([result('Chords', 120, 'a'), result('Chords', 3400, 'b'), result('Chords', 15, 'c')], 'b'),
+    ([result('Official', 9000, 'official'), result('Chords', 10, 'a')], 'a'),
+    ([result('Pro', 9000, 'pro'), result('Chords', 10, 'a')], 'a'),
+    ([result('Tab', 9000, 'tab'), result('Chords', 10, 'a')], 'a'),
+    ([result('Chords', 0, 'a'), result('Chords', 0, 'b')], 'a'),
+    ([result('Official', 9000, 'official'), result('Pro', 10, 'pro')], None),
+]
+# Only the embedded store marks promoted results
+MARKETED = [
+    ([result('Chords', 9000, 'marketed', marketing_type='TabPro'), result('Chords', 10, 'a')], 'a'),
+]
+
+
+@pytest.mark.parametrize('results, expected', RANKED + MARKETED)
+def test_rank_search_results_from_store(results, expected):
+    url = rank_search_results(make_search_page(results))
+    assert url == (f'https://tabs.ultimate-guitar.com/tab/artist/{expected}' if expected else None)
+
+
+@pytest.mark.parametrize('results, expected', RANKED)
+def test_rank_search_results_from_rows(results, expected):
+    url = rank_search_results(rows_only(make_search_page(results)))
+    assert url == (f'https://tabs.ultimate-guitar.com/tab/artist/{expected}' if expected else None)
+
+
+def test_parse_search_results_from_rows():
+    page = rows_only(make_search_page([result('Chords', 12345, 'a'), result('Official', 7, 'b')]))
+    assert parse_search_results(page) == [result('Chords', 12345, 'a'), result('Official', 7, 'b')]
+
+
+def test_select_result_without_ratings():
+    results = [result('Chords', None, 'a'), result('Chords', None, 'b')]
+    assert select_result(results)['tab_url'].endswith('/a')
+    # A result with ratings wins over results without any
+    assert select_result(results + [result('Chords', 0, 'c')])['tab_url'].endswith('/c')
+
+
+def test_nothing_found():
+    assert rank_search_results(make_search_page([])) is None
+    assert rank_search_results(rows_only(make_search_page([]))) is None